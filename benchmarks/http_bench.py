@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP压测脚本: 模拟大量并发客户端(keep-alive长连接)持续请求同一接口, 统计requests/s及p50/p99延迟
+仅依赖标准库, 用于对比同步/异步执行模式(config.async_config["enable"])下的吞吐
+
+用法(先分别以同步、异步模式启动服务, 再各跑一次):
+    python benchmarks/http_bench.py --path "/merchant/deal_list?begin_time=2020-01-01T00:00:00&end_time=2020-12-31T00:00:00" \
+        --cookie "x_token=<登录token>" --concurrency 500 --duration 30
+"""
+import time
+import asyncio
+import argparse
+
+
+async def worker(host, port, request, deadline, latencies, errors):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+
+            # 解析响应头, 按Content-Length读取响应体
+            header = await reader.readuntil(b"\r\n\r\n")
+            content_length = 0
+            for line in header.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    content_length = int(line.split(b":")[1])
+            await reader.readexactly(content_length)
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors.append(1)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(args):
+    request = (f"GET {args.path} HTTP/1.1\r\n"
+               f"Host: {args.host}:{args.port}\r\n"
+               f"Cookie: {args.cookie}\r\n"
+               f"Connection: keep-alive\r\n\r\n").encode()
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + args.duration
+    begin = time.perf_counter()
+    await asyncio.gather(*[worker(args.host, args.port, request, deadline, latencies, errors)
+                           for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - begin
+
+    latencies.sort()
+    count = len(latencies)
+    print(f"concurrency: {args.concurrency}, duration: {elapsed:.1f}s, requests: {count}, errors: {len(errors)}")
+    if count:
+        print(f"requests/s: {count / elapsed:.1f}")
+        print(f"p50: {1000 * latencies[int(count * 0.5)]:.1f}ms, "
+              f"p99: {1000 * latencies[min(count - 1, int(count * 0.99))]:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP并发压测")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6035)
+    parser.add_argument("--path", required=True, help="请求路径(含查询参数)")
+    parser.add_argument("--cookie", default="", help="请求Cookie, 如 x_token=xxx")
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--duration", type=int, default=30, help="压测时长(秒)")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+日志微基准: 对比旧模式(inspect.stack() + 同步写文件)与快速模式(直接取栈帧 + 后台线程写文件)每秒可处理的日志调用次数
+日志调用在一定深度的调用栈中发起, 模拟请求处理时的真实栈深度
+
+用法:
+    python benchmarks/log_bench.py --count 20000 --depth 30
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from logging.handlers import TimedRotatingFileHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import MyLogger, formatter, add_file_handler, stop_log_listeners
+
+
+def create_logger(name, log_path, fast_mode, async_write):
+    logger = MyLogger(name, fast_mode)
+    logger.setLevel(logging.DEBUG)
+    fh = TimedRotatingFileHandler(filename=log_path, when='midnight', backupCount=1)
+    fh.setFormatter(formatter)
+    add_file_handler(logger, fh, async_write)
+    return logger
+
+
+def log_at_depth(logger, depth, count):
+    if depth > 0:
+        return log_at_depth(logger, depth - 1, count)
+    start = time.perf_counter()
+    for i in range(count):
+        logger.info(f"Time consuming: {i}ms")
+    return time.perf_counter() - start
+
+
+def bench(name, fast_mode, async_write, args, log_dir):
+    logger = create_logger(name, os.path.join(log_dir, f"{name}.log"), fast_mode, async_write)
+    elapsed = log_at_depth(logger, args.depth, args.count)
+    print(f"{name:<40} {args.count / elapsed:>12.0f} calls/s   ({1e6 * elapsed / args.count:.1f}us/call)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="日志调用微基准")
+    parser.add_argument("--count", type=int, default=20000, help="日志调用次数")
+    parser.add_argument("--depth", type=int, default=30, help="发起日志调用时的调用栈深度")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        bench("legacy (inspect.stack + sync write)", False, False, args, log_dir)
+        bench("fast frame + sync write", True, False, args, log_dir)
+        bench("fast frame + background writer", True, True, args, log_dir)
+        stop_log_listeners()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+商品缓存结构基准: 对比json结构(products哈希存放JSON串)与hash结构(每个商品一个哈希)的
+redis内存占用(按每10万商品折算)、商品列表读取、部分字段读取及单字段更新(下架)的耗时
+使用独立的redis db, 运行前后会清空该db, 请勿指向业务库
+
+用法:
+    python benchmarks/product_cache_bench.py --products 100000 --db 15
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import redis_config, product_cache_config
+from utils import product_cache_util
+
+
+def make_product(product_id, merchant_count):
+    now = datetime.now()
+    return {
+        "id": product_id,
+        "merchant_id": product_id % merchant_count + 1,
+        "product_name": f"商品{product_id}",
+        "product_tag": random.choice(["水果", "食品", "生鲜", "数码", "电器", "洗护"]),
+        "product_cover": f"https://cdn.example.com/products/{product_id}/cover.jpg",
+        "product_desc": "新鲜直达, 当日配送" * 3,
+        "detail_pictures": '["https://cdn.example.com/1.jpg", "https://cdn.example.com/2.jpg"]',
+        "has_stock_limit": 1,
+        "init_stock": 100,
+        "remain_stock": random.randint(0, 100),
+        "price": round(random.uniform(1, 500), 2),
+        "status": 0,
+        "create_time": now,
+        "update_time": now
+    }
+
+
+def used_memory(client):
+    return client.info("memory")["used_memory"]
+
+
+def timeit(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def bench(layout, client, args):
+    product_cache_config["layout"] = layout
+    client.flushdb()
+    base = used_memory(client)
+    for start in range(1, args.products + 1, 1000):
+        product_cache_util.save_products([make_product(product_id, args.merchants)
+                                          for product_id in range(start, min(start + 1000, args.products + 1))])
+    memory = (used_memory(client) - base) * 100000 / args.products
+
+    page_ids = [random.sample(range(1, args.products + 1), args.page_size) for _ in range(args.rounds)]
+    pages = iter(page_ids)
+    list_p50, list_p99 = timeit(lambda: product_cache_util.get_products(next(pages)), args.rounds)
+    pages = iter(page_ids)
+    partial_p50, partial_p99 = timeit(
+        lambda: product_cache_util.get_products(next(pages), ["product_name", "product_cover", "merchant_id"]),
+        args.rounds)
+    update_p50, update_p99 = timeit(
+        lambda: product_cache_util.update_products([make_product(random.randint(1, args.products), args.merchants)],
+                                                   {"status": 1}), args.rounds)
+
+    print(f"{layout:<6} memory/100k: {memory / 1024 / 1024:>8.1f}MB   "
+          f"list({args.page_size}) p50/p99: {list_p50:>7.0f}/{list_p99:<7.0f}us   "
+          f"partial({args.page_size}) p50/p99: {partial_p50:>7.0f}/{partial_p99:<7.0f}us   "
+          f"update p50/p99: {update_p50:>6.0f}/{update_p99:<6.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="商品缓存结构基准")
+    parser.add_argument("--products", type=int, default=100000, help="商品数量")
+    parser.add_argument("--merchants", type=int, default=200, help="商户数量")
+    parser.add_argument("--page-size", type=int, default=50, help="每次读取的商品数")
+    parser.add_argument("--rounds", type=int, default=2000, help="每项测试的执行次数")
+    parser.add_argument("--db", type=int, default=15, help="测试使用的redis db")
+    args = parser.parse_args()
+
+    # 基准使用独立db, 替换product_cache_util使用的客户端
+    client = redis.Redis(host=redis_config["host"], port=redis_config["port"], db=args.db,
+                         password=redis_config["passwd"] or None, decode_responses=True)
+    product_cache_util.redis_client = client
+    product_cache_util.UPDATE_FIELDS_SCRIPT = client.register_script(product_cache_util.UPDATE_FIELDS_SCRIPT.script)
+
+    try:
+        bench("json", client, args)
+        bench("hash", client, args)
+    finally:
+        client.flushdb()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+商品搜索基准: 建立指定数量商品的搜索索引后, 测量常见单字、二字词、多词及带标签/商户/价格过滤的查询耗时,
+分别统计首次查询(扫描索引)与重复查询(命中查询结果缓存)的p50/p99
+使用独立的redis db, 运行前后会清空该db, 请勿指向业务库
+
+用法:
+    python benchmarks/product_search_bench.py --products 1000000 --db 15
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import redis_config
+from utils import product_search_util
+
+TAGS = ["水果", "食品", "生鲜", "数码", "电器", "洗护"]
+# 高频字在前, 按齐普夫分布抽取, 使常见单字的倒排索引接近全量商品
+CHARS = "新鲜有机进口精选特价苹果香蕉橙子牛奶面包大米手机耳机电脑洗发水沐浴露纸巾零食坚果茶叶咖啡"
+WORDS = ["apple", "pro", "max", "mini", "plus", "500g", "1kg", "2024"]
+
+
+def random_text(length):
+    return "".join(CHARS[min(int(random.paretovariate(1.2)) - 1, len(CHARS) - 1)] for _ in range(length))
+
+
+def make_product(product_id, merchant_count):
+    return {
+        "id": product_id,
+        "merchant_id": product_id % merchant_count + 1,
+        "product_name": random_text(random.randint(4, 10)) + " " + random.choice(WORDS),
+        "product_tag": random.choice(TAGS),
+        "product_desc": random_text(random.randint(10, 30)),
+        "price": round(random.uniform(1, 500), 2),
+        "status": random.choice([0, 0, 0, 1])
+    }
+
+
+def build_index(client, args):
+    for start in range(1, args.products + 1, 1000):
+        pipe = client.pipeline(transaction=False)
+        products = [make_product(product_id, args.merchants)
+                    for product_id in range(start, min(start + 1000, args.products + 1))]
+        for product in products:
+            product_search_util.queue_index(pipe, product)
+            pipe.sadd(f"products_of_merchant_{product['merchant_id']}", product["id"])
+        pipe.execute()
+
+
+def timeit(client, query, rounds):
+    """
+    :return: (首次查询p50, p99, 重复查询p50, p99)毫秒
+    """
+    cold, warm = [], []
+    for _ in range(rounds):
+        for key in client.scan_iter(match="search_cache_*", count=1000):
+            client.delete(key)
+        start = time.perf_counter()
+        query()
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        query()
+        warm.append(time.perf_counter() - start)
+    result = []
+    for samples in (cold, warm):
+        samples.sort()
+        result.extend((samples[len(samples) // 2] * 1e3, samples[int(len(samples) * 0.99)] * 1e3))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="商品搜索基准")
+    parser.add_argument("--products", type=int, default=1000000, help="商品数量")
+    parser.add_argument("--merchants", type=int, default=200, help="商户数量")
+    parser.add_argument("--rounds", type=int, default=200, help="每项测试的执行次数")
+    parser.add_argument("--db", type=int, default=15, help="测试使用的redis db")
+    args = parser.parse_args()
+
+    # 基准使用独立db, 替换product_search_util使用的客户端
+    client = redis.Redis(host=redis_config["host"], port=redis_config["port"], db=args.db,
+                         password=redis_config["passwd"] or None, decode_responses=True)
+    product_search_util.redis_client = client
+    product_search_util.SEARCH_SCRIPT = client.register_script(product_search_util.SEARCH_SCRIPT.script)
+
+    queries = {
+        "common char": lambda: product_search_util.search(CHARS[0]),
+        "bigram": lambda: product_search_util.search(CHARS[2:4]),
+        "multi token": lambda: product_search_util.search(f"{CHARS[0]}{CHARS[1]} {WORDS[0]}"),
+        "tag+status": lambda: product_search_util.search(CHARS[0], tag=TAGS[0], status=0),
+        "merchant": lambda: product_search_util.search(CHARS[0], merchant_id=1),
+        "price range": lambda: product_search_util.search(CHARS[2:4], min_price=100, max_price=200),
+        "page 10": lambda: product_search_util.search(CHARS[0], offset=200, count=20)
+    }
+    try:
+        client.flushdb()
+        start = time.perf_counter()
+        build_index(client, args)
+        print(f"indexed {args.products} products in {time.perf_counter() - start:.1f}s, "
+              f"memory: {client.info('memory')['used_memory'] / 1024 / 1024:.1f}MB")
+        for name, query in queries.items():
+            total, _ = query()
+            cold_p50, cold_p99, warm_p50, warm_p99 = timeit(client, query, args.rounds)
+            print(f"{name:<12} total: {total:>6}   cold p50/p99: {cold_p50:>7.2f}/{cold_p99:<7.2f}ms   "
+                  f"cached p50/p99: {warm_p50:>6.2f}/{warm_p99:<6.2f}ms")
+    finally:
+        client.flushdb()
@@ -2,6 +2,32 @@
 app_log_path = "logs/app.log"
 msg_log_path = "logs/msg.log"
 
+# 日志配置: fast_mode直接读取调用方栈帧获取文件名及行号(不再调用inspect.stack()),
+# async_write将日志记录投递到队列, 由后台线程写文件, 文件I/O不再阻塞请求线程
+log_config = {
+    "fast_mode": True,
+    "async_write": True
+}
+
+
+# 接口日志(decorators.log_filter)配置: 慢请求(超过slow_threshold_ms)及异常请求全量记录,
+# 其余请求按采样率记录且Args/Response最多记录max_payload个字符,
+# route_sample_rates可按接口函数("模块.函数名", 同名函数存在于多个路由模块中)单独指定采样率
+log_filter_config = {
+    "sample_rate": 1.0,
+    "max_payload": 2048,
+    "slow_threshold_ms": 500,
+    "route_sample_rates": {
+        "handlers.merchant_handler.get_deal_list": 0.1,
+        "handlers.merchant_handler.get_product_list": 0.1,
+        "handlers.admin_handler.get_total_deal_list": 0.1,
+        "handlers.express_handler.get_deals_to_delivery": 0.1,
+        "handlers.async_handler.get_deal_list": 0.1,
+        "handlers.async_handler.get_product_list": 0.1,
+        "handlers.async_handler.get_total_deal_list": 0.1,
+        "handlers.async_handler.get_deals_to_delivery": 0.1
+    }
+}
 
 db_config = {
     "host": "127.0.0.1",
@@ -27,9 +53,20 @@ app_config = {
     "host": "127.0.0.1"
 }
 
+# 异步执行模式: 开启后deal_list、product_list等高频轮询接口使用async def版本(aiomysql + redis.asyncio), 不再占用线程池
+async_config = {
+    "enable": False,
+    "db_driver": "aiomysql",        # 可选 aiomysql、asyncmy
+    "db_pool_size": 16,
+    "db_max_overflow": 16,
+    "redis_max_connections": 128
+}
+
+# WebSocket Server: report_interval为上报本进程在线连接数的间隔(秒)
 socket_config = {
     "host": "127.0.0.1",
-    "port": 6789
+    "port": 6789,
+    "report_interval": 10
 }
 
 cos_config = {
@@ -45,6 +82,142 @@ SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
+# 已校验token缓存: 命中时跳过jwt签名校验, 条目在token的exp时刻过期
+token_cache_config = {
+    "max_size": 10000
+}
+
+# bcrypt密码哈希专用进程池: workers为进程数, queue_size为允许排队的最大请求数,
+# queue_timeout为排队等待上限(秒), 超过则快速失败, timeout为单次哈希计算上限(秒)
+# 等待哈希结果的请求会占用处理同步接口的线程池(默认40个线程), workers + queue_size须远小于线程池大小
+password_hash_config = {
+    "workers": 2,
+    "queue_size": 8,
+    "queue_timeout": 0.5,
+    "timeout": 5
+}
+
+# 订单计数桶: reconcile_days为定时校正最近几天(不含当天)的计数桶, reconcile_interval为校正间隔(秒), expire_days为计数桶保留天数,
+# sweep_days为每次校正时轮流重新统计的更早计数桶天数(400天约需57个校正周期, 即约9.5小时覆盖一轮)
+deal_counter_config = {
+    "reconcile_days": 2,
+    "sweep_days": 7,
+    "reconcile_interval": 600,
+    "expire_days": 400
+}
+
+# 订单销量汇总表: interval为汇总任务执行间隔(秒), settle_seconds为小时结束后等待迟到订单写入的时间(秒),
+# batch_hours为单批汇总的最大小时数(首次回填历史数据时分批执行)
+deal_rollup_config = {
+    "interval": 300,
+    "settle_seconds": 300,
+    "batch_hours": 24 * 31
+}
+
+# 实时销量: tail_interval为增量读取新订单的间隔(秒), batch_size为每批读取的订单数, reconcile_interval为按数据库重新统计当天计数的间隔(秒),
+# push_interval为WebSocket合并推送增量的间隔(秒), expire_days为计数保留天数
+live_sales_config = {
+    "tail_interval": 1,
+    "batch_size": 1000,
+    "reconcile_interval": 300,
+    "push_interval": 1,
+    "expire_days": 2
+}
+live_sales_topic = "live_sales"
+
+# 订单导出: max_concurrency为同时进行的导出任务数上限, batch_size为服务端游标每次拉取的行数,
+# net_write_timeout为导出连接等待客户端读取数据的超时时间(秒), 避免下载较慢时MySQL中断连接
+export_config = {
+    "max_concurrency": 2,
+    "batch_size": 1000,
+    "net_write_timeout": 600
+}
+
+# 商品缓存存储结构: json(products哈希存放商品JSON串), hash(每个商品一个哈希product_{id}),
+# dual(迁移期间双写, 优先读hash结构, 未命中时读json结构), 迁移步骤: json -> dual(执行迁移) -> hash
+product_cache_config = {
+    "layout": "json"
+}
+
+# 商户商品索引: query_cache_seconds为带过滤条件的分页查询结果缓存时间(秒), 商品变更后缓存立即失效
+product_index_config = {
+    "query_cache_seconds": 60
+}
+
+# 商品搜索: max_query_tokens为单次查询最多使用的查询词数, max_scan为单次查询最多扫描的候选商品数(最小的查询词索引按权重倒序),
+# cache_seconds为查询结果缓存时间(秒), 缓存期间商品变更不会反映到该查询的结果中
+product_search_config = {
+    "max_query_tokens": 16,
+    "max_scan": 5000,
+    "cache_seconds": 30
+}
+
+# 商品分面计数: reconcile_interval为按数据库校正计数的间隔(秒)
+product_facet_config = {
+    "reconcile_interval": 600
+}
+
+# 商品库存: reservation_seconds为库存预留有效期(秒), 超时未确认的预留由定时任务每expire_interval秒释放一次,
+# write_back_interval为售出数量合并回写数据库的间隔(秒), lock_seconds为回写锁过期时间(秒), 应大于单次回写耗时,
+# batch_retention_days为回写批次记录(用于跳过重复回写)的保留天数
+stock_config = {
+    "reservation_seconds": 900,
+    "expire_interval": 5,
+    "write_back_interval": 2,
+    "lock_seconds": 60,
+    "batch_retention_days": 7
+}
+
+# 营销活动调度: tick_interval为推进活动状态(开始时预热缓存, 结束时清理缓存)的间隔(秒),
+# ended_retry_seconds为结束多久内的活动仍检查并重试清理缓存(秒)
+activity_schedule_config = {
+    "tick_interval": 1,
+    "ended_retry_seconds": 300
+}
+
+# 商品批量导入: batch_size为每批写入数据库及redis的商品数, max_rows为单个文件最多导入的商品数
+product_import_config = {
+    "batch_size": 500,
+    "max_rows": 10000
+}
+
+# 缓存投影(outbox): batch_size为每批投影的事件数, poll_interval为未被唤醒时检查待投影事件的间隔(秒),
+# lock_seconds为投影锁过期时间(秒), 每批投影前续期, 应大于单批投影耗时
+cache_outbox_config = {
+    "batch_size": 500,
+    "poll_interval": 1,
+    "lock_seconds": 30
+}
+
+# 缓存重建: workers为并行进程数, shard_size为每个分片的商品id区间大小, batch_size为每批读取及写入redis的记录数,
+# on_startup为启动时检测到缓存未建立(redis被清空或首次上线)是否自动在后台重建
+cache_rebuild_config = {
+    "workers": 4,
+    "shard_size": 100000,
+    "batch_size": 1000,
+    "on_startup": True
+}
+
+# 商户目录: rating_interval为按评价数据重新计算商户平均星级的间隔(秒)
+merchant_directory_config = {
+    "rating_interval": 60
+}
+
+# 商户信息进程内缓存(L1), ttl为兜底过期时间(秒), 商户信息变更时通过merchant_cache_topic通知各进程失效
+merchant_cache_config = {
+    "max_size": 10000,
+    "ttl": 600
+}
+merchant_cache_topic = "merchant_cache_invalidation"
+
+# 商品活动折扣进程内缓存: 参加活动的商品随活动结束过期, ttl为未参加活动的商品的缓存时间(秒),
+# 活动商品或折扣变更时通过price_cache_topic通知各进程失效
+price_config = {
+    "max_size": 100000,
+    "ttl": 300
+}
+price_cache_topic = "price_cache_invalidation"
+
 # merchants_listener_topic用于通知商户后端接收新消息， merchants_message_queue作为商户后端消息队列
 merchants_listener_topic = "merchants_listener"
 merchants_message_queue = "merchants_message_queue"
@@ -17,12 +17,27 @@ DealStatusDesc = {
     5: "已完成"
 }
 
+"快递公司订单状态流转规则: 目标状态 -> 允许变更到该状态的原状态列表"
+ExpressDealTransitions = {
+    3: [1],     # 快递公司接单: 待派送 -> 派送中
+    4: [1, 3],  # 快递公司拒绝派送: 待派送/派送中 -> 快递公司已拒绝派送
+    5: [3]      # 快递公司完成派送: 派送中 -> 已完成
+}
+
+"商户订单状态流转规则: 目标状态 -> 允许变更到该状态的原状态列表"
+MerchantDealTransitions = {
+    5: [2]      # 用户上门领取: 待上门领取 -> 已完成
+}
+
 "商品状态描述"
 ProductStatusDesc = {
     0: "售卖中",
     1: "已下架"
 }
 
+"商品分类标签"
+ProductTags = ["水果", "食品", "生鲜", "数码", "电器", "洗护", "男装", "女装", "鞋靴", "母婴", "保健", "医药", "百货", "其它"]
+
 
 def get_activity_status_desc(now, begin_time, end_time):
     """
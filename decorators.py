@@ -1,25 +1,89 @@
 # -*- coding: utf-8 -*-
 import time
+import random
+import inspect
+import logging
 from functools import wraps
 
+from config import log_filter_config
 from utils import app_logger as logger
 
 
-def log_filter(func):
+class LazyStr:
+    """
+    延迟格式化: 只有日志真正输出时才将对象转为字符串, max_len不为None时截断
+    """
+    __slots__ = ("obj", "max_len")
+
+    def __init__(self, obj, max_len=None):
+        self.obj = obj
+        self.max_len = max_len
+
+    def __str__(self):
+        text = str(self.obj)
+        if self.max_len is not None and len(text) > self.max_len:
+            return f"{text[:self.max_len]}...(truncated, total {len(text)} chars)"
+        return text
+
+
+def log_call(func_name, kwargs, rsp, elapsed_ms, sample_rate, max_payload):
+    """
+    记录接口调用日志, 慢请求及处理失败(ret_code非0)的请求全量记录, 其余请求按采样率记录并截断
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    failed = isinstance(rsp, dict) and rsp.get("ret_code", 0) != 0
+    if failed or elapsed_ms >= log_filter_config["slow_threshold_ms"]:
+        max_len = None
+    elif random.random() < sample_rate:
+        max_len = max_payload
+    else:
+        return
+    logger.info(f"=============  Begin: {func_name}  =============")
+    logger.info("Args: %s", LazyStr(kwargs, max_len))
+    logger.info("Response: %s", LazyStr(rsp, max_len))
+    logger.info(f"Time consuming: {elapsed_ms}ms")
+    logger.info(f"=============   End: {func_name}   =============\n")
+
+
+def log_filter(func=None, *, sample_rate=None, max_payload=None):
+    """
+    接口日志装饰器, 可直接使用 @log_filter, 也可指定参数 @log_filter(sample_rate=0.1, max_payload=512)
+    :param sample_rate: 非慢请求的日志采样率, 不传则取log_filter_config配置
+    :param max_payload: 采样日志中Args/Response的最大字符数, 不传则取log_filter_config配置
+    """
+    if func is None:
+        return lambda f: log_filter(f, sample_rate=sample_rate, max_payload=max_payload)
+
+    if sample_rate is None:
+        # 按"模块.函数名"查找, 不同路由模块中的同名接口函数互不影响
+        sample_rate = log_filter_config["route_sample_rates"].get(f"{func.__module__}.{func.__qualname__}",
+                                                                  log_filter_config["sample_rate"])
+    if max_payload is None:
+        max_payload = log_filter_config["max_payload"]
+
+    # async def 接口需要返回协程函数, 否则FastAPI会将其当作同步函数放入线程池执行
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = 1000 * time.time()
+            try:
+                rsp = await func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"{func.__name__} Args: {kwargs}, Error: {repr(e)}")
+                raise e
+            log_call(func.__name__, kwargs, rsp, 1000 * time.time() - start, sample_rate, max_payload)
+            return rsp
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         start = 1000 * time.time()
-        logger.info(f"=============  Begin: {func.__name__}  =============")
-        logger.info(f"Args: {kwargs}")
         try:
             rsp = func(*args, **kwargs)
-            logger.info(f"Response: {rsp}")
-            end = 1000 * time.time()
-            logger.info(f"Time consuming: {end - start}ms")
-            logger.info(f"=============   End: {func.__name__}   =============\n")
-            return rsp
         except Exception as e:
-            logger.error(repr(e))
+            logger.error(f"{func.__name__} Args: {kwargs}, Error: {repr(e)}")
             raise e
+        log_call(func.__name__, kwargs, rsp, 1000 * time.time() - start, sample_rate, max_payload)
+        return rsp
     return wrapper
-
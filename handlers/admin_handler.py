@@ -2,23 +2,24 @@
 """
 管理员模块
 """
-import json
 from typing import List
 from datetime import datetime
 
-from sqlalchemy import func
 from sqlalchemy.orm import Session
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 
 from decorators import log_filter
 from utils.redis_util import redis_client
-from utils.security_util import get_login_merchant
-from utils.json_encoder import JsonEncoder
-from utils import app_logger as logger
-from consts import MerchantTypeDesc, DealStatusDesc
+from utils.security_util import get_login_merchant, get_current_merchant
+from utils import app_logger as logger, merchant_cache_util, deal_counter_util, deal_rollup_util, \
+    deal_state_util, export_util, outbox_util, activity_schedule_util, merchant_directory_util
+from consts import MerchantTypeDesc, DealStatusDesc, MerchantDealTransitions
 from handlers import make_response
 from utils.db_util import create_session
+from utils.pagination_util import page_deals, next_deal_cursor
 from models.merchant import Merchant
 from models.deal import Deal
 from models.evaluation import Evaluation
@@ -37,13 +38,17 @@ class ActivityModel(BaseModel):
 
 @router.get("/merchant_list")
 @log_filter
-def get_merchant_list(page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
-                      merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+def get_merchant_list(page_no: int = Query(1, gt=0), page_size: int = Query(20, gt=0, le=100),
+                      sort_by: str = Query("create_time", regex="^(create_time|rating|sales)$"), desc: bool = True,
+                      merchant_id: int = Depends(get_login_merchant),
+                      cur_merchant: dict = Depends(get_current_merchant)):
     """
-    拉取已接入商户列表(仅管理员有权限) \n
+    拉取已接入商户列表(仅管理员有权限, 读取商户目录) \n
     :param page_no: 当前页码\n
     :param page_size: 页面大小\n
-    :return:
+    :param sort_by: 排序字段 create_time: 注册时间, rating: 平均星级, sales: 近30天订单数量, 默认create_time\n
+    :param desc: 是否倒序, 默认是\n
+    :return: 商户列表, 含stars(平均星级)、sales(近30天订单数量)、product_count(商品数)
     """
     ret_code = 0
     ret_msg = "success"
@@ -52,37 +57,15 @@ def get_merchant_list(page_no: int = Query(1, gt=-1), page_size: int = Query(20,
         "merchant_list": []
     }
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
-            session.commit()
             return make_response(-1, "权限不足!")
 
-        merchants = session.query(Merchant).filter(Merchant.id != merchant_id, Merchant.status == 1)
-        ret_data["total_count"] = merchants.count()
-        merchants = merchants.order_by(-Merchant.create_time).offset((page_no - 1) * page_size).limit(page_size)
-
-        # 查评价星级 evaluation_stars存储商户得星总数  evaluation_times被评星次数
-        evaluation_stars = redis_client.hmget("evaluation_stars", [merchant.id for merchant in merchants])
-        evaluation_times = redis_client.hmget("evaluation_times", [merchant.id for merchant in merchants])
-        merchant_list = []
-        for i in range(merchants.count()):
-            merchant = merchants[i]
-            merchant_detail = merchant.to_dict()
-            merchant_detail.pop("password")
-            merchant_detail.pop("status")
+        ret_data["total_count"], merchant_list = merchant_directory_util.list_merchants(
+            sort_by, desc, (page_no - 1) * page_size, page_size, exclude_id=merchant_id)
+        for merchant_detail in merchant_list:
             merchant_detail["merchant_type"] = MerchantTypeDesc.get(merchant_detail["merchant_type"])
-
-            stars = evaluation_stars[i]
-            times = evaluation_times[i]
-            if stars is None:
-                merchant_detail["stars"] = 4  # 初始星级默认为4
-            else:
-                merchant_detail["stars"] = float(stars) / int(times)
-            merchant_list.append(merchant_detail)
         ret_data["merchant_list"] = merchant_list
-        session.commit()
     except Exception as e:
-        session.rollback()
         logger.error(str(e))
         ret_code = -1
         ret_msg = str(e)
@@ -92,6 +75,7 @@ def get_merchant_list(page_no: int = Query(1, gt=-1), page_size: int = Query(20,
 @router.get("/merchant_detail")
 @log_filter
 def get_merchant_detail(target_merchant_id: int, merchant_id: int = Depends(get_login_merchant),
+                        cur_merchant: dict = Depends(get_current_merchant),
                         session: Session = Depends(create_session)):
     """
     查看商户详情\n
@@ -102,7 +86,6 @@ def get_merchant_detail(target_merchant_id: int, merchant_id: int = Depends(get_
     ret_msg = "success"
     ret_data = {}
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
@@ -135,6 +118,7 @@ def get_merchant_detail(target_merchant_id: int, merchant_id: int = Depends(get_
 @router.delete("/delete_merchant")
 @log_filter
 def delete_merchant(target_merchant_id: int, merchant_id: int = Depends(get_login_merchant),
+                    cur_merchant: dict = Depends(get_current_merchant),
                     session: Session = Depends(create_session)):
     """
     删除商户(仅管理员有权限)\n
@@ -145,13 +129,15 @@ def delete_merchant(target_merchant_id: int, merchant_id: int = Depends(get_logi
     ret_msg = "success"
 
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
-        merchant = session.query(Merchant).filter(Merchant.id == target_merchant_id)
+        merchant = session.query(Merchant).filter(Merchant.id == target_merchant_id).one_or_none()
+        if merchant is None:
+            session.commit()
+            return make_response(-1, "商户不存在!")
         session.delete(merchant)
-        redis_client.hdel("merchants", merchant.id)
+        outbox_util.record_merchants(session, [target_merchant_id])
         # todo 删除商户下商品、商户对应评价信息
         session.commit()
     except Exception as e:
@@ -166,6 +152,7 @@ def delete_merchant(target_merchant_id: int, merchant_id: int = Depends(get_logi
 @log_filter
 def get_apply_list(page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
                    apply_status: int = Query(..., gt=-1, lt=3), merchant_id: int = Depends(get_login_merchant),
+                   cur_merchant: dict = Depends(get_current_merchant),
                    session: Session = Depends(create_session)):
     """
     拉取接申请列表\n
@@ -181,7 +168,6 @@ def get_apply_list(page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt
         "apply_list": []
     }
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
@@ -209,7 +195,8 @@ def get_apply_list(page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt
 @router.put("/handle_apply")
 @log_filter
 def handle_apply(target_merchant_id: int, handle_status: int = Query(..., gt=0, lt=3),
-                 merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+                 merchant_id: int = Depends(get_login_merchant),
+                 cur_merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
     """
     处理商户接入申请
     :param target_merchant_id: 待接入
@@ -219,7 +206,6 @@ def handle_apply(target_merchant_id: int, handle_status: int = Query(..., gt=0,
     ret_code = 0
     ret_msg = "success"
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
@@ -228,8 +214,7 @@ def handle_apply(target_merchant_id: int, handle_status: int = Query(..., gt=0,
             session.commit()
             return make_response(-1, "申请不存在!")
         merchant.status = handle_status
-        if handle_status == 1:
-            redis_client.hset("merchants", merchant.id, json.dumps(merchant.to_dict(), cls=JsonEncoder))
+        outbox_util.record_merchants(session, [target_merchant_id])
         session.commit()
     except Exception as e:
         session.rollback()
@@ -242,12 +227,14 @@ def handle_apply(target_merchant_id: int, handle_status: int = Query(..., gt=0,
 @router.get("/deal_list")
 @log_filter
 def get_total_deal_list(begin_time: datetime, end_time: datetime, deal_status: int = Query(None, gt=-1, lt=5),
-                        page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
-                        merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+                        page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1), cursor: str = None,
+                        merchant_id: int = Depends(get_login_merchant),
+                        cur_merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
     """
     查询商城begin_time到end_time时间段内全部订单列表(仅管理员可见)\n
     :param page_no: 当前页码 （不传默认为1）\n
     :param page_size: 页面大小 （不传默认为20）\n
+    :param cursor: 分页游标(上一页返回的next_cursor), 传入时忽略page_no, 按游标翻页\n
     :param begin_time: 起始时间\n
     :param end_time: 结束时间\n
     :param deal_status: 订单状态 0: 待支付  1: 待派送 2: 待上门领取 3: 派送中 4: 已完成， 不传则拉取全部\n
@@ -257,10 +244,10 @@ def get_total_deal_list(begin_time: datetime, end_time: datetime, deal_status: i
     ret_msg = "success"
     ret_data = {
         "total_count": 0,
-        "deal_list": []
+        "deal_list": [],
+        "next_cursor": None
     }
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
@@ -270,8 +257,11 @@ def get_total_deal_list(begin_time: datetime, end_time: datetime, deal_status: i
             deals = session.query(Deal).filter(Deal.create_time.between(begin_time, end_time),
                                                Deal.deal_status == deal_status)
 
-        ret_data["total_count"] = deals.count()
-        deals = deals.order_by(-Deal.create_time).offset((page_no - 1) * page_size).limit(page_size)
+        # 总数由订单计数桶统计, 不再对整个时间段执行COUNT
+        ret_data["total_count"] = deal_counter_util.count_deals(session, begin_time, end_time,
+                                                                statuses=None if deal_status is None else [deal_status])
+        deals = page_deals(deals, page_no, page_size, cursor).all()
+        ret_data["next_cursor"] = next_deal_cursor(deals, page_size)
         deal_list = []
         for deal in deals:
             deal_info = deal.to_dict()
@@ -288,9 +278,74 @@ def get_total_deal_list(begin_time: datetime, end_time: datetime, deal_status: i
     return make_response(ret_code, ret_msg, ret_data)
 
 
+@router.get("/deal_status_counts")
+@log_filter
+def get_total_deal_status_counts(begin_time: datetime, end_time: datetime, merchant_id: int = Depends(get_login_merchant),
+                                 cur_merchant: dict = Depends(get_current_merchant),
+                                 session: Session = Depends(create_session)):
+    """
+    查询商城begin_time到end_time时间段内各状态订单数量(订单管理页状态角标, 仅管理员可见)\n
+    :param begin_time: 起始时间\n
+    :param end_time: 结束时间\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = []
+    try:
+        if cur_merchant["merchant_type"] != 0:
+            session.commit()
+            return make_response(-1, "权限不足!")
+        status_counts = deal_counter_util.get_status_counts(session, begin_time, end_time)
+        ret_data = [{"deal_status": status, "status_desc": desc, "count": status_counts[status]}
+                    for status, desc in DealStatusDesc.items()]
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@router.get("/export_deals")
+@log_filter
+def export_deals(begin_time: datetime, end_time: datetime, deal_status: int = Query(None, gt=-1, lt=6),
+                 target_merchant_id: int = None, file_format: str = Query("csv", regex="^(csv|ndjson)$"),
+                 expand_content: bool = False, item_fields: str = "product_id,product_name,count,price,discount",
+                 merchant_id: int = Depends(get_login_merchant), cur_merchant: dict = Depends(get_current_merchant)):
+    """
+    流式导出begin_time到end_time时间段内的订单(仅管理员有权限)\n
+    :param begin_time: 起始时间\n
+    :param end_time: 结束时间\n
+    :param deal_status: 订单状态, 不传则导出全部\n
+    :param target_merchant_id: 商户id, 不传则导出全部商户\n
+    :param file_format: 导出格式 csv/ndjson, 默认csv\n
+    :param expand_content: 是否将订单内容展开为商品明细(每个商品一行)\n
+    :param item_fields: 展开为CSV时输出的明细字段, 逗号分隔\n
+    :return: 订单文件
+    """
+    # 不依赖create_session: 响应流式输出期间不占用接口连接池中的连接, 导出使用独立连接
+    if cur_merchant["merchant_type"] != 0:
+        return make_response(-1, "权限不足!")
+    # 原子地占用导出名额, 导出生成器结束或响应发送完成时释放(生成器未开始迭代时不会执行其finally)
+    slot = export_util.acquire_slot()
+    if slot is None:
+        return make_response(-1, "导出任务过多, 请稍后重试!")
+    fields = tuple(field.strip() for field in item_fields.split(",") if field.strip())
+    chunks = export_util.export_deals(slot, begin_time, end_time, file_format, deal_status, target_merchant_id,
+                                      expand_content, fields)
+    file_name = f"deals_{begin_time.strftime('%Y%m%d%H%M%S')}_{end_time.strftime('%Y%m%d%H%M%S')}.{file_format}"
+    media_type = "text/csv; charset=utf-8" if file_format == "csv" else "application/x-ndjson"
+    # 同步生成器由starlette在线程池中迭代, 不阻塞事件循环
+    return StreamingResponse(chunks, media_type=media_type, background=BackgroundTask(slot.release),
+                             headers={"Content-Disposition": f"attachment; filename={file_name}"})
+
+
 @router.get("/sale_statistics")
 @log_filter
 def get_sale_statistics(begin_time: datetime, end_time: datetime, merchant_id: int = Depends(get_login_merchant),
+                        cur_merchant: dict = Depends(get_current_merchant),
                         session: Session = Depends(create_session)):
     """
     获取商城begin_time到end_time时间段内销量统计，含商城订单总数量、总金额，及各商户订单数量、金额分布(仅管理员有权限)\n
@@ -307,33 +362,25 @@ def get_sale_statistics(begin_time: datetime, end_time: datetime, merchant_id: i
     }
 
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
-        statistics = session.query(
-            Deal.merchant_id.label("merchant_id"),
-            func.count(Deal.deal_no).label("deal_amount"),
-            func.sum(Deal.money).label("total_money"),
-        ).filter(
-            Deal.create_time.between(begin_time, end_time)
-        ).group_by(Deal.merchant_id)
-
-        merchant_infos = redis_client.hgetall("merchants")
-        logger.info(f"商户列表: {merchant_infos}")
+        # 完整天/小时读取销量汇总表, 仅首尾不足一小时及未汇总部分实时统计
+        merchant_statistics = deal_rollup_util.get_sale_statistics(session, begin_time, end_time)
+        merchant_names = merchant_cache_util.get_merchant_names(session, merchant_statistics.keys())
 
         distributions = []
         total_deal_amount = 0
         total_deal_money = 0
-        for statistic in statistics:
-            total_deal_amount += statistic.deal_amount
-            total_deal_money += statistic.total_money
-            merchant_info = json.loads(merchant_infos[str(statistic.merchant_id)])
+        for statistic_merchant_id, (deal_amount, total_money, origin_money) in merchant_statistics.items():
+            total_deal_amount += deal_amount
+            total_deal_money += total_money
             distributions.append({
-                "merchant_id": statistic.merchant_id,
-                "merchant_name": merchant_info["merchant_name"],
-                "deal_amount": statistic.deal_amount,
-                "total_money": statistic.total_money
+                "merchant_id": statistic_merchant_id,
+                "merchant_name": merchant_names.get(statistic_merchant_id, ""),
+                "deal_amount": deal_amount,
+                "total_money": total_money,
+                "total_origin_money": origin_money
             })
         ret_data["total_deal_amount"] = total_deal_amount
         ret_data["total_deal_money"] = total_deal_money
@@ -351,6 +398,7 @@ def get_sale_statistics(begin_time: datetime, end_time: datetime, merchant_id: i
 @log_filter
 def get_merchant_evaluations(target_merchant_id: int, page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
                              merchant_id: int = Depends(get_login_merchant),
+                             cur_merchant: dict = Depends(get_current_merchant),
                              session: Session = Depends(create_session)):
     """
     拉取目标商户的评价列表(仅管理员有权限) \n
@@ -364,7 +412,6 @@ def get_merchant_evaluations(target_merchant_id: int, page_no: int = Query(1, gt
         "evaluation_list": []
     }
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
@@ -393,10 +440,10 @@ def complete_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant),
     ret_code = 0
     ret_msg = "success"
     try:
-        session.query(Deal).filter(Deal.deal_no == deal_no, Deal.merchant_id == merchant_id).update({
-            Deal.deal_status: 5
-        })
-        session.commit()
+        result = deal_state_util.transition_deals(session, [deal_no], 5, MerchantDealTransitions,
+                                                  merchant_id=merchant_id)[0]
+        if not result["success"]:
+            return make_response(-1, result["msg"])
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -411,7 +458,8 @@ class AdvertismentModel(BaseModel):
 
 @router.post("/set_advertisments")
 @log_filter
-def set_advertisments(request: AdvertismentModel, merchant_id: int = Depends(get_login_merchant)):
+def set_advertisments(request: AdvertismentModel, merchant_id: int = Depends(get_login_merchant),
+                      cur_merchant: dict = Depends(get_current_merchant)):
     """
     设置广告位图片\n
     :return:
@@ -419,7 +467,6 @@ def set_advertisments(request: AdvertismentModel, merchant_id: int = Depends(get
     ret_code = 0
     ret_msg = "success"
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             return make_response(-1, "权限不足!")
         redis_client.delete("advertisments")
@@ -433,7 +480,8 @@ def set_advertisments(request: AdvertismentModel, merchant_id: int = Depends(get
 
 @router.post("/get_advertisments")
 @log_filter
-def get_advertisments(merchant_id: int = Depends(get_login_merchant)):
+def get_advertisments(merchant_id: int = Depends(get_login_merchant),
+                      cur_merchant: dict = Depends(get_current_merchant)):
     """
     拉取广告位图片\n
     :return:
@@ -444,7 +492,6 @@ def get_advertisments(merchant_id: int = Depends(get_login_merchant)):
         "advertis_list": []
     }
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             return make_response(-1, "权限不足!")
         ret_data["advertis_list"] = redis_client.lrange("advertisments", 0, -1)
@@ -458,6 +505,7 @@ def get_advertisments(merchant_id: int = Depends(get_login_merchant)):
 @router.post("/add_activity")
 @log_filter
 def add_activity(activity: ActivityModel, merchant_id: int = Depends(get_login_merchant),
+                 cur_merchant: dict = Depends(get_current_merchant),
                  session: Session = Depends(create_session)):
     """
     新建营销活动\n
@@ -467,29 +515,23 @@ def add_activity(activity: ActivityModel, merchant_id: int = Depends(get_login_m
     ret_code = 0
     ret_msg = "success"
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
 
         now = datetime.now()
+        if activity.end_time <= activity.begin_time or activity.end_time <= now:
+            session.commit()
+            return make_response(-1, "活动结束时间须晚于开始时间及当前时间!")
         act = Activity(activity.act_name, activity.act_cover, activity.begin_time, activity.end_time, now, now)
         session.add(act)
-
-        # 活动存入redis并添加商品折扣表
-        activity_key = f"activity_{act.id}"
-        discount_key = f"discount_of_activity_{act.id}"
-        expire_time = (activity.end_time - now).seconds
-        pipe = redis_client.pipeline(transaction=True)
-        pipe.set(activity_key, json.dumps(act.to_dict(), cls=JsonEncoder), ex=expire_time)
-        # 创建一个空的商品折扣表, 插入一条空数据占位符
-        pipe.hset(discount_key, "", "")
-        pipe.expire(discount_key, expire_time)
-        pipe.execute()
-        logger.info("活动redis信息初始化成功!")
-
+        session.flush()
+        act_info = act.to_dict()
         session.commit()
-        logger.info(f"新建营销活动成功，活动id: {act.id}")
+
+        # 提交后写入活动日历及活动缓存(活动信息、空的商品折扣表), 均在活动结束时刻过期
+        activity_schedule_util.schedule(act_info)
+        logger.info(f"新建营销活动成功，活动id: {act_info['id']}")
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -501,6 +543,7 @@ def add_activity(activity: ActivityModel, merchant_id: int = Depends(get_login_m
 @router.delete("/delete_activity")
 @log_filter
 def delete_activity(activity_id: int, merchant_id: int = Depends(get_login_merchant),
+                    cur_merchant: dict = Depends(get_current_merchant),
                     session: Session = Depends(create_session)):
     """
     删除营销活动活动\n
@@ -511,21 +554,15 @@ def delete_activity(activity_id: int, merchant_id: int = Depends(get_login_merch
     ret_msg = "success"
 
     try:
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
 
         session.query(Activity).filter(Activity.id == activity_id).delete()
-        # 删除缓存活动信息、商品折扣表
-        activity_key = f"activity_{activity_id}"
-        discount_key = f"discount_of_activity_{activity_id}"
-        pipe = redis_client.pipeline(transaction=True)
-        pipe.delete(activity_key)
-        pipe.delete(discount_key)
-        pipe.execute()
-        logger.info("删除活动成功!")
         session.commit()
+        # 删除活动日历及活动缓存(活动信息、商品折扣表、商品活动映射)
+        activity_schedule_util.unschedule(activity_id)
+        logger.info("删除活动成功!")
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -537,6 +574,7 @@ def delete_activity(activity_id: int, merchant_id: int = Depends(get_login_merch
 @router.post("/modify_activity")
 @log_filter
 def modify_activity(activity: ActivityModel, merchant_id: int = Depends(get_login_merchant),
+                    cur_merchant: dict = Depends(get_current_merchant),
                     session: Session = Depends(create_session)):
     """
     修改活动信息\n
@@ -547,7 +585,6 @@ def modify_activity(activity: ActivityModel, merchant_id: int = Depends(get_logi
     ret_msg = "success"
     try:
         now = datetime.now()
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 0:
             session.commit()
             return make_response(-1, "权限不足!")
@@ -560,19 +597,20 @@ def modify_activity(activity: ActivityModel, merchant_id: int = Depends(get_logi
             session.commit()
             return make_response(-1, "活动已启动，不允许修改!")
 
-        # 更新缓存
-        activity_key = f"activity_{act.id}"
-        discount_key = f"discount_of_activity_{act.id}"
-        expire_time = (activity.end_time - now).seconds
-        redis_client.set(activity_key, json.dumps(act.to_dict(), cls=JsonEncoder), ex=expire_time)
-        redis_client.expire(discount_key, expire_time)
+        if activity.end_time <= activity.begin_time or activity.end_time <= now:
+            session.commit()
+            return make_response(-1, "活动结束时间须晚于开始时间及当前时间!")
 
         act.act_name = activity.act_name
         act.act_cover = activity.act_cover
         act.begin_time = activity.begin_time
         act.end_time = activity.end_time
         act.update_time = now
+        act_info = act.to_dict()
         session.commit()
+
+        # 提交后按修改后的信息更新活动日历及活动缓存
+        activity_schedule_util.schedule(act_info)
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+异步模块: 高频轮询接口的async def版本(aiomysql + redis.asyncio), 由config.async_config["enable"]控制是否挂载
+挂载时在同步路由之前注册, 同路径请求优先匹配此处的异步版本, 其余接口仍走同步版本
+"""
+from datetime import datetime
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from consts import MerchantTypeDesc, ProductStatusDesc, DealStatusDesc
+from decorators import log_filter
+from handlers import make_response
+from utils import app_logger as logger, deal_counter_util, product_cache_util
+from utils.db_util import create_async_session
+from utils.pagination_util import page_deals, next_deal_cursor
+from utils.redis_util import async_redis_client
+from utils.security_util import get_login_merchant, get_current_merchant
+from models.deal import Deal
+from models.evaluation import Evaluation
+
+common_router = APIRouter()
+admin_router = APIRouter()
+merchant_router = APIRouter()
+express_router = APIRouter()
+
+
+async def query_deal_page(session: AsyncSession, stmt, page_no: int, page_size: int, cursor: str = None):
+    """
+    执行订单分页查询
+    :param session: 异步会话
+    :param stmt: 已带过滤条件的订单查询语句
+    :param page_no: 当前页码
+    :param page_size: 页面大小
+    :param cursor: 分页游标, 传入时忽略page_no
+    :return: 当前页订单列表, 下一页游标
+    """
+    deals = (await session.execute(page_deals(stmt, page_no, page_size, cursor))).scalars().all()
+    deal_list = []
+    for deal in deals:
+        deal_info = deal.to_dict()
+        deal_info["need_delivery"] = "是" if deal_info["need_delivery"] == 1 else "否"
+        deal_info["deal_status"] = DealStatusDesc.get(deal_info["deal_status"])
+        deal_list.append(deal_info)
+    return deal_list, next_deal_cursor(deals, page_size)
+
+
+@common_router.get("/me")
+@log_filter
+async def show_me(merchant_id: int = Depends(get_login_merchant), merchant: dict = Depends(get_current_merchant)):
+    """
+    获取我的账号信息\n
+    :return: 商户基本信息\n
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {}
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.hget("evaluation_stars", merchant_id)
+        pipe.hget("evaluation_times", merchant_id)
+        stars, times = await pipe.execute()
+        merchant.pop("password")
+        merchant.pop("status")
+        merchant["merchant_type"] = MerchantTypeDesc.get(merchant["merchant_type"])
+        if stars is None:
+            merchant["stars"] = 4   # 初始星级默认为4
+        else:
+            merchant["stars"] = float(stars) / int(times)
+        ret_data["merchant_info"] = merchant
+    except Exception as e:
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@merchant_router.get("/evaluation_list")
+@log_filter
+async def get_evaluation_list(page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
+                              merchant_id: int = Depends(get_login_merchant),
+                              session: AsyncSession = Depends(create_async_session)):
+    """
+    获取我的评价列表 \n
+    :param page_no:  当前页码\n
+    :param page_size:  页面代销\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "total_amount": 0,
+        "evaluation_list": []
+    }
+    try:
+        stmt = select(Evaluation).where(Evaluation.merchant_id == merchant_id)
+        ret_data["total_amount"] = await session.scalar(select(func.count()).select_from(stmt.subquery()))
+        stmt = stmt.order_by(-Evaluation.create_time).offset((page_no - 1) * page_size).limit(page_size)
+        evaluations = await session.execute(stmt)
+        ret_data["evaluation_list"] = [evaluation.to_dict() for evaluation in evaluations.scalars()]
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@merchant_router.get("/product_list")
+@log_filter
+async def get_product_list(sort_by: str = Query("update_time", regex="^(update_time|price|remain_stock)$"),
+                           desc: bool = True, status: int = Query(None, gt=-1, lt=2), tag: str = None,
+                           page_no: int = Query(1, gt=0), page_size: int = Query(20, gt=0, le=100),
+                           merchant_id: int = Depends(get_login_merchant)):
+    """
+    分页拉取本商户下商品列表\n
+    :param sort_by: 排序字段 update_time: 更新时间 price: 价格 remain_stock: 剩余库存, 默认按更新时间\n
+    :param desc: 是否倒序, 默认倒序\n
+    :param status: 商品状态 0: 售卖中 1: 已下架, 不传则拉取全部\n
+    :param tag: 商品标签, 不传则拉取全部\n
+    :param page_no: 当前页码（不传默认为1）\n
+    :param page_size: 页面大小（不传默认为20, 最大100）\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "total_amount": 0,
+        "product_list": [],
+    }
+    try:
+        ret_data["total_amount"], products = await product_cache_util.list_merchant_products_async(
+            merchant_id, sort_by, desc, status, tag, page_no, page_size)
+
+        product_list = []
+        for product in products:
+            product["status"] = ProductStatusDesc[product["status"]]
+            product_list.append(product)
+        ret_data["product_list"] = product_list
+    except Exception as e:
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@merchant_router.get("/deal_list")
+@log_filter
+async def get_deal_list(begin_time: datetime, end_time: datetime, deal_status: int = Query(None, gt=-1, lt=5),
+                        page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1), cursor: str = None,
+                        merchant_id: int = Depends(get_login_merchant),
+                        session: AsyncSession = Depends(create_async_session)):
+    """
+    根据时间段及状态拉取商户下订单列表\n
+    :param begin_time: 开始时间\n
+    :param end_time: 结束时间\n
+    :param deal_status: 订单状态 0: 待支付  1: 待派送 2: 待上门领取 3: 派送中 4: 已完成， 不传则拉取全部\n
+    :param page_no: 当前页码（不传默认为1）\n
+    :param page_size: 页面大小（不传默认为20）\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "total_count": 0,
+        "deal_list": [],
+        "next_cursor": None
+    }
+    try:
+        stmt = select(Deal).where(Deal.create_time.between(begin_time, end_time), Deal.merchant_id == merchant_id)
+        if deal_status is not None:
+            stmt = stmt.where(Deal.deal_status == deal_status)
+        ret_data["total_count"] = await deal_counter_util.count_deals_async(
+            session, begin_time, end_time, merchant_id, None if deal_status is None else [deal_status])
+        ret_data["deal_list"], ret_data["next_cursor"] = await query_deal_page(session, stmt, page_no, page_size, cursor)
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@admin_router.get("/deal_list")
+@log_filter
+async def get_total_deal_list(begin_time: datetime, end_time: datetime, deal_status: int = Query(None, gt=-1, lt=5),
+                              page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
+                              cursor: str = None, merchant_id: int = Depends(get_login_merchant),
+                              cur_merchant: dict = Depends(get_current_merchant),
+                              session: AsyncSession = Depends(create_async_session)):
+    """
+    查询商城begin_time到end_time时间段内全部订单列表(仅管理员可见)\n
+    :param page_no: 当前页码 （不传默认为1）\n
+    :param page_size: 页面大小 （不传默认为20）\n
+    :param begin_time: 起始时间\n
+    :param end_time: 结束时间\n
+    :param deal_status: 订单状态 0: 待支付  1: 待派送 2: 待上门领取 3: 派送中 4: 已完成， 不传则拉取全部\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "total_count": 0,
+        "deal_list": [],
+        "next_cursor": None
+    }
+    try:
+        if cur_merchant["merchant_type"] != 0:
+            return make_response(-1, "权限不足!")
+        stmt = select(Deal).where(Deal.create_time.between(begin_time, end_time))
+        if deal_status is not None:
+            stmt = stmt.where(Deal.deal_status == deal_status)
+        ret_data["total_count"] = await deal_counter_util.count_deals_async(
+            session, begin_time, end_time, None, None if deal_status is None else [deal_status])
+        ret_data["deal_list"], ret_data["next_cursor"] = await query_deal_page(session, stmt, page_no, page_size, cursor)
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@express_router.get("/deal_list")
+@log_filter
+async def get_deals_to_delivery(begin_time: datetime, end_time: datetime, deal_status: int = Query(None, gt=2, lt=6),
+                                page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
+                                cursor: str = None, merchant_id: int = Depends(get_login_merchant),
+                                merchant: dict = Depends(get_current_merchant),
+                                session: AsyncSession = Depends(create_async_session)):
+    """
+    拉取需要派送的订单
+    :param begin_time: 开始时间
+    :param end_time: 结束时间
+    :param deal_status: 订单状态 3:派送中 4:已拒收 5:已完成(快递公司只能看到需要派送的订单信息), 不传则拉取全部
+    :param page_no: 当前页码
+    :param page_size: 页面大小
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "total_count": 0,
+        "deal_list": [],
+        "next_cursor": None
+    }
+    try:
+        if merchant["merchant_type"] != 2:
+            return make_response(-1, "sorry, 您没有此操作权限!")
+
+        stmt = select(Deal).where(Deal.create_time.between(begin_time, end_time))
+        if deal_status is None:
+            stmt = stmt.where(Deal.deal_status.in_([3, 4, 5]))
+        else:
+            stmt = stmt.where(Deal.deal_status == deal_status)
+        ret_data["total_count"] = await deal_counter_util.count_deals_async(
+            session, begin_time, end_time, None, [3, 4, 5] if deal_status is None else [deal_status])
+        ret_data["deal_list"], ret_data["next_cursor"] = await query_deal_page(session, stmt, page_no, page_size, cursor)
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
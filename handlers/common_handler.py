@@ -2,27 +2,27 @@
 """
 公共模块
 """
-import json
 import datetime
 import time
 
 import sqlalchemy.exc
 from datetime import timedelta
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from fastapi.responses import Response
 from pydantic import BaseModel, Field
+from typing import List
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
 import config
-from utils.json_encoder import JsonEncoder
-from consts import MerchantTypeDesc
+from consts import MerchantTypeDesc, ProductStatusDesc
 from utils.redis_util import redis_client
 from handlers import make_response
 from decorators import log_filter
-from utils import security_util, validation_utils, app_logger as logger, cos_util
+from utils import security_util, validation_utils, app_logger as logger, cos_util, merchant_cache_util, \
+    product_cache_util, product_search_util, outbox_util, price_util
 from utils.db_util import create_session
-from utils.security_util import get_login_merchant
+from utils.security_util import get_login_merchant, get_current_merchant
 from models.merchant import Merchant
 from models.user import User
 
@@ -69,8 +69,8 @@ def register(request: RegisterModel, session: Session = Depends(create_session))
     if request.merchant_type == 1 and request.building not in ["A", "B", "C"]:
         return make_response(-1, "请选择正确的楼栋!")
 
-    hashed_password = security_util.get_password_hash(request.password)
     try:
+        hashed_password = security_util.get_password_hash(request.password)
         now = datetime.datetime.now()
         merchant = Merchant(request.merchant_name, request.merchant_type, request.logo, request.description,
                             request.building, request.floor, request.owner_name, request.phone, hashed_password,
@@ -129,10 +129,10 @@ def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends(),
         response.set_cookie("x_token", access_token, httponly=True)
         response.set_cookie("merchant_type", merchant.merchant_type)
 
-        # 商户信息存入redis
-        redis_client.hset("merchants", merchant.id, json.dumps(merchant.to_dict(), cls=JsonEncoder))
-
+        # 商户信息存入redis(只读请求, 不经过outbox), 并通知各进程失效本地缓存
+        merchant_info = merchant.to_dict()
         session.commit()
+        merchant_cache_util.save_merchant(merchant_info)
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -162,7 +162,8 @@ def logout(response: Response):
 
 @router.get("/me")
 @log_filter
-def show_me(merchant_id: int = Depends(get_login_merchant)):
+def show_me(merchant_id: int = Depends(get_login_merchant),
+            merchant: dict = Depends(get_current_merchant)):
     """
     获取我的账号信息\n
     :return: 商户基本信息\n
@@ -171,7 +172,6 @@ def show_me(merchant_id: int = Depends(get_login_merchant)):
     ret_msg = "success"
     ret_data = {}
     try:
-        merchant = json.loads(redis_client.hget("merchants", merchant_id))
         merchant.pop("password")
         merchant.pop("status")
         merchant["merchant_type"] = MerchantTypeDesc.get(merchant["merchant_type"])
@@ -191,9 +191,82 @@ def show_me(merchant_id: int = Depends(get_login_merchant)):
     return make_response(ret_code, ret_msg, ret_data)
 
 
+@router.get("/search_products")
+@log_filter
+def search_products(keyword: str = Query(..., min_length=1, max_length=64), tag: str = None,
+                    target_merchant_id: int = None, status: int = Query(None, gt=-1, lt=2),
+                    min_price: float = None, max_price: float = None,
+                    page_no: int = Query(1, gt=0), page_size: int = Query(20, gt=0, le=100),
+                    merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+    """
+    搜索商城商品(按商品名称、简介、标签匹配, 需命中全部关键词, 按相关度排序)\n
+    :param keyword: 搜索关键词\n
+    :param tag: 商品标签, 不传则不过滤\n
+    :param target_merchant_id: 商户id, 不传则搜索全部商户\n
+    :param status: 商品状态 0: 售卖中 1: 已下架, 不传则不过滤\n
+    :param min_price: 最低价格\n
+    :param max_price: 最高价格\n
+    :param page_no: 当前页码（不传默认为1）\n
+    :param page_size: 页面大小（不传默认为20, 最大100）\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "total_amount": 0,
+        "product_list": []
+    }
+    try:
+        ret_data["total_amount"], hits = product_search_util.search(
+            keyword, tag, target_merchant_id, status, min_price, max_price, (page_no - 1) * page_size, page_size)
+        products = product_cache_util.get_products(
+            [product_id for product_id, _ in hits],
+            ["product_name", "product_tag", "product_cover", "price", "remain_stock", "status", "merchant_id"])
+        merchant_names = merchant_cache_util.get_merchant_names(
+            session, {product["merchant_id"] for product in products if product is not None})
+        product_list = []
+        for (_, score), product in zip(hits, products):
+            if product is None:
+                continue
+            product["merchant_name"] = merchant_names.get(product["merchant_id"], "")
+            product["status"] = ProductStatusDesc.get(product["status"])
+            product["score"] = score
+            product_list.append(product)
+        ret_data["product_list"] = product_list
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@router.get("/product_prices")
+@log_filter
+def get_product_prices(product_ids: List[int] = Query(..., max_items=100), merchant_id: int = Depends(get_login_merchant)):
+    """
+    批量查询商品实际售价(商品单价 × 进行中活动的折扣)\n
+    :param product_ids: 商品id列表\n
+    :return: prices: {商品id: {"price": 单价, "effective_price": 实际售价, "activity_id": 活动id, "discount": 折扣}},
+             不存在的商品不返回\n
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {}
+    try:
+        ret_data["prices"] = price_util.get_prices(product_ids)
+    except Exception as e:
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
 @router.get("/user")
 @log_filter
-def get_user_info(openid: str, merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+def get_user_info(openid: str, merchant_id: int = Depends(get_login_merchant),
+                  cur_merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
     """
     查看用户信息(仅商户和管理员有权限)\n
     :param openid: 用户微信openid\n
@@ -203,7 +276,6 @@ def get_user_info(openid: str, merchant_id: int = Depends(get_login_merchant), s
     ret_msg = "success"
     ret_data = {}
 
-    cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
     if cur_merchant["merchant_type"] not in [0, 1]:
         session.commit()
         return make_response(-1, "权限不足!")
@@ -244,7 +316,7 @@ def update_password(request: UpdatePasswordModel, response: Response, merchant_i
             return make_response(-1, "密码更新失败，原密码错误!")
         # 更新密码
         merchant.password = security_util.get_password_hash(request.new_passwprd)
-        redis_client.hset("merchants", merchant.id, json.dumps(merchant.to_dict(), cls=JsonEncoder))
+        outbox_util.record_merchants(session, [merchant_id])
         # 清空当前登录态
         response.delete_cookie("x_token")
         session.commit()
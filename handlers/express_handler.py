@@ -2,44 +2,46 @@
 """
 快递员模块
 """
-import json
 from datetime import datetime
+from typing import List
 from fastapi import APIRouter, Depends, Query
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
-from consts import DealStatusDesc
+from consts import DealStatusDesc, ExpressDealTransitions
 from handlers import make_response
-from utils import app_logger as logger
-from utils.security_util import get_login_merchant
+from utils import app_logger as logger, deal_counter_util, deal_state_util
+from utils.security_util import get_login_merchant, get_current_merchant
 from utils.db_util import create_session
-from utils.redis_util import redis_client
+from utils.pagination_util import page_deals, next_deal_cursor
 from decorators import log_filter
 from models.deal import Deal
 
 router = APIRouter()
 
 
+class DealStatusModel(BaseModel):
+    deal_nos: List[int] = Field(..., title="订单号列表", min_items=1, max_items=200)
+    deal_status: int = Field(..., title="目标状态 3: 派送中(接单) 4: 快递公司已拒绝派送 5: 已完成")
+
+
 @router.put("/accept_deal")
 @log_filter
-def accept_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+def accept_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant),
+                merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
     """
     接收订单
     :param deal_no:
     :return:
     """
-    merchant = json.loads(redis_client.hget("merchants", merchant_id))
-    if merchant["merchant_type"] != 2:
-        return make_response(-1, "sorry, 您没有此操作权限!")
     ret_code = 0
     ret_msg = "success"
     try:
-        merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if merchant["merchant_type"] != 2:
             return make_response(-1, "sorry, 您没有此操作权限!")
-        session.query(Deal).filter(Deal.deal_no == deal_no).update({
-            Deal.deal_status: 3
-        })
-        session.commit()
+        result = deal_state_util.transition_deals(session, [deal_no], 3, ExpressDealTransitions)[0]
+        if not result["success"]:
+            return make_response(-1, result["msg"])
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -50,25 +52,21 @@ def accept_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant), se
 
 @router.put("/refuse_deal")
 @log_filter
-def refuse_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+def refuse_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant),
+                merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
     """
     拒收订单
     :param deal_no:
     :return:
     """
-    merchant = json.loads(redis_client.hget("merchants", merchant_id))
-    if merchant["merchant_type"] != 2:
-        return make_response(-1, "sorry, 您没有此操作权限!")
     ret_code = 0
     ret_msg = "success"
     try:
-        merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if merchant["merchant_type"] != 2:
             return make_response(-1, "sorry, 您没有此操作权限!")
-        session.query(Deal).filter(Deal.deal_no == deal_no).update({
-            Deal.deal_status: 4
-        })
-        session.commit()
+        result = deal_state_util.transition_deals(session, [deal_no], 4, ExpressDealTransitions)[0]
+        if not result["success"]:
+            return make_response(-1, result["msg"])
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -79,7 +77,8 @@ def refuse_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant), se
 
 @router.put("/complete_deal")
 @log_filter
-def complete_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+def complete_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant),
+                  merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
     """
     完成订单
     :param deal_no: 订单号
@@ -88,13 +87,11 @@ def complete_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant),
     ret_code = 0
     ret_msg = "success"
     try:
-        merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if merchant["merchant_type"] != 2:
             return make_response(-1, "sorry, 您没有此操作权限!")
-        session.query(Deal).filter(Deal.deal_no == deal_no).update({
-            Deal.deal_status: 5
-        })
-        session.commit()
+        result = deal_state_util.transition_deals(session, [deal_no], 5, ExpressDealTransitions)[0]
+        if not result["success"]:
+            return make_response(-1, result["msg"])
     except Exception as e:
         session.rollback()
         logger.error(str(e))
@@ -103,11 +100,42 @@ def complete_deal(deal_no: int, merchant_id: int = Depends(get_login_merchant),
     return make_response(ret_code, ret_msg)
 
 
+@router.put("/deal_status")
+@log_filter
+def update_deal_status(request: DealStatusModel, merchant_id: int = Depends(get_login_merchant),
+                       merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
+    """
+    批量变更订单状态(批量接单、拒收、完成), 一次请求一次提交, 返回每个订单的处理结果\n
+    :param request: 订单号列表及目标状态\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "success_count": 0,
+        "results": []
+    }
+    try:
+        if merchant["merchant_type"] != 2:
+            return make_response(-1, "sorry, 您没有此操作权限!")
+        results = deal_state_util.transition_deals(session, request.deal_nos, request.deal_status,
+                                                   ExpressDealTransitions)
+        ret_data["success_count"] = sum(1 for result in results if result["success"])
+        ret_data["results"] = results
+    except Exception as e:
+        session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
 @router.get("/deal_list")
 @log_filter
 def get_deals_to_delivery(begin_time: datetime, end_time: datetime, deal_status: int = Query(None, gt=2, lt=6),
-                          page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
-                          merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+                          page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1), cursor: str = None,
+                          merchant_id: int = Depends(get_login_merchant),
+                          merchant: dict = Depends(get_current_merchant), session: Session = Depends(create_session)):
     """
     拉取需要派送的订单
     :param begin_time: 开始时间
@@ -115,16 +143,17 @@ def get_deals_to_delivery(begin_time: datetime, end_time: datetime, deal_status:
     :param deal_status: 订单状态 3:派送中 4:已拒收 5:已完成(快递公司只能看到需要派送的订单信息), 不传则拉取全部
     :param page_no: 当前页码
     :param page_size: 页面大小
+    :param cursor: 分页游标(上一页返回的next_cursor), 传入时忽略page_no, 按游标翻页
     :return:
     """
     ret_code = 0
     ret_msg = "success"
     ret_data = {
         "total_count": 0,
-        "deal_list": []
+        "deal_list": [],
+        "next_cursor": None
     }
     try:
-        merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if merchant["merchant_type"] != 2:
             return make_response(-1, "sorry, 您没有此操作权限!")
 
@@ -132,8 +161,11 @@ def get_deals_to_delivery(begin_time: datetime, end_time: datetime, deal_status:
             deals = session.query(Deal).filter(Deal.create_time.between(begin_time, end_time), Deal.deal_status.in_([3, 4, 5]))
         else:
             deals = session.query(Deal).filter(Deal.create_time.between(begin_time, end_time), Deal.deal_status == deal_status)
-        ret_data["total_count"] = deals.count()
-        deals = deals.order_by(-Deal.create_time).offset((page_no - 1) * page_size).limit(page_size)
+        # 总数由订单计数桶统计, 不再对整个时间段执行COUNT
+        ret_data["total_count"] = deal_counter_util.count_deals(session, begin_time, end_time,
+                                                                statuses=[3, 4, 5] if deal_status is None else [deal_status])
+        deals = page_deals(deals, page_no, page_size, cursor).all()
+        ret_data["next_cursor"] = next_deal_cursor(deals, page_size)
         deal_list = []
         for deal in deals:
             deal_info = deal.to_dict()
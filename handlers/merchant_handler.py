@@ -4,23 +4,24 @@
 """
 import json
 from datetime import datetime
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, UploadFile, File
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict
 
-from consts import ProductStatusDesc, DealStatusDesc, get_activity_status_desc
-from utils import app_logger as logger
+from consts import ProductStatusDesc, ProductTags, DealStatusDesc
+from utils import app_logger as logger, deal_counter_util, product_cache_util, product_batch_util, \
+    product_facet_util, outbox_util, stock_util, price_util, activity_schedule_util, activity_product_util
 from decorators import log_filter
 from handlers import make_response
-from utils.json_encoder import JsonEncoder
 from utils.db_util import create_session
-from utils.security_util import get_login_merchant
+from config import product_import_config
+from utils.pagination_util import page_deals, next_deal_cursor
+from utils.security_util import get_login_merchant, get_current_merchant
 from utils.redis_util import redis_client
 from models.deal import Deal
 from models.evaluation import Evaluation
 from models.product import Product
-from models.activity import Activity
 
 router = APIRouter()
 
@@ -37,6 +38,10 @@ class ProductModel(BaseModel):
     price: float = Field(..., title="商品单价")
 
 
+class ProductIdsModel(BaseModel):
+    product_ids: List[int] = Field(..., title="商品id列表", min_items=1, max_items=1000)
+
+
 class ActivityProductModel(BaseModel):
     activity_id: int = Field(..., title="活动id")
     product_discount_map: Dict[int, float] = Field(..., title="商品及其折扣对应关系")
@@ -74,15 +79,25 @@ def get_evaluation_list(page_no: int = Query(1, gt=-1), page_size: int = Query(2
 
 @router.get("/product_tags")
 @log_filter
-def get_product_tags():
+def get_product_tags(target_merchant_id: int = None):
     """
-    拉取商品分类标签
+    拉取商品分类标签及各标签下的商品数\n
+    :param target_merchant_id: 商户id, 传入时只统计该商户的商品, 不传则统计全商城\n
+    :return: product_tags: 标签列表, tag_counts: [{"tag": 标签, "count": 商品数}], status_counts: {商品状态描述: 商品数}
     """
     ret_code = 0
     ret_msg = "success"
-    ret_data = {
-        "product_tags": ["水果", "食品", "生鲜", "数码", "电器", "洗护", "男装", "女装", "鞋靴", "母婴", "保健", "医药", "百货", "其它"]
-    }
+    ret_data = {}
+    try:
+        tag_counts, status_counts = product_facet_util.get_facets(target_merchant_id)
+        ret_data["product_tags"] = [item["tag"] for item in tag_counts]
+        ret_data["tag_counts"] = tag_counts
+        ret_data["status_counts"] = {desc: status_counts.get(status, 0) for status, desc in ProductStatusDesc.items()}
+    except Exception as e:
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+        ret_data["product_tags"] = list(ProductTags)
     return make_response(ret_code, ret_msg, ret_data)
 
 
@@ -107,15 +122,11 @@ def add_product(product_info: ProductModel, merchant_id: int = Depends(get_login
         session.add(product)
         session.flush()
 
-        # 商品信息存入缓存
-        logger.info(f"redis prduct_info: f{product.to_dict()}")
-        redis_client.hset("products", product.id, json.dumps(product.to_dict(), cls=JsonEncoder))
-
-        # 将商品id保存至商户，便于根据商户id查询对应商品
-        redis_client.sadd(f"products_of_merchant_{merchant_id}", product.id)
-        logger.info("商品存入redis成功!")
-
+        # 与商品同一事务记录缓存变更事件, 提交后由投影线程写入缓存及索引
+        outbox_util.record_products(session, [product.id])
         session.commit()
+        stock_util.adjust_stocks({product.id: (
+            None, product_info.remain_stock if product_info.has_stock_limit == 1 else None)})
         logger.info(f"新增商品成功, product_id: {product.id}")
         ret_data["product_id"] = product.id
     except Exception as e:
@@ -142,13 +153,15 @@ def modify_product(product_info: ProductModel, merchant_id: int = Depends(get_lo
         if product_info.id is None:
             session.commit()
             return make_response(-1, "商品id不能为空!")
-        product = session.query(Product).filter(Product.id == product_info.id).one_or_none()
+        # 锁定商品行, 避免与库存回写交错导致按旧库存计算的变化量有误
+        product = session.query(Product).filter(Product.id == product_info.id).with_for_update().one_or_none()
         if product is None:
             session.commit()
             return make_response(-1, f"商品({product_info.id})不存在!")
         if product.merchant_id != merchant_id:
             session.commit()
             return make_response(-1, f"不允许修改他人账户下的商品!")
+        old_stock = product.remain_stock if product.has_stock_limit == 1 else None
         product.product_name = product_info.product_name
         product.product_tag = product_info.product_tag
         product.product_cover = product_info.product_cover
@@ -159,11 +172,10 @@ def modify_product(product_info: ProductModel, merchant_id: int = Depends(get_lo
         product.price = product_info.price
         product.update_time = datetime.now()
 
-        # 更新缓存
-        redis_client.hset("products", product.id, json.dumps(product.to_dict(), cls=JsonEncoder))
-        logger.info("更新redis成功!")
-
+        outbox_util.record_products(session, [product.id])
         session.commit()
+        stock_util.adjust_stocks({product_info.id: (
+            old_stock, product_info.remain_stock if product_info.has_stock_limit == 1 else None)})
         logger.info(f"商品信息修改成功, product_id: {product.id}")
         ret_data["product_id"] = product.id
     except Exception as e:
@@ -186,25 +198,23 @@ def offline_product(product_id: int, merchant_id: int = Depends(get_login_mercha
     ret_code = 0
     ret_msg = "success"
     try:
-        product_info = redis_client.hget("products", product_id)
-        if product_info is None:
+        owner_id = session.query(Product.merchant_id).filter(Product.id == product_id).scalar()
+        if owner_id is None:
             session.commit()
             return make_response(-1, "商品不存在!")
-        product = json.loads(product_info)
-        if product["merchant_id"] != merchant_id:
+        if owner_id != merchant_id:
             session.commit()
             return make_response(-1, "仅能下架自己商户下的商品!")
 
-        # 更新缓存
-        product["status"] = 1
-        redis_client.hset("products", product_id, json.dumps(product))
-
         # 更新db
         session.query(Product).filter(Product.id == product_id).update({
-            Product.status: 1
+            Product.status: 1,
+            Product.update_time: datetime.now()
         })
+        outbox_util.record_products(session, [product_id])
         session.commit()
     except Exception as e:
+        session.rollback()
         logger.error(str(e))
         ret_code = -1
         ret_msg = str(e)
@@ -213,9 +223,18 @@ def offline_product(product_id: int, merchant_id: int = Depends(get_login_mercha
 
 @router.get("/product_list")
 @log_filter
-def get_product_list(merchant_id: int = Depends(get_login_merchant)):
+def get_product_list(sort_by: str = Query("update_time", regex="^(update_time|price|remain_stock)$"),
+                     desc: bool = True, status: int = Query(None, gt=-1, lt=2), tag: str = None,
+                     page_no: int = Query(1, gt=0), page_size: int = Query(20, gt=0, le=100),
+                     merchant_id: int = Depends(get_login_merchant)):
     """
-    拉取本商户下全部商品列表\n
+    分页拉取本商户下商品列表\n
+    :param sort_by: 排序字段 update_time: 更新时间 price: 价格 remain_stock: 剩余库存, 默认按更新时间\n
+    :param desc: 是否倒序, 默认倒序\n
+    :param status: 商品状态 0: 售卖中 1: 已下架, 不传则拉取全部\n
+    :param tag: 商品标签, 不传则拉取全部\n
+    :param page_no: 当前页码（不传默认为1）\n
+    :param page_size: 页面大小（不传默认为20, 最大100）\n
     :return:
     """
     ret_code = 0
@@ -224,20 +243,15 @@ def get_product_list(merchant_id: int = Depends(get_login_merchant)):
         "total_amount": 0,
         "product_list": [],
     }
-    # 从redis拉取本商户下全部商品信息
+    # 从redis商户商品索引分页拉取商品信息
     try:
-        product_ids = redis_client.smembers(f"products_of_merchant_{merchant_id}")
-
-        products = redis_client.hmget("products", product_ids)
+        ret_data["total_amount"], products = product_cache_util.list_merchant_products(
+            merchant_id, sort_by, desc, status, tag, page_no, page_size)
 
-        total_amount = 0
         product_list = []
-        for value in products:
-            total_amount += 1
-            product = json.loads(value)
+        for product in products:
             product["status"] = ProductStatusDesc[product["status"]]
             product_list.append(product)
-        ret_data["total_amount"] = len(products)
         ret_data["product_list"] = product_list
     except Exception as e:
         logger.error(str(e))
@@ -246,6 +260,29 @@ def get_product_list(merchant_id: int = Depends(get_login_merchant)):
     return make_response(ret_code, ret_msg, ret_data)
 
 
+@router.get("/product_stocks")
+@log_filter
+def get_product_stocks(product_ids: List[int] = Query(..., max_items=100), merchant_id: int = Depends(get_login_merchant)):
+    """
+    查询商品实时可售库存(已扣除未确认的预留)\n
+    :param product_ids: 商品id列表\n
+    :return: {商品id: 实时库存}, 无库存限制或非本商户的商品不返回\n
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {}
+    try:
+        own_ids = [product_id for product_id, product in
+                   zip(product_ids, product_cache_util.get_products(product_ids, ["merchant_id"]))
+                   if product is not None and product["merchant_id"] == merchant_id]
+        ret_data["stocks"] = stock_util.get_stocks(own_ids)
+    except Exception as e:
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
 @router.delete("/delete_product")
 @log_filter
 def delete_product(product_id: int, merchant_id: int = Depends(get_login_merchant),
@@ -258,33 +295,173 @@ def delete_product(product_id: int, merchant_id: int = Depends(get_login_merchan
     ret_code = 0
     ret_msg = "success"
     try:
-        product_info = redis_client.hget("products", product_id)
-        if product_info is None:
+        owner_id = session.query(Product.merchant_id).filter(Product.id == product_id).scalar()
+        if owner_id is None:
             session.commit()
             return make_response(-1, "商品不存在!")
-        product = json.loads(product_info)
-        if product["merchant_id"] != merchant_id:
+        if owner_id != merchant_id:
             session.commit()
             return make_response(-1, "仅能删除自己商户下的商品!")
 
-        # 删除缓存
-        redis_client.hdel("products", product_id)
-        redis_client.srem(f"products_of_merchant_{merchant_id}", product_id)
-
         # 删除db
         session.query(Product).filter(Product.id == product_id).delete()
+        outbox_util.record_products(session, [product_id])
         session.commit()
+        stock_util.drop_stocks([product_id])
     except Exception as e:
+        session.rollback()
         logger.error(str(e))
         ret_code = -1
         ret_msg = str(e)
     return make_response(ret_code, ret_msg)
 
 
+@router.post("/import_products")
+@log_filter
+def import_products(file: UploadFile = File(...), file_format: str = Query(None, regex="^(jsonl|csv)$"),
+                    merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+    """
+    批量导入商品(JSONL或CSV文件, 字段同ProductModel, 带id的行为修改商品, 不带id的行为新增商品)\n
+    CSV文件首行为表头, detail_pictures列为JSON数组或以|分隔的图片地址\n
+    :param file: 商品文件\n
+    :param file_format: 文件格式 jsonl/csv, 不传则根据文件扩展名判断\n
+    :return: 成功导入的行及商品id, 失败的行及错误信息
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "imported_count": 0,
+        "error_count": 0,
+        "products": [],
+        "errors": []
+    }
+    try:
+        if file_format is None:
+            file_format = (file.filename or "").rsplit(".", 1)[-1].lower()
+            if file_format not in ("jsonl", "csv"):
+                return make_response(-1, "仅支持jsonl及csv格式文件!")
+
+        def flush(batch):
+            try:
+                imported, errors = product_batch_util.import_batch(session, merchant_id, batch)
+            except Exception as e:
+                session.rollback()
+                logger.error(f"商品批量导入失败: {repr(e)}")
+                imported, errors = [], [{"line": line_no, "msg": str(e)} for line_no, _ in batch]
+            ret_data["products"].extend(imported)
+            ret_data["errors"].extend(errors)
+
+        batch_size = product_import_config["batch_size"]
+        row_count = 0
+        batch = []
+        for line_no, row, error in product_batch_util.iter_upload_rows(file.file, file_format):
+            if error is not None:
+                ret_data["errors"].append({"line": line_no, "msg": error})
+                continue
+            row_count += 1
+            if row_count > product_import_config["max_rows"]:
+                ret_data["errors"].append({
+                    "line": line_no, "msg": f"单次最多导入{product_import_config['max_rows']}个商品!"
+                })
+                break
+            try:
+                batch.append((line_no, ProductModel(**row)))
+            except ValidationError as e:
+                ret_data["errors"].append({
+                    "line": line_no,
+                    "msg": "; ".join(f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors())
+                })
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        ret_data["errors"].sort(key=lambda item: item["line"])
+        ret_data["imported_count"] = len(ret_data["products"])
+        ret_data["error_count"] = len(ret_data["errors"])
+        logger.info(f"商品批量导入完成, 成功: {ret_data['imported_count']}, 失败: {ret_data['error_count']}")
+    except Exception as e:
+        session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@router.put("/online_products")
+@log_filter
+def online_products(request: ProductIdsModel, merchant_id: int = Depends(get_login_merchant),
+                    session: Session = Depends(create_session)):
+    """
+    批量上架商品\n
+    :param request: 商品id列表\n
+    :return: 成功的商品id列表及失败的商品
+    """
+    return update_products_status(request.product_ids, 0, merchant_id, session)
+
+
+@router.put("/offline_products")
+@log_filter
+def offline_products(request: ProductIdsModel, merchant_id: int = Depends(get_login_merchant),
+                     session: Session = Depends(create_session)):
+    """
+    批量下架商品\n
+    :param request: 商品id列表\n
+    :return: 成功的商品id列表及失败的商品
+    """
+    return update_products_status(request.product_ids, 1, merchant_id, session)
+
+
+def update_products_status(product_ids, status, merchant_id, session):
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "product_ids": [],
+        "errors": []
+    }
+    try:
+        ret_data["product_ids"], ret_data["errors"] = product_batch_util.set_products_status(session, merchant_id,
+                                                                                             product_ids, status)
+    except Exception as e:
+        session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
+@router.post("/delete_products")
+@log_filter
+def delete_products(request: ProductIdsModel, merchant_id: int = Depends(get_login_merchant),
+                    session: Session = Depends(create_session)):
+    """
+    批量删除商品\n
+    :param request: 商品id列表\n
+    :return: 成功的商品id列表及失败的商品
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = {
+        "product_ids": [],
+        "errors": []
+    }
+    try:
+        ret_data["product_ids"], ret_data["errors"] = product_batch_util.delete_products(session, merchant_id,
+                                                                                         request.product_ids)
+    except Exception as e:
+        session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
 @router.get("/deal_list")
 @log_filter
 def get_deal_list(begin_time: datetime, end_time: datetime, deal_status: int = Query(None, gt=-1, lt=5),
-                  page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1),
+                  page_no: int = Query(1, gt=-1), page_size: int = Query(20, gt=-1), cursor: str = None,
                   merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
     """
     根据时间段及状态拉取商户下订单列表\n
@@ -293,13 +470,15 @@ def get_deal_list(begin_time: datetime, end_time: datetime, deal_status: int = Q
     :param deal_status: 订单状态 0: 待支付  1: 待派送 2: 待上门领取 3: 派送中 4: 已完成， 不传则拉取全部\n
     :param page_no: 当前页码（不传默认为1）\n
     :param page_size: 页面大小（不传默认为20）\n
+    :param cursor: 分页游标(上一页返回的next_cursor), 传入时忽略page_no, 按游标翻页\n
     :return:
     """
     ret_code = 0
     ret_msg = "success"
     ret_data = {
         "total_count": 0,
-        "deal_list": []
+        "deal_list": [],
+        "next_cursor": None
     }
     try:
         if deal_status is None:
@@ -309,8 +488,11 @@ def get_deal_list(begin_time: datetime, end_time: datetime, deal_status: int = Q
             deals = session.query(Deal).filter(Deal.create_time.between(begin_time, end_time),
                                                Deal.deal_status == deal_status,
                                                Deal.merchant_id == merchant_id)
-        ret_data["total_count"] = deals.count()
-        deals = deals.order_by(-Deal.create_time).offset((page_no - 1) * page_size).limit(page_size)
+        # 总数由订单计数桶统计, 不再对整个时间段执行COUNT
+        ret_data["total_count"] = deal_counter_util.count_deals(session, begin_time, end_time, merchant_id=merchant_id,
+                                                                statuses=None if deal_status is None else [deal_status])
+        deals = page_deals(deals, page_no, page_size, cursor).all()
+        ret_data["next_cursor"] = next_deal_cursor(deals, page_size)
         deal_list = []
         for deal in deals:
             deal_info = deal.to_dict()
@@ -327,41 +509,57 @@ def get_deal_list(begin_time: datetime, end_time: datetime, deal_status: int = Q
     return make_response(ret_code, ret_msg, ret_data)
 
 
+@router.get("/deal_status_counts")
+@log_filter
+def get_deal_status_counts(begin_time: datetime, end_time: datetime, merchant_id: int = Depends(get_login_merchant),
+                           session: Session = Depends(create_session)):
+    """
+    查询商户begin_time到end_time时间段内各状态订单数量(订单管理页状态角标)\n
+    :param begin_time: 开始时间\n
+    :param end_time: 结束时间\n
+    :return:
+    """
+    ret_code = 0
+    ret_msg = "success"
+    ret_data = []
+    try:
+        status_counts = deal_counter_util.get_status_counts(session, begin_time, end_time, merchant_id)
+        ret_data = [{"deal_status": status, "status_desc": desc, "count": status_counts[status]}
+                    for status, desc in DealStatusDesc.items()]
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(str(e))
+        ret_code = -1
+        ret_msg = str(e)
+    return make_response(ret_code, ret_msg, ret_data)
+
+
 @router.get("/activity_list")
 @log_filter
-def get_activity_list(page_no: int = 1, page_size: int = 10, merchant_id: int = Depends(get_login_merchant), session: Session = Depends(create_session)):
+def get_activity_list(page_no: int = 1, page_size: int = 10,
+                      status: str = Query(None, regex="^(upcoming|running|ended)$"),
+                      merchant_id: int = Depends(get_login_merchant)):
     """
-    查询商城营销活动列表\n
+    查询商城营销活动列表(从活动日历读取, 不扫描活动表)\n
     :param: page_no: 当前页码，默认1
     :param: page_size: 页面大小， 默认10
-    :return:
+    :param: status: 活动状态 upcoming: 未开始, running: 进行中, ended: 已结束, 不传则查询全部
+    :return: total_count: 符合条件的活动数, status_counts: 各状态活动数
     """
     ret_code = 0
     ret_msg = "success"
     ret_data = {
         "total_count": 0,
+        "status_counts": {},
         "activity_list": []
     }
 
     try:
-        now = datetime.now()
-        activities = session.query(Activity).order_by(-Activity.create_time)
-        ret_data["total_count"] = activities.count()
-
-        activities = activities.offset((page_no - 1) * page_size).limit(page_size)
-        activity_list = []
-        for activity in activities:
-            activity_list.append({
-                "id": activity.id,
-                "act_name": activity.act_name,
-                "act_cover": activity.act_cover,
-                "status": get_activity_status_desc(now, activity.begin_time, activity.end_time),
-                "begin_time": activity.begin_time,
-                "end_time": activity.end_time,
-            })
-        ret_data["activity_list"] = activity_list
+        ret_data["total_count"], ret_data["activity_list"] = activity_schedule_util.list_activities(
+            status, (page_no - 1) * page_size, page_size)
+        ret_data["status_counts"] = activity_schedule_util.count_activities()
     except Exception as e:
-        session.rollback()
         logger.error(str(e))
         ret_code = -1
         ret_msg = str(e)
@@ -370,45 +568,26 @@ def get_activity_list(page_no: int = 1, page_size: int = 10, merchant_id: int =
 
 @router.get("/get_activity_products")
 @log_filter
-def get_activity_products(activity_id: int, merchant_id: int = Depends(get_login_merchant)):
+def get_activity_products(activity_id: int, target_merchant_id: int = None, page_no: int = Query(1, gt=0),
+                          page_size: int = Query(20, gt=0, le=100), merchant_id: int = Depends(get_login_merchant)):
     """
-    拉取参与某个营销活动的商品列表 \n
+    分页拉取参与某个营销活动的商品列表(读取活动商品视图) \n
     :param activity_id: 活动id \n
+    :param target_merchant_id: 只查询该商户的商品, 不传则查询全部(按折扣从低到高排序) \n
+    :param page_no: 当前页码, 默认1 \n
+    :param page_size: 页面大小, 默认20 \n
     :return:
     """
     ret_code = 0
     ret_msg = "success"
     ret_data = {
+        "total_count": 0,
         "product_list": []
     }
 
     try:
-        # 获取活动商品折扣表
-        discount_table = redis_client.hgetall(f"discount_of_activity_{activity_id}")
-        if discount_table is not None:
-            discount_table.pop("")
-            product_ids = discount_table.keys()
-
-            # 查询活动商品信息
-            products = redis_client.hmget("products", product_ids)
-
-            # 查询商户信息
-            merchants = redis_client.hgetall("merchants")
-            for k, v in merchants.items():
-                merchants[k] = json.loads(v)
-
-            product_list = []
-            for value in products:
-                if value is not None:
-                    product = json.loads(value)
-                    product_list.append({
-                        "product_id": product["id"],
-                        "product_name": product["product_name"],
-                        "product_cover": product["product_cover"],
-                        "discount": discount_table.get(str(product["id"])),
-                        "merchant_name": merchants.get(str(product["merchant_id"])).get("merchant_name")
-                    })
-            ret_data["product_list"] = product_list
+        ret_data["total_count"], ret_data["product_list"] = activity_product_util.list_products(
+            activity_id, target_merchant_id, (page_no - 1) * page_size, page_size)
     except Exception as e:
         logger.error(str(e))
         ret_code = -1
@@ -418,7 +597,9 @@ def get_activity_products(activity_id: int, merchant_id: int = Depends(get_login
 
 @router.post("/add_products_to_activity")
 @log_filter
-def add_products_to_activity(actvity_product: ActivityProductModel, merchant_id: int = Depends(get_login_merchant)):
+def add_products_to_activity(actvity_product: ActivityProductModel, merchant_id: int = Depends(get_login_merchant),
+                             cur_merchant: dict = Depends(get_current_merchant),
+                             session: Session = Depends(create_session)):
     """
     添加商品到营销活动(必须在活动结束之前) \n
     :param: actvity_product: 活动商品及折扣信息 \n
@@ -435,34 +616,27 @@ def add_products_to_activity(actvity_product: ActivityProductModel, merchant_id:
         activity = json.loads(activity_info)
 
         # 检查操作合法性(只能操作自己商户下的商品)
-        cur_merchant = json.loads(redis_client.hget("merchants", merchant_id))
         if cur_merchant["merchant_type"] != 1:
             return make_response(-1, "权限不足, 仅普通商户能执行此操作!")
         product_ids = actvity_product.product_discount_map.keys()
-        pipe = redis_client.pipeline(transaction=False)
-        for product_id in product_ids:
-            pipe.hget("products", product_id)
-        product_infos = pipe.execute()
-        for product_info in product_infos:
-            if product_info is None:
+        products = product_cache_util.get_products(product_ids, activity_product_util.CARD_FIELDS)
+        for product in products:
+            if product is None:
                 return make_response(-1, "请确认商品都存在!")
-            product = json.loads(product_info)
             if int(product.get("merchant_id")) != merchant_id:
                 return make_response(-1, "非法操作, 仅能操作自己商户下的商品!")
 
-        # 将商品折扣信息添加至活动折扣表, 并建立活动商品与活动的映射关系
-        discount_key = f"discount_of_activity_{actvity_product.activity_id}"
-        act_endtime = datetime.strptime(activity.get("end_time"), "%Y-%y-%d %H:%M:%S")
-        now = datetime.now()
-        expire_time = (act_endtime - now).seconds
-        pipe = redis_client.pipeline(transaction=True)
-        for product_id, discount in actvity_product.product_discount_map.items():
-            pipe.hset(discount_key, product_id, discount)
-            pipe.set(f"activity_of_product_{product_id}", activity.get("id"), ex=expire_time)
-        pipe.execute()
+        # 将商品折扣信息添加至活动折扣表及活动商品视图, 并建立活动商品与活动的映射关系,
+        # 均与活动信息一样在活动结束时刻过期
+        expire_at = datetime.strptime(activity.get("end_time"), "%Y-%m-%d %H:%M:%S").timestamp()
+        activity_product_util.add_products(session, activity, products, actvity_product.product_discount_map,
+                                           expire_at)
+        session.commit()
+        price_util.invalidate_products(product_ids)
 
         logger.info("新增活动商品成功!")
     except Exception as e:
+        session.rollback()
         logger.error(str(e))
         ret_code = -1
         ret_msg = str(e)
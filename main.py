@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
+import time
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
 from starlette.staticfiles import StaticFiles
 from asgi_request_id import RequestIDMiddleware
 import config
 from handlers import common_handler, admin_handler, merchant_handler, express_handler
-from utils import app_logger as logger
+from utils import app_logger as logger, merchant_cache_util, security_util, metrics_util, job_util, deal_counter_util, \
+    deal_rollup_util, export_util, product_cache_util, product_search_util, product_facet_util, \
+    outbox_util, cache_rebuild_util, stock_util, price_util, activity_schedule_util, live_sales_util, \
+    merchant_directory_util
+from utils.db_util import engine
+from utils.redis_util import redis_client
+from message import message_handler
 from message.message_handler import MessageHandler
 
 app = FastAPI(
@@ -21,6 +29,33 @@ app.add_middleware(
     incoming_request_id_header="request_id",
 )
 
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """
+    统计各接口请求次数、耗时及单次请求内的数据库、redis调用情况
+    """
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    stats = metrics_util.begin_request()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # 按路由模板聚合, 未匹配到路由的请求统一归为unmatched, 避免指标基数膨胀
+        route = request.scope.get("route")
+        if route is not None:
+            route_path = route.path
+        elif "endpoint" in request.scope:
+            route_path = request.url.path
+        else:
+            route_path = "unmatched"
+        metrics_util.end_request(request.method, route_path, status_code, time.perf_counter() - start, stats)
+
+
 # 挂载静态文件目录
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -30,6 +65,14 @@ msg_handler = MessageHandler("WebSocket Server")
 # 登录管理
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+# 异步执行模式: 异步路由需先于同步路由注册, 同路径请求优先匹配异步版本
+if config.async_config["enable"]:
+    from handlers import async_handler
+    app.include_router(async_handler.common_router, tags=["公共模块"])
+    app.include_router(async_handler.admin_router, prefix="/admin", tags=["管理员模块"])
+    app.include_router(async_handler.merchant_router, prefix="/merchant", tags=["商户模块"])
+    app.include_router(async_handler.express_router, prefix="/express", tags=["快递公司模块"])
+
 # # 导入路由模块
 app.include_router(common_handler.router, tags=["公共模块"])
 app.include_router(admin_handler.router, prefix="/admin", tags=["管理员模块"])
@@ -37,13 +80,86 @@ app.include_router(merchant_handler.router, prefix="/merchant", tags=["商户模
 app.include_router(express_handler.router, prefix="/express", tags=["快递公司模块"])
 
 
+# 监控指标: 数据库连接池、缓存及密码哈希进程池状态
+metrics_util.register_gauge("db_pool_size", "数据库连接池大小", lambda: engine.pool.size())
+metrics_util.register_gauge("db_pool_checked_out", "已借出的数据库连接数", lambda: engine.pool.checkedout())
+metrics_util.register_gauge("db_pool_overflow", "数据库连接池溢出连接数", lambda: engine.pool.overflow())
+metrics_util.register_gauge("token_cache", "已校验token缓存统计", lambda: {
+    (("stat", k),): v for k, v in security_util.token_cache.stats().items()})
+metrics_util.register_gauge("merchant_cache", "商户信息本地缓存统计", lambda: {
+    (("stat", k),): v for k, v in merchant_cache_util.merchant_cache.stats().items()})
+metrics_util.register_gauge("price_cache", "商品活动折扣本地缓存统计", lambda: {
+    (("stat", k),): v for k, v in price_util.activity_cache.stats().items()})
+metrics_util.register_gauge("password_hash", "密码哈希进程池统计", lambda: {
+    (("stat", k),): v for k, v in security_util.hash_stats.items()})
+metrics_util.register_gauge("cache_outbox", "缓存投影统计", lambda: {
+    (("stat", k),): v for k, v in outbox_util.projector_stats.items()})
+metrics_util.register_gauge("deal_exports", "进行中的订单导出任务数", lambda: export_util.export_stats["active"])
+metrics_util.register_gauge("websocket_connections", "WebSocket在线商户连接数(按WebSocket Server进程)",
+                            lambda: websocket_connections())
+
+
+def websocket_connections():
+    """
+    :return: {(("process", 主机名:进程id),): 在线连接数}
+    """
+    keys = list(redis_client.scan_iter(match=f"{message_handler.CONNECTIONS_KEY_PREFIX}*", count=100))
+    if not keys:
+        return {}
+    return {(("process", key[len(message_handler.CONNECTIONS_KEY_PREFIX):]),): int(value)
+            for key, value in zip(keys, redis_client.mget(keys)) if value is not None}
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Prometheus格式监控指标
+    """
+    return PlainTextResponse(metrics_util.render())
+
+
 @app.on_event("startup")
 def app_start():
     logger.info("******************** App Start ********************")
+    # 订阅商户缓存失效通知
+    merchant_cache_util.start_invalidation_listener()
+    # 订阅商品活动折扣缓存失效通知
+    price_util.start_invalidation_listener()
+    # 启动缓存投影线程, 将写接口记录的变更事件同步到redis
+    outbox_util.start_projector()
+    # 定时校正最近几天的订单计数桶, 并轮流校正更早的计数桶
+    job_util.start_periodic_job("deal_counter_reconcile", config.deal_counter_config["reconcile_interval"],
+                                deal_counter_util.reconcile_buckets)
+    # 定时滚动汇总订单销量
+    job_util.start_periodic_job("deal_rollup", config.deal_rollup_config["interval"], deal_rollup_util.roll_forward)
+    # 定时增量累加新订单的实时销量, 由WebSocket Server推送给订阅的管理员
+    job_util.start_periodic_job("live_sales_tail", config.live_sales_config["tail_interval"], live_sales_util.tail_deals)
+    # 按商户表重建商户目录, 之后定时按评价数据重新计算商户平均星级
+    job_util.start_once_job("merchant_directory_sync", merchant_directory_util.sync_from_db, 60)
+    job_util.start_periodic_job("merchant_directory_ratings", config.merchant_directory_config["rating_interval"],
+                                merchant_directory_util.refresh_ratings)
+    # 定时按数据库校正商品分面计数(启动时立即执行一次, 首次上线时完成初始化)
+    job_util.start_periodic_job("product_facet_reconcile", config.product_facet_config["reconcile_interval"],
+                                product_facet_util.reconcile_facets)
+    # 定时释放超时的库存预留, 合并回写售出数量
+    job_util.start_periodic_job("stock_release_expired", config.stock_config["expire_interval"],
+                                stock_util.release_expired)
+    job_util.start_periodic_job("stock_write_back", config.stock_config["write_back_interval"], stock_util.write_back)
+    # 按活动表重建活动日历(补齐本功能上线前创建的活动), 之后定时推进活动状态
+    job_util.start_once_job("activity_schedule_sync", activity_schedule_util.sync_from_db, 60)
+    job_util.start_periodic_job("activity_tick", config.activity_schedule_config["tick_interval"],
+                                activity_schedule_util.tick)
+    # 缓存未建立(redis被清空或首次上线)时, 后台根据数据库重建全部缓存及索引
+    if config.cache_rebuild_config["on_startup"] and not redis_client.exists(cache_rebuild_util.BUILT_KEY):
+        job_util.start_once_job("cache_rebuild", cache_rebuild_util.rebuild, 3600)
+    # 商品搜索索引尚未全量建立时, 后台根据商品缓存建立
+    elif not redis_client.exists(product_search_util.INDEX_BUILT_KEY):
+        job_util.start_once_job("product_reindex", product_cache_util.reindex_products, 3600)
 
 
 @app.on_event("shutdown")
 def app_shutdown():
+    security_util.shutdown_hash_executor()
     logger.info("******************** App Close ********************\n")
 
 
@@ -3,7 +3,7 @@
 消息即时通讯模块: 从商户WebSocket读取消息并发布到小程序后台订阅的Redis主题，以及从商户后台订阅的Redis主题读取消息并发送给指定商户
 定义通信消息体如下:
 {
-    "message_type": "消息类型， message: 普通消息   deal: 订单消息",
+    "message_type": "消息类型， message: 普通消息   deal: 订单消息   live_sales: 实时销量",
     "from_id": "发送方id",
     "from_name": "发送方名称",
     "to_id": "接收方id",
@@ -14,15 +14,30 @@
     }
     "timestamp": "消息发送时间"
 }
+管理员连接/live_sales路径订阅实时销量, 订单增量由live_sales_topic发布, 按live_sales_config["push_interval"]合并后推送,
+订阅时及每次重新统计后推送全量快照, 消息体body如下:
+{
+    "type": "snapshot: 全量快照(替换当天数据)  delta: 增量(累加到当天数据)",
+    "day": "日期",
+    "distributions": [{"merchant_id": 商户id, "merchant_name": 商户名称, "deal_amount": 订单数量, "total_money": 订单金额}]
+}
 """
+import os
 import json
+import time
+import socket
 import threading
 import asyncio
 import websockets
-from utils import msg_logger as logger
+from utils import msg_logger as logger, merchant_cache_util, live_sales_util
 from utils.redis_util import redis_client
 from utils.security_util import verify_token
-from config import merchants_listener_topic, miniapp_listener_topic, merchants_message_queue, miniapp_message_queue, socket_config
+from config import merchants_listener_topic, miniapp_listener_topic, merchants_message_queue, miniapp_message_queue, \
+    socket_config, live_sales_topic, live_sales_config
+
+LIVE_SALES_PATH = "/live_sales"
+# 各WebSocket Server进程的在线连接数(供/metrics读取), 进程退出后随过期时间自动删除
+CONNECTIONS_KEY_PREFIX = "websocket_connections_"
 
 
 class MessageHandler(threading.Thread):
@@ -30,10 +45,15 @@ class MessageHandler(threading.Thread):
         super().__init__()
         self.name = thread_name
         self.USERS = {}     # 保存当前在线的商户socket连接
+        self.SALES_SUBSCRIBERS = set()      # 保存订阅实时销量的管理员socket连接
+        # 待推送的实时销量 {日期: {"snapshot": 是否全量快照, "statistics": {merchant_id: [订单数量, 订单金额]}}}
+        self.pending_sales = {}
+        self.sales_lock = threading.Lock()
 
-        # 订阅merchants_listener_topic
+        # 订阅merchants_listener_topic, live_sales_topic
         self.redis_subscriber = redis_client.pubsub()
         self.redis_subscriber.psubscribe(**{merchants_listener_topic: self.redis_listener})
+        self.redis_subscriber.subscribe(**{live_sales_topic: self.sales_listener})
 
     def run(self):
         # 重新设置事件循环为当前线程，否则get_event_loop会获取主线程事件循环
@@ -49,6 +69,12 @@ class MessageHandler(threading.Thread):
         self.redis_subscriber.run_in_thread(sleep_time=0.1)
         logger.info("Redis Subscriber Started...")
 
+        # 定时合并推送实时销量
+        loop.create_task(self.push_sales())
+
+        # 定时上报本进程的在线连接数
+        loop.create_task(self.report_connections())
+
         # 启动事件循环
         loop.run_forever()
 
@@ -58,6 +84,21 @@ class MessageHandler(threading.Thread):
     def unregister(self, merchant_id):
         self.USERS.pop(merchant_id)
 
+    async def report_connections(self):
+        """
+        每report_interval秒将本进程的在线连接数写入redis(WebSocket Server与Web应用不在同一进程),
+        每个进程使用独立的key, 同步redis客户端在线程池中执行, 不阻塞事件循环
+        """
+        key = f"{CONNECTIONS_KEY_PREFIX}{socket.gethostname()}:{os.getpid()}"
+        interval = socket_config["report_interval"]
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, lambda: redis_client.set(key, len(self.USERS), ex=3 * interval))
+            except Exception as e:
+                logger.error(f"上报WebSocket在线连接数失败: {repr(e)}")
+            await asyncio.sleep(interval)
+
     def is_online(self, merchant_id):
         """
         检查商户是否在线
@@ -89,6 +130,8 @@ class MessageHandler(threading.Thread):
         except Exception as e:
             logger.error(str(e))
             return await websocket.close()
+        if path == LIVE_SALES_PATH:
+            return await self.sales_socket_listener(cur_merchant_id, websocket)
         logger.info(f"商户({cur_merchant_id})已连接!")
         self.register(cur_merchant_id, websocket)
 
@@ -139,3 +182,77 @@ class MessageHandler(threading.Thread):
             # 商户不在线时，通过在redis中为每个商户维护一个接收队列来存储离线消息，待下次商户登录时获取(暂时不做持久化存储)
             redis_client.rpush(f"messages_for_merchant_{target_merchant_id}", message)
 
+    async def sales_socket_listener(self, merchant_id, websocket):
+        """
+        管理员订阅实时销量, 连接后先推送当天全量快照, 之后由push_sales推送合并后的增量
+        """
+        merchant = await merchant_cache_util.get_merchant(merchant_id)
+        if merchant is None or merchant["merchant_type"] != 0:
+            logger.error(f"商户({merchant_id})无权订阅实时销量!")
+            return await websocket.close()
+        logger.info(f"管理员({merchant_id})已订阅实时销量!")
+        snapshot = live_sales_util.get_snapshot()
+        await websocket.send(self.sales_message("snapshot", snapshot["day"], snapshot["statistics"]))
+        self.SALES_SUBSCRIBERS.add(websocket)
+        try:
+            # 订阅连接不处理客户端输入, 仅等待连接关闭
+            async for _ in websocket:
+                pass
+        finally:
+            self.SALES_SUBSCRIBERS.discard(websocket)
+
+    def sales_listener(self, msg):
+        """
+        订阅redis实时销量主题, 将增量合并到待推送数据, 快照覆盖当天之前未推送的增量
+        """
+        if msg["type"] != "message":
+            return
+        sales = json.loads(msg["data"])
+        with self.sales_lock:
+            pending = self.pending_sales.get(sales["day"])
+            if sales["type"] == "snapshot" or pending is None:
+                self.pending_sales[sales["day"]] = {"snapshot": sales["type"] == "snapshot",
+                                                    "statistics": sales["statistics"]}
+                return
+            for merchant_id, (count, money) in sales["statistics"].items():
+                statistic = pending["statistics"].setdefault(merchant_id, [0, 0])
+                statistic[0] += count
+                statistic[1] += money
+
+    def sales_message(self, message_type, day, statistics):
+        merchant_ids = list(statistics.keys())
+        merchant_names = redis_client.hmget("merchant_names", merchant_ids) if merchant_ids else []
+        return json.dumps({
+            "message_type": "live_sales",
+            "body": {
+                "type": message_type,
+                "day": day,
+                "distributions": [{
+                    "merchant_id": int(merchant_id),
+                    "merchant_name": merchant_name or "",
+                    "deal_amount": count,
+                    "total_money": round(money, 2)
+                } for merchant_id, merchant_name, (count, money)
+                    in zip(merchant_ids, merchant_names, statistics.values())]
+            },
+            "timestamp": int(time.time())
+        })
+
+    async def push_sales(self):
+        """
+        每push_interval秒将合并后的实时销量推送给全部订阅者
+        """
+        while True:
+            await asyncio.sleep(live_sales_config["push_interval"])
+            with self.sales_lock:
+                pending_sales, self.pending_sales = self.pending_sales, {}
+            if not pending_sales or not self.SALES_SUBSCRIBERS:
+                continue
+            try:
+                messages = [self.sales_message("snapshot" if sales["snapshot"] else "delta", day, sales["statistics"])
+                            for day, sales in pending_sales.items()]
+                for message in messages:
+                    await asyncio.gather(*[websocket.send(message) for websocket in list(self.SALES_SUBSCRIBERS)],
+                                         return_exceptions=True)
+            except Exception as e:
+                logger.error(f"推送实时销量失败: {repr(e)}")
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from utils.db_util import Base
+from sqlalchemy import Column, String, BigInteger, TIMESTAMP
+"""
+缓存变更事件表(outbox): 业务写库时在同一事务内记录变更的实体, 由后台投影任务提交后批量同步到redis
+"""
+
+
+class CacheOutbox(Base):
+    __tablename__ = "t_cache_outbox"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True, comment="事件id")
+    entity_type = Column(String(16), nullable=False, comment="实体类型, product: 商品, merchant: 商户")
+    entity_id = Column(BigInteger, nullable=False, comment="实体id")
+    create_time = Column(TIMESTAMP, comment="事件时间")
+
+    def __init__(self, entity_type, entity_id, create_time):
+        self.entity_type = entity_type
+        self.entity_id = entity_id
+        self.create_time = create_time
@@ -27,5 +27,6 @@ class Deal(Base):
 
     __table_args__ = (
         Index("time_merchant_index", "create_time", "merchant_id"),  # 根据时间段查询订单列表
-        Index("time_status_index", "create_time", "deal_status")     # 根据时间状态查询订单列表
+        Index("time_status_index", "create_time", "deal_status"),    # 根据时间状态查询订单列表
+        Index("time_deal_no_index", "create_time", "deal_no")         # 订单列表按(创建时间, 订单号)游标分页
     )
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from utils.db_util import Base
+from sqlalchemy import Column, Integer, Float, TIMESTAMP
+"""
+订单销量汇总表: 按小时、天预聚合的各商户订单数量及金额, 由定时任务根据订单表滚动生成
+"""
+
+
+class DealRollupHourly(Base):
+    __tablename__ = "t_deal_rollup_hourly"
+
+    bucket_time = Column(TIMESTAMP, primary_key=True, comment="统计小时起始时间")
+    merchant_id = Column(Integer, primary_key=True, comment="商户id")
+    deal_count = Column(Integer, nullable=False, default=0, comment="订单数量")
+    money = Column(Float, nullable=False, default=0, comment="订单折后总金额")
+    origin_money = Column(Float, nullable=False, default=0, comment="订单折扣前总金额")
+
+
+class DealRollupDaily(Base):
+    __tablename__ = "t_deal_rollup_daily"
+
+    bucket_time = Column(TIMESTAMP, primary_key=True, comment="统计日期0点")
+    merchant_id = Column(Integer, primary_key=True, comment="商户id")
+    deal_count = Column(Integer, nullable=False, default=0, comment="订单数量")
+    money = Column(Float, nullable=False, default=0, comment="订单折后总金额")
+    origin_money = Column(Float, nullable=False, default=0, comment="订单折扣前总金额")
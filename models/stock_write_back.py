@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from utils.db_util import Base
+from sqlalchemy import Column, String, Integer, TIMESTAMP
+"""
+库存回写批次表: 售出数量回写数据库时与扣减库存在同一事务内记录批次id, 同一批次重复回写时跳过
+"""
+
+
+class StockWriteBack(Base):
+    __tablename__ = "t_stock_write_back"
+
+    batch_id = Column(String(32), primary_key=True, comment="回写批次id")
+    product_count = Column(Integer, nullable=False, default=0, comment="本批回写的商品数")
+    create_time = Column(TIMESTAMP, index=True, comment="回写时间")
+
+    def __init__(self, batch_id, product_count, create_time):
+        self.batch_id = batch_id
+        self.product_count = product_count
+        self.create_time = create_time
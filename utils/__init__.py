@@ -1,13 +1,24 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+import queue
+import atexit
 import inspect
 import logging
-from functools import wraps
-from logging.handlers import TimedRotatingFileHandler
-from config import app_log_path, msg_log_path
+from functools import wraps, lru_cache
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+from config import app_log_path, msg_log_path, log_config
 from asgi_request_id import get_request_id
 
 
+@lru_cache(maxsize=1024)
+def short_file_name(file_path):
+    """
+    只取文件名，不带路径(按路径缓存, 避免每条日志重复计算)
+    """
+    return os.path.basename(file_path)
+
+
 class MyLogger:
     def process(func):
         """
@@ -15,14 +26,20 @@ class MyLogger:
         """
         @wraps(func)
         def wrapper(self, msg, *args, **kwargs):
-            # 获取调用方所在栈帧(第2帧，数组下标为1)
-            frame = inspect.stack()[1]
+            if self.fast_mode:
+                # 直接获取调用方栈帧(第2帧), 不构造整个调用栈及源码上下文
+                frame = sys._getframe(1)
+                file_name = short_file_name(frame.f_code.co_filename)
+                file_no = frame.f_lineno
+            else:
+                # 获取调用方所在栈帧(第2帧，数组下标为1)
+                frame = inspect.stack()[1]
 
-            # 获取调用方所文件名，这里只取文件名，不带路径
-            file_name = os.path.basename(frame[1])
+                # 获取调用方所文件名，这里只取文件名，不带路径
+                file_name = os.path.basename(frame[1])
 
-            # 获取代码行数
-            file_no = frame[2]
+                # 获取代码行数
+                file_no = frame[2]
 
             kwargs["extra"] = {
                 # 当前请求id
@@ -35,8 +52,9 @@ class MyLogger:
             func(self, msg, *args, **kwargs)
         return wrapper
 
-    def __init__(self, name):
+    def __init__(self, name, fast_mode=True):
         self.logger = logging.getLogger(name)
+        self.fast_mode = fast_mode
 
     def setLevel(self, log_level):
         self.logger.setLevel(log_level)
@@ -44,6 +62,9 @@ class MyLogger:
     def addHandler(self, handler):
         self.logger.addHandler(handler)
 
+    def isEnabledFor(self, log_level):
+        return self.logger.isEnabledFor(log_level)
+
     @process
     def debug(self, msg, *args, **kwargs):
         self.logger.debug(msg, *args, **kwargs)
@@ -54,30 +75,66 @@ class MyLogger:
 
     @process
     def warn(self, msg, *args, **kwargs):
-        self.logger.warn(msg, *args, **kwargs)
+        self.logger.warning(msg, *args, **kwargs)
 
     @process
     def error(self, msg, *args, **kwargs):
         self.logger.error(msg, *args, **kwargs)
 
 
+class FastQueueHandler(QueueHandler):
+    """
+    轻量队列handler: 只在请求线程中完成消息参数插值, 不复制日志记录, 完整格式化交给后台线程
+    """
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+# 后台写日志线程, 进程退出前停止并写完队列中剩余日志
+log_listeners = []
+
+
+def add_file_handler(logger, handler, async_write=True):
+    """
+    为logger添加文件handler, async_write为True时日志记录先投递到队列, 由后台线程写入文件
+    """
+    if not async_write:
+        logger.addHandler(handler)
+        return
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(FastQueueHandler(log_queue))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    log_listeners.append(listener)
+
+
+@atexit.register
+def stop_log_listeners():
+    for listener in log_listeners:
+        listener.stop()
+    log_listeners.clear()
+
+
 # 定义handler的输出格式(新增自定义的request id)
 # formatter = logging.Formatter("%(asctime)s %(request_id)s %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s")
 formatter = logging.Formatter("%(asctime)s %(request_id)s %(file_name)s[line:%(file_no)d] - %(levelname)s: %(message)s")
 
 # Web应用日志
-app_logger = MyLogger("App Logger")
+app_logger = MyLogger("App Logger", log_config["fast_mode"])
 app_logger.setLevel(logging.DEBUG)
 app_fh = TimedRotatingFileHandler(filename=app_log_path, when='midnight', backupCount=30)
 app_fh.setLevel(logging.DEBUG)
 app_fh.setFormatter(formatter)
-app_logger.addHandler(app_fh)
+add_file_handler(app_logger, app_fh, log_config["async_write"])
 
 
 # WebSocket Server日志
-msg_logger = MyLogger("Message Logger")
+msg_logger = MyLogger("Message Logger", log_config["fast_mode"])
 msg_logger.setLevel(logging.DEBUG)
 msg_fh = TimedRotatingFileHandler(filename=msg_log_path, when='midnight', backupCount=30)
 msg_fh.setLevel(logging.DEBUG)
 msg_fh.setFormatter(formatter)
-msg_logger.addHandler(msg_fh)
+add_file_handler(msg_logger, msg_fh, log_config["async_write"])
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+活动商品视图工具类: 按活动维护反范式的活动商品视图, 查询活动商品列表时无需读取全部商户信息, 支持分页
+    activity_products_by_discount_{活动id}: 有序集合, 分值为折扣
+    activity_products_by_merchant_{活动id}: 有序集合, 分值为商户id(按商户过滤时ZRANGEBYSCORE)
+    activity_product_cards_{活动id}: 哈希, 商品id -> 商品卡片JSON(商品名称、封面、单价、折扣、商户名称)
+商品加入活动时写入视图(并从商品原活动的视图中移除), 商品或商户信息变更投影到缓存时刷新卡片,
+视图与活动信息一样在活动结束时刻过期
+"""
+import json
+
+from utils import product_cache_util, merchant_cache_util
+from utils.json_encoder import JsonEncoder
+from utils.redis_util import redis_client
+
+# 商品卡片取自商品缓存的字段
+CARD_FIELDS = ["id", "product_name", "product_cover", "price", "merchant_id"]
+
+# KEYS: 排序集合key, 商品卡片key
+# ARGV: 商户id(不按商户过滤时为空串), 起始下标, 商品数
+# 返回: {商品总数, 商品卡片...}
+LIST_SCRIPT = redis_client.register_script("""
+local ids, total
+if ARGV[1] ~= '' then
+    ids = redis.call('zrangebyscore', KEYS[1], ARGV[1], ARGV[1], 'LIMIT', ARGV[2], ARGV[3])
+    total = redis.call('zcount', KEYS[1], ARGV[1], ARGV[1])
+else
+    ids = redis.call('zrange', KEYS[1], ARGV[2], ARGV[2] + ARGV[3] - 1)
+    total = redis.call('zcard', KEYS[1])
+end
+local cards = {}
+if #ids > 0 then
+    cards = redis.call('hmget', KEYS[2], unpack(ids))
+end
+for i = 1, #cards do
+    cards[i] = cards[i] or ''
+end
+return {total, cards}
+""")
+
+
+def by_discount_key(activity_id):
+    return f"activity_products_by_discount_{activity_id}"
+
+
+def by_merchant_key(activity_id):
+    return f"activity_products_by_merchant_{activity_id}"
+
+
+def cards_key(activity_id):
+    return f"activity_product_cards_{activity_id}"
+
+
+def view_keys(activity_id):
+    return [by_discount_key(activity_id), by_merchant_key(activity_id), cards_key(activity_id)]
+
+
+def make_card(product, discount, merchant_names):
+    return {
+        "product_id": product["id"],
+        "product_name": product["product_name"],
+        "product_cover": product["product_cover"],
+        "price": product["price"],
+        "discount": float(discount),
+        "merchant_id": product["merchant_id"],
+        "merchant_name": merchant_names.get(product["merchant_id"])
+    }
+
+
+def queue_add(pipe, activity_id, cards, expire_at):
+    """
+    在pipeline中加入写入商品卡片的命令
+    :param cards: 商品卡片列表
+    :param expire_at: 活动结束时间戳
+    """
+    if not cards:
+        return
+    pipe.zadd(by_discount_key(activity_id), {card["product_id"]: card["discount"] for card in cards})
+    pipe.zadd(by_merchant_key(activity_id), {card["product_id"]: card["merchant_id"] for card in cards})
+    pipe.hset(cards_key(activity_id), mapping={card["product_id"]: json.dumps(card, cls=JsonEncoder)
+                                               for card in cards})
+    queue_expire(pipe, activity_id, expire_at)
+
+
+def queue_remove(pipe, activity_id, product_ids):
+    if not product_ids:
+        return
+    pipe.zrem(by_discount_key(activity_id), *product_ids)
+    pipe.zrem(by_merchant_key(activity_id), *product_ids)
+    pipe.hdel(cards_key(activity_id), *product_ids)
+
+
+def queue_expire(pipe, activity_id, expire_at):
+    for key in view_keys(activity_id):
+        pipe.expireat(key, int(expire_at))
+
+
+def queue_drop(pipe, activity_id):
+    pipe.delete(*view_keys(activity_id))
+
+
+def add_products(session, activity, products, discounts, expire_at):
+    """
+    将商品加入活动: 写入活动折扣表、商品活动映射及活动商品视图, 商品已在其他活动中时从原活动视图中移除
+    :param activity: 活动信息
+    :param products: 商品缓存信息列表(至少包含CARD_FIELDS字段)
+    :param discounts: {商品id: 折扣}
+    :param expire_at: 活动结束时间戳
+    """
+    activity_id = activity["id"]
+    product_ids = [product["id"] for product in products]
+    previous = redis_client.mget([f"activity_of_product_{product_id}" for product_id in product_ids])
+    merchant_names = merchant_cache_util.get_merchant_names(session, {product["merchant_id"] for product in products})
+    cards = [make_card(product, discounts[product["id"]], merchant_names) for product in products]
+
+    pipe = redis_client.pipeline(transaction=True)
+    moved = {}
+    for product_id, previous_id in zip(product_ids, previous):
+        if previous_id is not None and previous_id != str(activity_id):
+            moved.setdefault(previous_id, []).append(product_id)
+    for previous_id, moved_ids in moved.items():
+        queue_remove(pipe, previous_id, moved_ids)
+    discount_key = f"discount_of_activity_{activity_id}"
+    for card in cards:
+        pipe.hset(discount_key, card["product_id"], card["discount"])
+        pipe.set(f"activity_of_product_{card['product_id']}", activity_id)
+        pipe.expireat(f"activity_of_product_{card['product_id']}", int(expire_at))
+    pipe.expireat(discount_key, int(expire_at))
+    queue_add(pipe, activity_id, cards, expire_at)
+    pipe.execute()
+
+
+def rebuild_view(session, activity_id, product_ids, expire_at):
+    """
+    按活动折扣表重建活动商品视图(活动商品视图上线前已加入活动的商品)
+    :param product_ids: 当前仍映射到该活动的商品id列表
+    """
+    discounts = redis_client.hmget(f"discount_of_activity_{activity_id}", product_ids) if product_ids else []
+    products = [product for product in product_cache_util.get_products(product_ids, CARD_FIELDS) if product is not None]
+    merchant_names = merchant_cache_util.get_merchant_names(session, {product["merchant_id"] for product in products})
+    discounts = dict(zip([int(product_id) for product_id in product_ids], discounts))
+    cards = [make_card(product, discounts[product["id"]], merchant_names) for product in products
+             if discounts.get(product["id"])]
+    pipe = redis_client.pipeline(transaction=True)
+    queue_drop(pipe, activity_id)
+    queue_add(pipe, activity_id, cards, expire_at)
+    pipe.execute()
+
+
+def refresh_products(session, products, removed_ids):
+    """
+    商品信息变更投影到缓存后刷新其所在活动的商品卡片
+    :param products: 最新商品信息列表
+    :param removed_ids: 已删除的商品id列表
+    """
+    products = list(products)
+    product_ids = [product["id"] for product in products] + list(removed_ids)
+    if not product_ids:
+        return
+    activity_ids = redis_client.mget([f"activity_of_product_{product_id}" for product_id in product_ids])
+    mapped = {product_id: activity_id for product_id, activity_id in zip(product_ids, activity_ids)
+              if activity_id is not None}
+    if not mapped:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for product_id, activity_id in mapped.items():
+        pipe.hget(cards_key(activity_id), product_id)
+    old_cards = {product_id: card for product_id, card in zip(mapped.keys(), pipe.execute()) if card}
+    updated = [product for product in products if product["id"] in old_cards]
+    merchant_names = merchant_cache_util.get_merchant_names(session, {product["merchant_id"] for product in updated})
+
+    pipe = redis_client.pipeline(transaction=True)
+    for product in updated:
+        card = make_card(product, json.loads(old_cards[product["id"]])["discount"], merchant_names)
+        pipe.hset(cards_key(mapped[product["id"]]), product["id"], json.dumps(card, cls=JsonEncoder))
+    for product_id in removed_ids:
+        if product_id in mapped:
+            queue_remove(pipe, mapped[product_id], [product_id])
+    pipe.execute()
+
+
+def refresh_merchants(merchant_names, activity_ids):
+    """
+    商户名称变更后刷新进行中及未开始活动内该商户的商品卡片
+    :param merchant_names: {商户id: 商户名称}
+    :param activity_ids: 进行中及未开始的活动id列表
+    """
+    if not merchant_names or not activity_ids:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    targets = []
+    for activity_id in activity_ids:
+        for merchant_id in merchant_names:
+            pipe.zrangebyscore(by_merchant_key(activity_id), merchant_id, merchant_id)
+            targets.append((activity_id, merchant_id))
+    product_ids = pipe.execute()
+    targets = [(activity_id, merchant_id, ids) for (activity_id, merchant_id), ids in zip(targets, product_ids) if ids]
+    if not targets:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for activity_id, _, ids in targets:
+        pipe.hmget(cards_key(activity_id), ids)
+    pipe_cards = pipe.execute()
+    pipe = redis_client.pipeline(transaction=True)
+    for (activity_id, merchant_id, ids), cards in zip(targets, pipe_cards):
+        mapping = {}
+        for product_id, card in zip(ids, cards):
+            if card:
+                card = json.loads(card)
+                card["merchant_name"] = merchant_names[merchant_id]
+                mapping[product_id] = json.dumps(card, cls=JsonEncoder)
+        if mapping:
+            pipe.hset(cards_key(activity_id), mapping=mapping)
+    pipe.execute()
+
+
+def list_products(activity_id, merchant_id=None, offset=0, count=20):
+    """
+    分页查询活动商品, 不按商户过滤时按折扣从低到高排序
+    :param merchant_id: 只查询该商户的商品, 不传则查询全部
+    :return: (商品总数, 商品卡片列表)
+    """
+    key = by_discount_key(activity_id) if merchant_id is None else by_merchant_key(activity_id)
+    total, cards = LIST_SCRIPT(keys=[key, cards_key(activity_id)],
+                               args=["" if merchant_id is None else merchant_id, offset, count])
+    return total, [json.loads(card) for card in cards if card]
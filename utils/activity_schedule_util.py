@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+营销活动调度工具类: 用redis有序集合维护活动日历, 按活动状态划分
+    activity_calendar_upcoming: 未开始的活动, 分值为开始时间戳
+    activity_calendar_running: 进行中的活动, 分值为结束时间戳
+    activity_calendar_ended: 已结束的活动, 分值为结束时间戳
+    activity_calendar_begin/activity_calendar_end: 全部活动的开始/结束时间戳
+活动卡片(列表展示信息)存于activity_cards哈希, 活动列表按状态分页查询只需一次lua脚本调用, 不再扫描活动表
+定时任务每秒将到达开始时间的活动移入进行中(预热活动信息及折扣表), 将到达结束时间的活动移入已结束并清理缓存,
+活动信息、折扣表、商品活动映射及活动商品视图均以EXPIREAT在活动结束时刻准确过期
+    状态迁移先于预热/清理执行, 每次推进时按缓存是否存在补齐: 进行中但活动信息缺失的活动重新预热,
+    近期结束但缓存仍存在的活动重新清理, 预热或清理失败时下一次推进自动重试
+"""
+import json
+import time
+
+from config import activity_schedule_config
+from consts import get_activity_status_desc
+from utils import app_logger as logger, price_util, activity_product_util
+from utils.json_encoder import JsonEncoder
+from utils.redis_util import redis_client
+from utils.db_util import session_class
+from models.activity import Activity
+
+UPCOMING_KEY = "activity_calendar_upcoming"
+RUNNING_KEY = "activity_calendar_running"
+ENDED_KEY = "activity_calendar_ended"
+BEGIN_KEY = "activity_calendar_begin"
+END_KEY = "activity_calendar_end"
+CARDS_KEY = "activity_cards"
+STATE_KEYS = {"upcoming": UPCOMING_KEY, "running": RUNNING_KEY, "ended": ENDED_KEY}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# KEYS: 未开始, 进行中, 已结束, 结束时间
+# ARGV: 当前时间戳
+# 返回: {本次开始的活动id列表, 本次结束的活动id列表}
+TICK_SCRIPT = redis_client.register_script("""
+local started = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1])
+for _, activity_id in ipairs(started) do
+    redis.call('zrem', KEYS[1], activity_id)
+    redis.call('zadd', KEYS[2], redis.call('zscore', KEYS[4], activity_id), activity_id)
+end
+local ended = redis.call('zrangebyscore', KEYS[2], '-inf', ARGV[1])
+for _, activity_id in ipairs(ended) do
+    redis.call('zrem', KEYS[2], activity_id)
+    redis.call('zadd', KEYS[3], redis.call('zscore', KEYS[4], activity_id), activity_id)
+end
+return {started, ended}
+""")
+
+# KEYS: 活动日历key, 活动卡片key
+# ARGV: 起始下标, 结束下标, 是否倒序
+LIST_SCRIPT = redis_client.register_script("""
+local ids
+if ARGV[3] == '1' then
+    ids = redis.call('zrevrange', KEYS[1], ARGV[1], ARGV[2])
+else
+    ids = redis.call('zrange', KEYS[1], ARGV[1], ARGV[2])
+end
+local cards = {}
+if #ids > 0 then
+    cards = redis.call('hmget', KEYS[2], unpack(ids))
+end
+for i = 1, #cards do
+    cards[i] = cards[i] or ''
+end
+return {redis.call('zcard', KEYS[1]), cards}
+""")
+
+
+def activity_key(activity_id):
+    return f"activity_{activity_id}"
+
+
+def discount_key(activity_id):
+    return f"discount_of_activity_{activity_id}"
+
+
+def activity_products(activity_id):
+    """
+    :return: 折扣表中当前仍映射到该活动的商品id列表(商品可能已被加入其他活动)
+    """
+    product_ids = [product_id for product_id in redis_client.hkeys(discount_key(activity_id)) if product_id != ""]
+    if not product_ids:
+        return []
+    mapped = redis_client.mget([f"activity_of_product_{product_id}" for product_id in product_ids])
+    return [product_id for product_id, value in zip(product_ids, mapped) if value == str(activity_id)]
+
+
+def queue_warm(pipe, activity, end_ts):
+    """
+    在pipeline中加入写入活动信息、折扣表(不存在时插入空数据占位符)并设置在活动结束时刻过期的命令
+    """
+    activity_id = activity["id"]
+    pipe.set(activity_key(activity_id), json.dumps(activity, cls=JsonEncoder))
+    pipe.expireat(activity_key(activity_id), int(end_ts))
+    pipe.hsetnx(discount_key(activity_id), "", "")
+    pipe.expireat(discount_key(activity_id), int(end_ts))
+
+
+def schedule(activity):
+    """
+    新建或修改活动后写入活动日历、活动卡片及活动缓存(提交后调用)
+    :param activity: 活动信息(Activity.to_dict())
+    """
+    activity_id = activity["id"]
+    begin_ts = activity["begin_time"].timestamp()
+    end_ts = activity["end_time"].timestamp()
+    now = time.time()
+    product_ids = activity_products(activity_id)
+
+    pipe = redis_client.pipeline(transaction=True)
+    for key in STATE_KEYS.values():
+        pipe.zrem(key, activity_id)
+    pipe.zadd(BEGIN_KEY, {activity_id: begin_ts})
+    pipe.zadd(END_KEY, {activity_id: end_ts})
+    if now < begin_ts:
+        pipe.zadd(UPCOMING_KEY, {activity_id: begin_ts})
+    elif now < end_ts:
+        pipe.zadd(RUNNING_KEY, {activity_id: end_ts})
+    else:
+        pipe.zadd(ENDED_KEY, {activity_id: end_ts})
+    pipe.hset(CARDS_KEY, activity_id, json.dumps(activity, cls=JsonEncoder))
+    if now < end_ts:
+        queue_warm(pipe, activity, end_ts)
+        # 活动结束时间变更时同步调整商品活动映射及活动商品视图的过期时间
+        for product_id in product_ids:
+            pipe.expireat(f"activity_of_product_{product_id}", int(end_ts))
+        activity_product_util.queue_expire(pipe, activity_id, end_ts)
+    pipe.execute()
+    price_util.invalidate_products(product_ids)
+
+
+def unschedule(activity_id):
+    """
+    删除活动后移除活动日历、活动卡片及活动缓存(提交后调用)
+    """
+    product_ids = activity_products(activity_id)
+    pipe = redis_client.pipeline(transaction=True)
+    for key in list(STATE_KEYS.values()) + [BEGIN_KEY, END_KEY]:
+        pipe.zrem(key, activity_id)
+    pipe.hdel(CARDS_KEY, activity_id)
+    pipe.delete(activity_key(activity_id), discount_key(activity_id))
+    activity_product_util.queue_drop(pipe, activity_id)
+    for product_id in product_ids:
+        pipe.delete(f"activity_of_product_{product_id}")
+    pipe.execute()
+    price_util.invalidate_products(product_ids)
+
+
+def load_activities(activity_ids):
+    session = session_class()
+    try:
+        activities = [activity.to_dict() for activity in
+                      session.query(Activity).filter(Activity.id.in_(activity_ids))]
+        session.commit()
+        return activities
+    finally:
+        session.close()
+
+
+def count_caches(activity_ids):
+    """
+    :return: [(活动id, 活动信息及折扣表中存在的key数)], 已预热的活动为2, 已清理的活动为0
+    """
+    if not activity_ids:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for activity_id in activity_ids:
+        pipe.exists(activity_key(activity_id), discount_key(activity_id))
+    return list(zip(activity_ids, pipe.execute()))
+
+
+def tick():
+    """
+    推进活动状态(定时任务): 进行中但未预热的活动预热缓存, 近期结束但仍有缓存的活动清理缓存
+    """
+    now = time.time()
+    started, ended = TICK_SCRIPT(keys=[UPCOMING_KEY, RUNNING_KEY, ENDED_KEY, END_KEY], args=[now])
+    # 包含本次开始的活动及此前预热失败的活动
+    cold = [activity_id for activity_id, count in count_caches(redis_client.zrange(RUNNING_KEY, 0, -1)) if count < 2]
+    if cold:
+        pipe = redis_client.pipeline(transaction=False)
+        for activity in load_activities(cold):
+            queue_warm(pipe, activity, activity["end_time"].timestamp())
+        pipe.execute()
+        for activity_id in cold:
+            price_util.invalidate_activity(activity_id)
+        logger.info(f"营销活动已开始: {cold}")
+    # 包含本次结束的活动及此前清理失败的活动
+    stale = [activity_id for activity_id, count in count_caches(redis_client.zrangebyscore(
+        ENDED_KEY, now - activity_schedule_config["ended_retry_seconds"], "+inf")) if count > 0]
+    if stale:
+        for activity_id in stale:
+            price_util.invalidate_activity(activity_id)
+        pipe = redis_client.pipeline(transaction=False)
+        for activity_id in stale:
+            pipe.delete(activity_key(activity_id), discount_key(activity_id))
+            activity_product_util.queue_drop(pipe, activity_id)
+        pipe.execute()
+    if ended:
+        logger.info(f"营销活动已结束: {ended}")
+
+
+def sync_from_db():
+    """
+    按活动表重建活动日历(启动时执行, 补齐本功能上线前创建的活动)
+    """
+    session = session_class()
+    try:
+        activities = [activity.to_dict() for activity in session.query(Activity)]
+        session.commit()
+        activity_ids = {str(activity["id"]) for activity in activities}
+        stale_ids = [activity_id for activity_id in redis_client.hkeys(CARDS_KEY) if activity_id not in activity_ids]
+        for activity_id in stale_ids:
+            unschedule(activity_id)
+        now = time.time()
+        for activity in activities:
+            schedule(activity)
+            # 补齐未结束活动的活动商品视图
+            end_ts = activity["end_time"].timestamp()
+            if now < end_ts:
+                activity_product_util.rebuild_view(session, activity["id"], activity_products(activity["id"]), end_ts)
+        session.commit()
+    finally:
+        session.close()
+
+
+def live_activity_ids():
+    """
+    :return: 未开始及进行中的活动id列表
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zrange(UPCOMING_KEY, 0, -1)
+    pipe.zrange(RUNNING_KEY, 0, -1)
+    upcoming, running = pipe.execute()
+    return upcoming + running
+
+
+def list_activities(status=None, offset=0, count=10):
+    """
+    按状态分页查询活动
+    :param status: upcoming: 未开始(按开始时间正序), running: 进行中(按结束时间正序), ended: 已结束(按结束时间倒序),
+                   不传则查询全部(按开始时间倒序)
+    :return: (活动总数, 活动列表)
+    """
+    key = STATE_KEYS.get(status, BEGIN_KEY)
+    rev = 1 if status in (None, "ended") else 0
+    total, cards = LIST_SCRIPT(keys=[key, CARDS_KEY], args=[offset, offset + count - 1, rev])
+    now = time.strftime(TIME_FORMAT)
+    activities = []
+    for card in cards:
+        if not card:
+            continue
+        activity = json.loads(card)
+        activities.append({
+            "id": activity["id"],
+            "act_name": activity["act_name"],
+            "act_cover": activity["act_cover"],
+            "status": get_activity_status_desc(now, activity["begin_time"], activity["end_time"]),
+            "begin_time": activity["begin_time"],
+            "end_time": activity["end_time"]
+        })
+    return total, activities
+
+
+def count_activities():
+    """
+    :return: {状态: 活动数}
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for key in STATE_KEYS.values():
+        pipe.zcard(key)
+    return dict(zip(STATE_KEYS.keys(), pipe.execute()))
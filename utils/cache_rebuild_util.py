@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+缓存重建工具: redis数据丢失(清空、重启未持久化)后根据数据库重建商品缓存、商户商品集合、商户商品索引、
+搜索索引、分面计数、商户缓存及商户目录
+    rebuild: 按商品id区间分片, 多进程并行, 每个进程通过服务端游标流式读取分片内的商品, 按批pipeline写入,
+             只覆盖写入, 完成后重新投影重建期间变更的商品并删除数据库中已不存在的缓存商品, 适用于redis被清空后的重建
+    reconcile: 同样分片并行读取, 与缓存逐个比对, 只修复不一致或缺失的商品, 并删除数据库中已不存在的缓存商品
+重建完成后写入cache_rebuilt标记, 应用启动时标记不存在(redis被清空或首次上线)则在后台自动重建
+
+用法:
+    python -m utils.cache_rebuild_util rebuild --workers 8
+    python -m utils.cache_rebuild_util reconcile --workers 8
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+import argparse
+import multiprocessing
+from datetime import datetime
+from sqlalchemy import func
+
+from config import cache_rebuild_config
+from utils import app_logger as logger, product_cache_util, product_facet_util, product_search_util, \
+    merchant_cache_util, merchant_directory_util, outbox_util
+from utils.db_util import session_class, export_session_class
+from utils.redis_util import redis_client
+from models.product import Product
+from models.merchant import Merchant
+
+BUILT_KEY = "cache_rebuilt"
+
+
+def iter_rows(model, begin_id=None, end_id=None):
+    """
+    通过服务端游标按id顺序流式读取记录
+    :param begin_id: 起始id(包含), 不传则读取全表
+    :param end_id: 结束id(不包含)
+    :return: 生成器, 每次返回一批记录dict
+    """
+    session = export_session_class()
+    try:
+        stmt = model.__table__.select()
+        if begin_id is not None:
+            stmt = stmt.where(model.id >= begin_id, model.id < end_id)
+        result = session.execute(stmt.order_by(model.id).execution_options(stream_results=True))
+        for rows in result.mappings().partitions(cache_rebuild_config["batch_size"]):
+            yield [dict(row) for row in rows]
+        session.commit()
+    finally:
+        session.close()
+
+
+def id_shards(model):
+    """
+    按id区间将表划分为若干分片
+    :return: [(起始id, 结束id), ...]
+    """
+    session = session_class()
+    try:
+        min_id, max_id = session.query(func.min(model.id), func.max(model.id)).one()
+        session.commit()
+    finally:
+        session.close()
+    if min_id is None:
+        return []
+    step = cache_rebuild_config["shard_size"]
+    return [(begin, min(begin + step, max_id + 1)) for begin in range(min_id, max_id + 1, step)]
+
+
+def normalize(product):
+    """
+    统一缓存与数据库中商品信息的取值格式, 用于比对
+    """
+    return {field: str(product_cache_util.encode_value(value)) for field, value in product.items()}
+
+
+def process_shard(mode, begin_id, end_id):
+    """
+    重建/校正一个分片内的商品缓存(在工作进程中执行)
+    :return: (商品数, 修复的商品数)
+    """
+    count = repaired = 0
+    for products in iter_rows(Product, begin_id, end_id):
+        count += len(products)
+        if mode == "rebuild":
+            product_cache_util.fill_products(products)
+            continue
+        cached = product_cache_util.get_products([product["id"] for product in products])
+        changed = []
+        old_products = {}
+        for product, old_product in zip(products, cached):
+            if old_product is None or normalize(old_product) != normalize(product):
+                changed.append(product)
+                if old_product is not None:
+                    old_products[product["id"]] = old_product
+        product_cache_util.save_products(changed, old_products)
+        repaired += len(changed)
+    return count, repaired
+
+
+def remove_stale_products():
+    """
+    删除数据库中已不存在的缓存商品
+    :return: 删除的商品数
+    """
+    removed = 0
+    session = session_class()
+    try:
+        for products in product_cache_util.iter_cached_products(cache_rebuild_config["batch_size"]):
+            existing_ids = {product_id for product_id, in session.query(Product.id).filter(
+                Product.id.in_([product["id"] for product in products]))}
+            session.commit()
+            stale = [product for product in products if product["id"] not in existing_ids]
+            product_cache_util.remove_products(stale)
+            removed += len(stale)
+    finally:
+        session.close()
+    return removed
+
+
+def sync_merchants(mode):
+    """
+    重建/校正商户缓存, 只缓存审核通过的商户
+    :return: (审核通过的商户数, 写入的商户数)
+    """
+    approved_ids = set()
+    written = 0
+    for merchants in iter_rows(Merchant):
+        merchants = [merchant for merchant in merchants if merchant["status"] == 1]
+        approved_ids.update(merchant["id"] for merchant in merchants)
+        if mode == "reconcile" and merchants:
+            cached = redis_client.hmget("merchants", [merchant["id"] for merchant in merchants])
+            merchants = [merchant for merchant, value in zip(merchants, cached)
+                         if value is None or normalize(json.loads(value)) != normalize(merchant)]
+        merchant_cache_util.save_merchants(merchants)
+        written += len(merchants)
+    if mode == "reconcile":
+        merchant_cache_util.remove_merchants([int(merchant_id) for merchant_id in redis_client.hkeys("merchants")
+                                              if int(merchant_id) not in approved_ids])
+    return len(approved_ids), written
+
+
+def reproject_updated_since(since):
+    """
+    重新投影重建期间有变更的商品, 避免重建时读到的旧数据覆盖投影线程已写入的新数据
+    """
+    session = session_class()
+    try:
+        product_ids = [product_id for product_id, in session.query(Product.id).filter(Product.update_time >= since)]
+        for start in range(0, len(product_ids), cache_rebuild_config["batch_size"]):
+            outbox_util.project_products(session, product_ids[start: start + cache_rebuild_config["batch_size"]])
+        session.commit()
+    finally:
+        session.close()
+
+
+def run(mode="rebuild", workers=None):
+    """
+    重建或校正全部缓存
+    :param mode: rebuild: 全量写入, reconcile: 比对后只修复不一致的部分
+    :param workers: 并行进程数, 不传则使用配置值
+    :return: 统计信息
+    """
+    workers = workers or cache_rebuild_config["workers"]
+    start = time.time()
+    # TIMESTAMP精确到秒, 向前多取1秒
+    since = datetime.fromtimestamp(int(start) - 1)
+    shards = id_shards(Product)
+    if workers > 1 and len(shards) > 1:
+        # spawn方式启动工作进程, 不继承父进程的数据库连接及其他线程持有的锁
+        with multiprocessing.get_context("spawn").Pool(min(workers, len(shards))) as pool:
+            results = pool.starmap(process_shard, [(mode, begin_id, end_id) for begin_id, end_id in shards])
+    else:
+        results = [process_shard(mode, begin_id, end_id) for begin_id, end_id in shards]
+
+    stats = {
+        "mode": mode,
+        "products": sum(count for count, _ in results),
+        "repaired_products": sum(repaired for _, repaired in results)
+    }
+    if mode == "rebuild":
+        reproject_updated_since(since)
+    # 重建期间被删除的商品没有update_time可供重新投影, 可能已被读到旧数据的分片写回缓存, 两种模式都清理
+    stats["removed_products"] = remove_stale_products()
+    stats["merchants"], stats["written_merchants"] = sync_merchants(mode)
+    merchant_directory_util.sync_from_db()
+    product_facet_util.reconcile_facets()
+
+    redis_client.set(product_search_util.INDEX_BUILT_KEY, stats["products"])
+    redis_client.set(BUILT_KEY, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    stats["seconds"] = round(time.time() - start, 3)
+    logger.info(f"缓存{'重建' if mode == 'rebuild' else '校正'}完成: {stats}")
+    return stats
+
+
+def rebuild():
+    """
+    应用启动时的后台重建任务: 以独立进程执行命令行工具, 工作进程不会重新导入应用主模块
+    """
+    subprocess.run([sys.executable, "-m", "utils.cache_rebuild_util", "rebuild"], check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="根据数据库重建或校正redis缓存")
+    parser.add_argument("mode", choices=["rebuild", "reconcile"], help="rebuild: 全量重建, reconcile: 比对并修复不一致")
+    parser.add_argument("--workers", type=int, default=cache_rebuild_config["workers"], help="并行进程数")
+    args = parser.parse_args()
+    print(run(args.mode, args.workers))
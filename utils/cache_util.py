@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+进程内缓存工具类
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    有界LRU缓存, 每个条目单独指定过期时间戳, 超过容量时淘汰最久未访问的条目, 并统计命中/未命中次数
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()    # key -> (value, expire_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expire_at = item
+            if expire_at is not None and expire_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expire_at=None):
+        """
+        :param key: 缓存键
+        :param value: 缓存值
+        :param expire_at: 过期时间戳(秒), 不传则只会被LRU淘汰
+        """
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -3,8 +3,9 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.pool import QueuePool
-from config import db_config
+from sqlalchemy.pool import QueuePool, NullPool
+from config import db_config, async_config
+from utils import metrics_util
 
 
 def to_dict(self):
@@ -16,6 +17,8 @@ db_url = "mysql+pymysql://{}:{}@{}:{}/{}?charset=utf8".format(db_config["user"],
                                                               db_config["port"], db_config["dbname"])
 # 创建实例
 engine = create_engine(db_url, convert_unicode=True, poolclass=QueuePool, pool_size=8, echo=False, pool_recycle=3600)
+# 统计sql执行次数及耗时
+metrics_util.instrument_engine(engine)
 
 Base = declarative_base()  # 生成orm基类
 Base.to_dict = to_dict
@@ -30,6 +33,31 @@ def create_session():
     session.close()
 
 
+# 数据导出专用engine: 不使用连接池, 导出时单独建立连接、结束后立即关闭, 长时间的流式读取不占用接口连接池
+export_engine = create_engine(db_url, convert_unicode=True, poolclass=NullPool, echo=False)
+metrics_util.instrument_engine(export_engine)
+export_session_class = sessionmaker(bind=export_engine)
+
+
+# 异步模式下的engine及会话工厂(aiomysql/asyncmy驱动), 未开启异步模式时不创建, 避免强依赖异步驱动
+async_engine = None
+async_session_class = None
+if async_config["enable"]:
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    async_db_url = "mysql+{}://{}:{}@{}:{}/{}?charset=utf8".format(async_config["db_driver"], db_config["user"],
+                                                                  db_config["passwd"], db_config["host"],
+                                                                  db_config["port"], db_config["dbname"])
+    async_engine = create_async_engine(async_db_url, pool_size=async_config["db_pool_size"],
+                                       max_overflow=async_config["db_max_overflow"], echo=False, pool_recycle=3600)
+    async_session_class = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def create_async_session():
+    async with async_session_class() as session:
+        yield session
+
+
 # 创建库表
 # from models.merchant import Merchant
 # from models.deal import Deal
@@ -37,4 +65,7 @@ def create_session():
 # from models.product import Product
 # from models.user import User
 # from models.activity import Activity
+# from models.deal_rollup import DealRollupHourly, DealRollupDaily
+# from models.cache_outbox import CacheOutbox
+# from models.stock_write_back import StockWriteBack
 # Base.metadata.create_all(bind=engine)  # 创建表结构
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+订单计数工具类: 按天、商户、订单状态维护订单数量计数桶(redis哈希 deal_counts_{yyyymmdd}),
+字段格式 {merchant_id}:{deal_status} 及 all:{deal_status}, 已从数据库初始化过的桶带有 _seeded 字段
+任意时间段订单总数 = 已结束的完整天的计数桶之和 + 首尾不足一天部分及当天(含)之后部分的数据库精确计数
+(订单由小程序后台创建, 计数桶在当天结束后首次读取时从数据库初始化, 新订单无需单独计数)
+订单状态变更时只增量更新已初始化的计数桶, 初始化时WATCH计数桶, 期间有状态变更写入则重新统计,
+定时任务重新统计最近几天的计数桶, 并轮流重新统计更早的计数桶, 修正其他服务变更订单状态造成的偏差
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from redis.exceptions import WatchError
+from starlette.concurrency import run_in_threadpool
+
+from config import deal_counter_config
+from consts import DealStatusDesc
+from utils import app_logger as logger
+from utils.redis_util import redis_client, async_redis_client
+from utils.db_util import session_class
+from models.deal import Deal
+
+ONE_DAY = timedelta(days=1)
+SEEDED_FIELD = "_seeded"
+# 下一次轮流校正的起始天数偏移
+SWEEP_CURSOR_KEY = "deal_counts_sweep_cursor"
+SEED_RETRIES = 3
+
+# KEYS: 计数桶key
+# ARGV: 字段及增量...
+# 计数桶未初始化时不更新(初始化时从数据库统计), 避免生成没有过期时间的残缺计数桶
+INCR_SCRIPT = redis_client.register_script("""
+if redis.call('hexists', KEYS[1], '_seeded') == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('hincrby', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+""")
+
+
+def day_key(day):
+    return f"deal_counts_{day.strftime('%Y%m%d')}"
+
+
+def day_start(t):
+    return datetime(t.year, t.month, t.day)
+
+
+def seed_day(day):
+    """
+    从数据库重新统计某一天的计数桶(使用独立的会话, 每次统计都读取最新提交的数据)
+    统计期间计数桶被状态变更修改时放弃写入并重新统计, 多次重试仍冲突时返回统计结果但不写入, 下次读取时再初始化
+    :param day: 当天0点
+    """
+    key = day_key(day)
+    session = session_class()
+    pipe = redis_client.pipeline(transaction=True)
+    try:
+        for _ in range(SEED_RETRIES):
+            # 先WATCH再统计: 统计期间有状态变更写入计数桶时本次写入失败并重新统计;
+            # 快照之前提交、但在写入之后才计数的变更(提交与计数之间的极短窗口)会重复计入, 由定时校正修正
+            pipe.watch(key)
+            statistics = session.query(
+                Deal.merchant_id, Deal.deal_status, func.count(Deal.deal_no)
+            ).filter(
+                Deal.create_time >= day, Deal.create_time < day + ONE_DAY
+            ).group_by(Deal.merchant_id, Deal.deal_status).all()
+            session.commit()
+
+            mapping = {SEEDED_FIELD: 1}
+            for merchant_id, deal_status, count in statistics:
+                mapping[f"{merchant_id}:{deal_status}"] = count
+                mapping[f"all:{deal_status}"] = mapping.get(f"all:{deal_status}", 0) + count
+            pipe.multi()
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, deal_counter_config["expire_days"] * 86400)
+            try:
+                pipe.execute()
+                return mapping
+            except WatchError:
+                continue
+        logger.info(f"订单计数桶({key})初始化时持续有状态变更写入, 暂不写入")
+        return mapping
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        pipe.reset()
+        session.close()
+
+
+def record_status_changed(changes, new_status):
+    """
+    订单状态变更计数(状态变更提交后调用)
+    :param changes: [(merchant_id, create_time, old_status), ...]
+    :param new_status: 新状态
+    """
+    # {计数桶key: {字段: 增量}}
+    deltas = {}
+    for merchant_id, create_time, old_status in changes:
+        if old_status == new_status:
+            continue
+        fields = deltas.setdefault(day_key(create_time), {})
+        for field, delta in [(f"{merchant_id}:{old_status}", -1), (f"all:{old_status}", -1),
+                             (f"{merchant_id}:{new_status}", 1), (f"all:{new_status}", 1)]:
+            fields[field] = fields.get(field, 0) + delta
+    if not deltas:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    for key, fields in deltas.items():
+        args = []
+        for field, delta in fields.items():
+            args.extend((field, delta))
+        INCR_SCRIPT(keys=[key], args=args, client=pipe)
+    pipe.execute()
+
+
+def split_range(begin_time, end_time):
+    """
+    将[begin_time, end_time]拆分为已结束的完整天区间及需查库的区间(首尾不足一天部分、当天及之后)
+    :return: (完整天列表, 需查库的边缘区间列表[(起始, 结束, 结束是否包含)])
+    """
+    first_full = day_start(begin_time)
+    if first_full < begin_time:
+        first_full += ONE_DAY
+    last_full_end = day_start(end_time)
+    if end_time >= last_full_end + ONE_DAY - timedelta(seconds=1):
+        last_full_end += ONE_DAY
+    # 当天及之后的天尚未结束, 不读取计数桶
+    last_full_end = min(last_full_end, day_start(datetime.now()))
+    if first_full >= last_full_end:
+        return [], [(begin_time, end_time, True)]
+
+    days = []
+    day = first_full
+    while day < last_full_end:
+        days.append(day)
+        day += ONE_DAY
+    edges = []
+    if begin_time < first_full:
+        edges.append((begin_time, first_full, False))
+    if last_full_end <= end_time:
+        edges.append((last_full_end, end_time, True))
+    return days, edges
+
+
+def edge_filters(begin, end, end_inclusive):
+    if end_inclusive:
+        return [Deal.create_time.between(begin, end)]
+    return [Deal.create_time >= begin, Deal.create_time < end]
+
+
+def bucket_fields(merchant_id):
+    prefix = "all" if merchant_id is None else merchant_id
+    return [f"{prefix}:{status}" for status in DealStatusDesc] + [SEEDED_FIELD]
+
+
+def merge_bucket(status_counts, values):
+    """
+    将一个计数桶各状态字段值累加到status_counts
+    """
+    for status, value in zip(DealStatusDesc, values):
+        if value:
+            status_counts[status] += int(value)
+
+
+def get_status_counts(session, begin_time, end_time, merchant_id=None):
+    """
+    统计时间段内各状态订单数量
+    :param session: 数据库会话(用于统计首尾不足一天部分)
+    :param begin_time: 开始时间
+    :param end_time: 结束时间
+    :param merchant_id: 商户id, 不传则统计全商城
+    :return: {deal_status: count}
+    """
+    status_counts = {status: 0 for status in DealStatusDesc}
+    days, edges = split_range(begin_time, end_time)
+
+    for begin, end, end_inclusive in edges:
+        filters = edge_filters(begin, end, end_inclusive)
+        if merchant_id is not None:
+            filters.append(Deal.merchant_id == merchant_id)
+        statistics = session.query(Deal.deal_status, func.count(Deal.deal_no)).filter(*filters).group_by(Deal.deal_status)
+        for deal_status, count in statistics:
+            status_counts[deal_status] += count
+
+    if days:
+        fields = bucket_fields(merchant_id)
+        pipe = redis_client.pipeline(transaction=False)
+        for day in days:
+            pipe.hmget(day_key(day), fields)
+        for day, values in zip(days, pipe.execute()):
+            if values[-1] is None:
+                # 计数桶未初始化, 从数据库统计
+                mapping = seed_day(day)
+                values = [mapping.get(field) for field in fields]
+            merge_bucket(status_counts, values[:-1])
+    return status_counts
+
+
+def sum_statuses(status_counts, statuses):
+    if statuses is None:
+        return sum(status_counts.values())
+    return sum(status_counts.get(status, 0) for status in statuses)
+
+
+def count_deals(session, begin_time, end_time, merchant_id=None, statuses=None):
+    """
+    统计时间段内订单总数
+    :param statuses: 订单状态列表, 不传则统计全部状态
+    """
+    return sum_statuses(get_status_counts(session, begin_time, end_time, merchant_id), statuses)
+
+
+async def get_status_counts_async(session, begin_time, end_time, merchant_id=None):
+    """
+    get_status_counts的异步版本(异步会话 + 异步redis客户端), 计数桶未初始化时在线程池中初始化
+    :param session: 异步数据库会话
+    """
+    status_counts = {status: 0 for status in DealStatusDesc}
+    days, edges = split_range(begin_time, end_time)
+
+    for begin, end, end_inclusive in edges:
+        filters = edge_filters(begin, end, end_inclusive)
+        if merchant_id is not None:
+            filters.append(Deal.merchant_id == merchant_id)
+        statistics = await session.execute(
+            select(Deal.deal_status, func.count(Deal.deal_no)).where(*filters).group_by(Deal.deal_status))
+        for deal_status, count in statistics:
+            status_counts[deal_status] += count
+
+    if days:
+        fields = bucket_fields(merchant_id)
+        pipe = async_redis_client.pipeline(transaction=False)
+        for day in days:
+            pipe.hmget(day_key(day), fields)
+        for day, values in zip(days, await pipe.execute()):
+            if values[-1] is None:
+                mapping = await run_in_threadpool(seed_day, day)
+                values = [mapping.get(field) for field in fields]
+            merge_bucket(status_counts, values[:-1])
+    return status_counts
+
+
+async def count_deals_async(session, begin_time, end_time, merchant_id=None, statuses=None):
+    """
+    count_deals的异步版本
+    """
+    return sum_statuses(await get_status_counts_async(session, begin_time, end_time, merchant_id), statuses)
+
+
+def reconcile_buckets():
+    """
+    重新统计最近几天(不含当天)的计数桶, 并从更早的计数桶中轮流取sweep_days天重新统计(不存在的计数桶跳过),
+    expire_days / sweep_days 个校正周期覆盖全部保留天数, 修正其他服务(如小程序后台)变更订单状态造成的偏差
+    """
+    try:
+        today = day_start(datetime.now())
+        recent_days = deal_counter_config["reconcile_days"]
+        for i in range(1, recent_days + 1):
+            seed_day(today - i * ONE_DAY)
+
+        older = deal_counter_config["expire_days"] - recent_days
+        if older <= 0:
+            return
+        cursor = int(redis_client.get(SWEEP_CURSOR_KEY) or 0) % older
+        sweep = min(deal_counter_config["sweep_days"], older)
+        redis_client.set(SWEEP_CURSOR_KEY, (cursor + sweep) % older)
+        days = [today - (recent_days + 1 + (cursor + i) % older) * ONE_DAY for i in range(sweep)]
+        pipe = redis_client.pipeline(transaction=False)
+        for day in days:
+            pipe.exists(day_key(day))
+        for day, exists in zip(days, pipe.execute()):
+            if exists:
+                seed_day(day)
+    except Exception as e:
+        logger.error(f"订单计数桶校正失败: {repr(e)}")
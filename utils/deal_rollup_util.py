@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+订单销量汇总工具类: 定时任务按水位线将已结束的小时滚动汇总到小时表, 已结束的天再由小时表汇总到天表
+水位线(redis deal_rollup_hourly_watermark / deal_rollup_daily_watermark)之前的时间段已汇总完成,
+任意时间段销量 = 天表中的完整天 + 小时表中的完整小时 + 首尾不足一小时及水位线之后部分的实时统计
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, and_
+
+from config import deal_rollup_config
+from utils import app_logger as logger
+from utils.redis_util import redis_client
+from utils.db_util import session_class
+from models.deal import Deal
+from models.deal_rollup import DealRollupHourly, DealRollupDaily
+
+ONE_HOUR = timedelta(hours=1)
+ONE_DAY = timedelta(days=1)
+ONE_SECOND = timedelta(seconds=1)
+WATERMARK_FORMAT = "%Y%m%d%H"
+HOURLY_WATERMARK_KEY = "deal_rollup_hourly_watermark"
+DAILY_WATERMARK_KEY = "deal_rollup_daily_watermark"
+
+
+def floor_hour(t):
+    return datetime(t.year, t.month, t.day, t.hour)
+
+
+def ceil_hour(t):
+    hour = floor_hour(t)
+    return hour if hour == t else hour + ONE_HOUR
+
+
+def floor_day(t):
+    return datetime(t.year, t.month, t.day)
+
+
+def ceil_day(t):
+    day = floor_day(t)
+    return day if day == t else day + ONE_DAY
+
+
+def parse_watermark(value):
+    return None if value is None else datetime.strptime(value, WATERMARK_FORMAT)
+
+
+def load_watermarks(session):
+    """
+    读取小时表、天表水位线, redis中不存在时根据汇总表及订单表推算
+    :return: (小时表水位线, 天表水位线)
+    """
+    hourly, daily = (parse_watermark(value) for value in redis_client.mget(HOURLY_WATERMARK_KEY, DAILY_WATERMARK_KEY))
+    if hourly is None:
+        last_bucket = session.query(func.max(DealRollupHourly.bucket_time)).scalar()
+        if last_bucket is not None:
+            hourly = last_bucket + ONE_HOUR
+        else:
+            first_deal_time = session.query(func.min(Deal.create_time)).scalar()
+            hourly = floor_hour(first_deal_time or datetime.now())
+    if daily is None:
+        last_bucket = session.query(func.max(DealRollupDaily.bucket_time)).scalar()
+        if last_bucket is not None:
+            daily = last_bucket + ONE_DAY
+        else:
+            first_bucket = session.query(func.min(DealRollupHourly.bucket_time)).scalar()
+            daily = floor_day(first_bucket or hourly)
+    return hourly, daily
+
+
+def roll_hours(session, begin, end):
+    """
+    从订单表重新汇总[begin, end)内各小时数据到小时表
+    """
+    bucket = func.date_format(Deal.create_time, "%Y-%m-%d %H:00:00")
+    statistics = session.query(
+        bucket, Deal.merchant_id, func.count(Deal.deal_no), func.sum(Deal.money), func.sum(Deal.origin_money)
+    ).filter(
+        Deal.create_time >= begin, Deal.create_time < end
+    ).group_by(bucket, Deal.merchant_id)
+    rows = [{
+        "bucket_time": datetime.strptime(bucket_time, "%Y-%m-%d %H:%M:%S"),
+        "merchant_id": merchant_id,
+        "deal_count": deal_count,
+        "money": money or 0,
+        "origin_money": origin_money or 0
+    } for bucket_time, merchant_id, deal_count, money, origin_money in statistics]
+    session.query(DealRollupHourly).filter(DealRollupHourly.bucket_time >= begin,
+                                           DealRollupHourly.bucket_time < end).delete(synchronize_session=False)
+    session.bulk_insert_mappings(DealRollupHourly, rows)
+
+
+def roll_days(session, begin, end):
+    """
+    从小时表重新汇总[begin, end)内各天数据到天表
+    """
+    bucket = func.date(DealRollupHourly.bucket_time)
+    statistics = session.query(
+        bucket, DealRollupHourly.merchant_id, func.sum(DealRollupHourly.deal_count),
+        func.sum(DealRollupHourly.money), func.sum(DealRollupHourly.origin_money)
+    ).filter(
+        DealRollupHourly.bucket_time >= begin, DealRollupHourly.bucket_time < end
+    ).group_by(bucket, DealRollupHourly.merchant_id)
+    rows = [{
+        "bucket_time": datetime(day.year, day.month, day.day),
+        "merchant_id": merchant_id,
+        "deal_count": int(deal_count),
+        "money": money or 0,
+        "origin_money": origin_money or 0
+    } for day, merchant_id, deal_count, money, origin_money in statistics]
+    session.query(DealRollupDaily).filter(DealRollupDaily.bucket_time >= begin,
+                                          DealRollupDaily.bucket_time < end).delete(synchronize_session=False)
+    session.bulk_insert_mappings(DealRollupDaily, rows)
+
+
+def roll_forward():
+    """
+    将水位线推进到最近一个已结束(且超过settle_seconds)的小时, 并汇总其间已结束的天(定时任务调用)
+    """
+    session = session_class()
+    try:
+        hourly, daily = load_watermarks(session)
+        closed = floor_hour(datetime.now() - timedelta(seconds=deal_rollup_config["settle_seconds"]))
+        while hourly < closed:
+            stop = min(closed, hourly + deal_rollup_config["batch_hours"] * ONE_HOUR)
+            roll_hours(session, hourly, stop)
+            session.commit()
+            hourly = stop
+            redis_client.set(HOURLY_WATERMARK_KEY, hourly.strftime(WATERMARK_FORMAT))
+
+        closed_day = floor_day(hourly)
+        if daily < closed_day:
+            roll_days(session, daily, closed_day)
+            session.commit()
+            redis_client.set(DAILY_WATERMARK_KEY, closed_day.strftime(WATERMARK_FORMAT))
+    except Exception as e:
+        session.rollback()
+        logger.error(f"订单销量汇总失败: {repr(e)}")
+    finally:
+        session.close()
+
+
+def split_range(begin_time, end_time, hourly, daily):
+    """
+    将[begin_time, end_time]拆分为天表区间、小时表区间及需实时统计的区间
+    :param hourly: 小时表水位线
+    :param daily: 天表水位线
+    :return: (天表区间列表[(起始, 结束)], 小时表区间列表[(起始, 结束)], 实时区间列表[(起始, 结束, 结束是否包含)])
+    """
+    first_hour = ceil_hour(begin_time)
+    # 完整小时H需满足 H + 1h - 1s <= end_time
+    last_hour_end = min(floor_hour(end_time + ONE_SECOND), hourly)
+    if first_hour >= last_hour_end:
+        return [], [], [(begin_time, end_time, True)]
+
+    live_ranges = []
+    if begin_time < first_hour:
+        live_ranges.append((begin_time, first_hour, False))
+    if last_hour_end <= end_time:
+        live_ranges.append((last_hour_end, end_time, True))
+
+    first_day = ceil_day(first_hour)
+    last_day_end = min(floor_day(last_hour_end), daily)
+    if first_day >= last_day_end:
+        return [], [(first_hour, last_hour_end)], live_ranges
+
+    hour_ranges = []
+    if first_hour < first_day:
+        hour_ranges.append((first_hour, first_day))
+    if last_day_end < last_hour_end:
+        hour_ranges.append((last_day_end, last_hour_end))
+    return [(first_day, last_day_end)], hour_ranges, live_ranges
+
+
+def merge_statistics(merchant_statistics, rows):
+    """
+    将(merchant_id, deal_count, money, origin_money)查询结果累加到merchant_statistics
+    """
+    for merchant_id, deal_count, money, origin_money in rows:
+        statistic = merchant_statistics.setdefault(merchant_id, [0, 0, 0])
+        statistic[0] += int(deal_count)
+        statistic[1] += money or 0
+        statistic[2] += origin_money or 0
+
+
+def query_rollup(session, model, ranges):
+    return session.query(
+        model.merchant_id, func.sum(model.deal_count), func.sum(model.money), func.sum(model.origin_money)
+    ).filter(
+        or_(*[and_(model.bucket_time >= begin, model.bucket_time < end) for begin, end in ranges])
+    ).group_by(model.merchant_id)
+
+
+def get_sale_statistics(session, begin_time, end_time):
+    """
+    统计时间段内各商户订单数量及金额
+    :return: {merchant_id: [订单数量, 折后总金额, 折扣前总金额]}
+    """
+    hourly, daily = (parse_watermark(value) for value in redis_client.mget(HOURLY_WATERMARK_KEY, DAILY_WATERMARK_KEY))
+    if hourly is None or daily is None:
+        # 汇总任务尚未执行, 全部实时统计
+        day_ranges, hour_ranges, live_ranges = [], [], [(begin_time, end_time, True)]
+    else:
+        day_ranges, hour_ranges, live_ranges = split_range(begin_time, end_time, hourly, daily)
+
+    merchant_statistics = {}
+    if day_ranges:
+        merge_statistics(merchant_statistics, query_rollup(session, DealRollupDaily, day_ranges))
+    if hour_ranges:
+        merge_statistics(merchant_statistics, query_rollup(session, DealRollupHourly, hour_ranges))
+    for begin, end, end_inclusive in live_ranges:
+        if end_inclusive:
+            time_filter = Deal.create_time.between(begin, end)
+        else:
+            time_filter = and_(Deal.create_time >= begin, Deal.create_time < end)
+        statistics = session.query(
+            Deal.merchant_id, func.count(Deal.deal_no), func.sum(Deal.money), func.sum(Deal.origin_money)
+        ).filter(time_filter).group_by(Deal.merchant_id)
+        merge_statistics(merchant_statistics, statistics)
+    return merchant_statistics
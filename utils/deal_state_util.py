@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+订单状态流转工具类: 按调用方的状态流转规则(consts.ExpressDealTransitions/MerchantDealTransitions)校验状态流转是否合法,
+一批订单只执行一次加锁查询、一次带原状态条件的UPDATE及一次提交, 并返回每个订单的处理结果
+"""
+from consts import DealStatusDesc
+from utils import deal_counter_util
+from models.deal import Deal
+
+
+def transition_deals(session, deal_nos, target_status, transitions, merchant_id=None):
+    """
+    批量变更订单状态并提交
+    :param session: 数据库会话
+    :param deal_nos: 订单号列表
+    :param target_status: 目标状态
+    :param transitions: 状态流转规则 {目标状态: 允许的原状态列表}
+    :param merchant_id: 订单所属商户id, 传入时只能变更该商户的订单
+    :return: [{"deal_no": 订单号, "success": 是否成功, "msg": 处理结果}, ...], 与deal_nos顺序一致(去重)
+    """
+    allowed_statuses = transitions.get(target_status)
+    if allowed_statuses is None:
+        raise ValueError(f"订单不能变更为{DealStatusDesc.get(target_status, target_status)}状态!")
+    deal_nos = list(dict.fromkeys(deal_nos))
+
+    deals = session.query(Deal.deal_no, Deal.merchant_id, Deal.create_time, Deal.deal_status).filter(
+        Deal.deal_no.in_(deal_nos))
+    if merchant_id is not None:
+        deals = deals.filter(Deal.merchant_id == merchant_id)
+    deals = {deal.deal_no: deal for deal in deals.with_for_update()}
+
+    results = []
+    changes = []
+    for deal_no in deal_nos:
+        deal = deals.get(deal_no)
+        if deal is None:
+            results.append({"deal_no": deal_no, "success": False, "msg": "订单不存在!"})
+        elif deal.deal_status == target_status:
+            results.append({"deal_no": deal_no, "success": True, "msg": "订单状态未变化"})
+        elif deal.deal_status not in allowed_statuses:
+            results.append({
+                "deal_no": deal_no, "success": False,
+                "msg": f"订单当前状态为{DealStatusDesc.get(deal.deal_status)}, 不能变更为{DealStatusDesc[target_status]}!"
+            })
+        else:
+            results.append({"deal_no": deal_no, "success": True, "msg": "success"})
+            changes.append(deal)
+
+    if changes:
+        session.query(Deal).filter(
+            Deal.deal_no.in_([deal.deal_no for deal in changes]), Deal.deal_status.in_(allowed_statuses)
+        ).update({Deal.deal_status: target_status}, synchronize_session=False)
+    session.commit()
+    if changes:
+        deal_counter_util.record_status_changed(
+            [(deal.merchant_id, deal.create_time, deal.deal_status) for deal in changes], target_status)
+    return results
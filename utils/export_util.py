@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+订单导出工具类: 通过服务端游标(yield_per)流式读取订单, 逐批编码为CSV或NDJSON,
+内存占用与导出行数无关; 导出使用独立的无连接池engine, 不占用接口连接池
+"""
+import io
+import csv
+import json
+import threading
+from datetime import datetime
+from sqlalchemy import text
+
+from config import export_config
+from utils import app_logger as logger
+from utils.db_util import export_session_class
+from utils.json_encoder import JsonEncoder
+from models.deal import Deal
+
+DEAL_COLUMNS = [column.name for column in Deal.__table__.columns]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 导出名额: 接口中非阻塞占用, 导出结束时释放; export_stats记录进行中的导出任务数(监控指标)
+export_slots = threading.BoundedSemaphore(export_config["max_concurrency"])
+export_stats = {"active": 0}
+export_lock = threading.Lock()
+
+
+class ExportSlot(object):
+    """
+    已占用的导出名额, release可重复调用(只释放一次)
+    导出生成器结束时、响应发送完成后(BackgroundTask)及对象被回收时都会释放,
+    生成器未开始迭代(客户端在首批数据前断开或发送失败)时不会执行其finally, 名额仍能释放
+    """
+    def __init__(self):
+        self.released = False
+
+    def release(self):
+        with export_lock:
+            if self.released:
+                return
+            self.released = True
+            export_stats["active"] -= 1
+        export_slots.release()
+
+    def __del__(self):
+        self.release()
+
+
+def acquire_slot():
+    """
+    非阻塞地占用一个导出名额
+    :return: ExportSlot, 名额已满时返回None
+    """
+    if not export_slots.acquire(blocking=False):
+        return None
+    with export_lock:
+        export_stats["active"] += 1
+    return ExportSlot()
+
+
+def iter_deals(begin_time, end_time, deal_status=None, merchant_id=None):
+    """
+    按创建时间顺序流式读取订单
+    :return: 生成器, 每次返回一个订单dict
+    """
+    session = export_session_class()
+    connected = finished = False
+    try:
+        session.execute(text("SET SESSION net_write_timeout = :timeout"),
+                        {"timeout": export_config["net_write_timeout"]})
+        connected = True
+        deals = session.query(Deal).filter(Deal.create_time.between(begin_time, end_time))
+        if deal_status is not None:
+            deals = deals.filter(Deal.deal_status == deal_status)
+        if merchant_id is not None:
+            deals = deals.filter(Deal.merchant_id == merchant_id)
+        for deal in deals.order_by(Deal.create_time, Deal.deal_no).yield_per(export_config["batch_size"]):
+            yield deal.to_dict()
+        finished = True
+    finally:
+        if connected and not finished:
+            # 中途退出(客户端断开或出错)时直接废弃连接, 避免关闭游标时读完剩余结果集
+            session.connection().invalidate()
+        session.close()
+
+
+def expand_items(deal):
+    """
+    将订单内容(content)展开为订单明细, 每个商品一行
+    :return: 生成器, 每次返回(订单dict, 明细dict), 内容为空或无法解析时返回一行空明细
+    """
+    try:
+        items = json.loads(deal.get("content") or "[]")
+    except ValueError:
+        items = []
+    if not isinstance(items, list) or not items:
+        yield deal, {}
+        return
+    for item in items:
+        yield deal, item if isinstance(item, dict) else {"value": item}
+
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(TIME_FORMAT)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, cls=JsonEncoder)
+    return value
+
+
+def stream_csv(deals, expand_content=False, item_fields=()):
+    """
+    :param deals: 订单dict迭代器
+    :param expand_content: 是否展开订单内容, 展开时每个商品一行, 明细字段列为item_{字段名}
+    :param item_fields: 展开时输出的明细字段
+    :return: 生成器, 每次返回一批CSV文本
+    """
+    columns = [column for column in DEAL_COLUMNS if not (expand_content and column == "content")]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # 带BOM, 便于Excel直接打开
+    buffer.write("\ufeff")
+    writer.writerow(columns + [f"item_{field}" for field in item_fields] if expand_content else columns)
+
+    rows = 0
+    for deal in deals:
+        if expand_content:
+            for deal_info, item in expand_items(deal):
+                writer.writerow([format_value(deal_info[column]) for column in columns] +
+                                [format_value(item.get(field)) for field in item_fields])
+        else:
+            writer.writerow([format_value(deal[column]) for column in columns])
+        rows += 1
+        if rows % export_config["batch_size"] == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(deals, expand_content=False):
+    """
+    :param expand_content: 是否展开订单内容, 展开时每个商品一行, 明细放在item字段中
+    :return: 生成器, 每次返回一批NDJSON文本
+    """
+    lines = []
+    for deal in deals:
+        if expand_content:
+            for deal_info, item in expand_items(deal):
+                row = {column: value for column, value in deal_info.items() if column != "content"}
+                row["item"] = item
+                lines.append(json.dumps(row, ensure_ascii=False, cls=JsonEncoder))
+        else:
+            lines.append(json.dumps(deal, ensure_ascii=False, cls=JsonEncoder))
+        if len(lines) >= export_config["batch_size"]:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def export_deals(slot, begin_time, end_time, file_format, deal_status=None, merchant_id=None,
+                 expand_content=False, item_fields=()):
+    """
+    导出订单
+    :param slot: acquire_slot占用的导出名额, 导出结束时释放
+    :param file_format: csv 或 ndjson
+    :return: 生成器, 每次返回一批编码后的文本
+    """
+    deals = iter_deals(begin_time, end_time, deal_status, merchant_id)
+    try:
+        if file_format == "csv":
+            chunks = stream_csv(deals, expand_content, item_fields)
+        else:
+            chunks = stream_ndjson(deals, expand_content)
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+    except Exception as e:
+        logger.error(f"订单导出失败: {repr(e)}")
+        raise
+    finally:
+        # 客户端中途断开时立即释放数据库连接
+        deals.close()
+        slot.release()
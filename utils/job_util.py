@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+后台定时任务工具类: 每个任务在独立守护线程中按固定间隔执行,
+多进程部署时通过redis锁保证同一周期内只有一个进程执行
+"""
+import os
+import time
+import uuid
+import threading
+
+from utils import app_logger as logger
+from utils.redis_util import redis_client
+
+# 仅在锁仍由持有者(token)持有时续期/释放
+RENEW_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+
+def acquire_lock(key, lock_seconds):
+    """
+    抢占带持有者标识的锁, 持有期间应在锁过期前调用renew_lock续期, 结束后调用release_lock释放
+    :return: 持有者token, 未抢到锁时返回None
+    """
+    token = f"{os.getpid()}:{uuid.uuid4().hex}"
+    if redis_client.set(key, token, nx=True, px=max(1, int(1000 * lock_seconds))):
+        return token
+    return None
+
+
+def renew_lock(key, token, lock_seconds):
+    """
+    :return: 锁是否仍由token持有(持有时续期lock_seconds)
+    """
+    return RENEW_LOCK_SCRIPT(keys=[key], args=[token, max(1, int(1000 * lock_seconds))]) == 1
+
+
+def release_lock(key, token):
+    RELEASE_LOCK_SCRIPT(keys=[key], args=[token])
+
+
+def run_job_once(name, func, lock_seconds):
+    """
+    抢占任务锁并执行一次任务, 锁在lock_seconds后自动过期(不主动释放, 保证一个周期内只执行一次)
+    :return: 是否执行了任务
+    """
+    if not redis_client.set(f"job_lock_{name}", os.getpid(), nx=True, px=max(1, int(1000 * lock_seconds))):
+        return False
+    start = time.time()
+    try:
+        func()
+    except Exception as e:
+        logger.error(f"定时任务({name})执行失败: {repr(e)}")
+    else:
+        logger.debug(f"定时任务({name})执行完成, 耗时: {1000 * (time.time() - start)}ms")
+    return True
+
+
+def start_periodic_job(name, interval, func, run_immediately=True):
+    """
+    启动定时任务
+    :param name: 任务名, 同名任务在所有进程中共用一把锁
+    :param interval: 执行间隔(秒)
+    :param func: 任务函数(无参数)
+    :param run_immediately: 是否启动后立即执行一次
+    """
+    def loop():
+        if not run_immediately:
+            time.sleep(interval)
+        while True:
+            run_job_once(name, func, interval)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name=f"job-{name}", daemon=True)
+    thread.start()
+    logger.info(f"定时任务({name})已启动, 执行间隔: {interval}s")
+    return thread
+
+
+def start_once_job(name, func, lock_seconds):
+    """
+    在后台线程中执行一次任务(多进程部署时只有抢到锁的进程执行)
+    :param lock_seconds: 任务锁过期时间(秒), 应大于任务预计耗时
+    """
+    thread = threading.Thread(target=run_job_once, args=(name, func, lock_seconds), name=f"job-{name}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+实时销量工具类: 定时任务按订单号水位线增量读取新订单(订单由小程序后台创建), 累加当天各商户订单数量及金额计数
+(redis哈希 live_sales_{yyyymmdd}, 字段 {merchant_id}:count、{merchant_id}:money 及 all:count、all:money),
+并将本批增量发布到live_sales_topic, 由WebSocket Server合并后推送给订阅实时销量的管理员, 同时累加商户目录的近30天销量
+    计数累加与水位线推进在同一个redis事务中执行(WATCH水位线), 任务中断重试或多进程同时执行不会重复计数
+    订单号自增但提交顺序不保证与订单号一致, 每隔reconcile_interval秒按数据库重新统计当天计数并推送全量快照以修正偏差,
+    重新统计与增量累加在同一个任务中执行, 不会并发修改计数
+"""
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from redis.exceptions import WatchError
+
+from config import live_sales_config, live_sales_topic
+from utils import merchant_directory_util
+from utils.redis_util import redis_client
+from utils.db_util import session_class
+from models.deal import Deal
+
+WATERMARK_KEY = "live_sales_watermark"
+# 存在期间不重新统计当天计数
+SEEDED_KEY = "live_sales_seeded"
+ONE_DAY = timedelta(days=1)
+
+
+def day_key(day):
+    return f"live_sales_{day.strftime('%Y%m%d')}"
+
+
+def day_start(t):
+    return datetime(t.year, t.month, t.day)
+
+
+def publish(message_type, day, statistics):
+    """
+    :param message_type: delta: 增量, snapshot: 全量快照
+    :param statistics: {merchant_id: [订单数量, 订单金额]}
+    """
+    redis_client.publish(live_sales_topic, json.dumps({
+        "type": message_type,
+        "day": day.strftime("%Y-%m-%d"),
+        "statistics": {merchant_id: [count, round(money, 2)] for merchant_id, (count, money) in statistics.items()}
+    }))
+
+
+def seed_today(session):
+    """
+    从数据库重新统计当天计数, 水位线推进到当前最大订单号
+    :return: (当天0点, {merchant_id: [订单数量, 订单金额]})
+    """
+    today = day_start(datetime.now())
+    max_deal_no = session.query(func.max(Deal.deal_no)).scalar() or 0
+    rows = session.query(Deal.merchant_id, func.count(Deal.deal_no), func.sum(Deal.money)).filter(
+        Deal.create_time >= today, Deal.create_time < today + ONE_DAY, Deal.deal_no <= max_deal_no
+    ).group_by(Deal.merchant_id)
+    statistics = {merchant_id: [count, money or 0] for merchant_id, count, money in rows}
+
+    mapping = {"all:count": sum(count for count, _ in statistics.values()),
+               "all:money": sum(money for _, money in statistics.values())}
+    for merchant_id, (count, money) in statistics.items():
+        mapping[f"{merchant_id}:count"] = count
+        mapping[f"{merchant_id}:money"] = money
+    key = day_key(today)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(key)
+    pipe.hset(key, mapping=mapping)
+    pipe.expire(key, live_sales_config["expire_days"] * 86400)
+    pipe.set(WATERMARK_KEY, max_deal_no)
+    pipe.set(SEEDED_KEY, 1, ex=live_sales_config["reconcile_interval"])
+    pipe.execute()
+    return today, statistics
+
+
+def tail_deals():
+    """
+    增量累加水位线之后的新订单并发布增量(定时任务), 水位线不存在或到达校正时间时从数据库重新统计当天计数并发布快照
+    """
+    session = session_class()
+    try:
+        watermark, seeded = redis_client.mget(WATERMARK_KEY, SEEDED_KEY)
+        if watermark is None or seeded is None:
+            today, statistics = seed_today(session)
+            merchant_directory_util.reseed_sales(session)
+            session.commit()
+            publish("snapshot", today, statistics)
+            return
+        watermark = int(watermark)
+        while True:
+            deals = session.query(Deal.deal_no, Deal.merchant_id, Deal.money, Deal.create_time).filter(
+                Deal.deal_no > watermark).order_by(Deal.deal_no).limit(live_sales_config["batch_size"]).all()
+            session.commit()
+            if not deals:
+                return
+            # {当天0点: {merchant_id: [订单数量, 订单金额]}}
+            deltas = {}
+            for deal in deals:
+                statistic = deltas.setdefault(day_start(deal.create_time), {}).setdefault(deal.merchant_id, [0, 0])
+                statistic[0] += 1
+                statistic[1] += deal.money or 0
+
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.watch(WATERMARK_KEY)
+            if pipe.get(WATERMARK_KEY) != str(watermark):
+                # 水位线已被其他进程推进或重新统计
+                pipe.reset()
+                return
+            pipe.multi()
+            for day, statistics in deltas.items():
+                key = day_key(day)
+                for merchant_id, (count, money) in statistics.items():
+                    pipe.hincrby(key, f"{merchant_id}:count", count)
+                    pipe.hincrbyfloat(key, f"{merchant_id}:money", money)
+                pipe.hincrby(key, "all:count", sum(count for count, _ in statistics.values()))
+                pipe.hincrbyfloat(key, "all:money", sum(money for _, money in statistics.values()))
+                pipe.expire(key, live_sales_config["expire_days"] * 86400)
+                merchant_directory_util.queue_sales(pipe, statistics)
+            watermark = deals[-1].deal_no
+            pipe.set(WATERMARK_KEY, watermark)
+            try:
+                pipe.execute()
+            except WatchError:
+                return
+            for day, statistics in deltas.items():
+                publish("delta", day, statistics)
+            if len(deals) < live_sales_config["batch_size"]:
+                return
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def get_snapshot(day=None):
+    """
+    读取某天的实时销量计数
+    :param day: 日期, 不传则为当天
+    :return: {"day": 日期, "statistics": {merchant_id: [订单数量, 订单金额]}}
+    """
+    day = day_start(day or datetime.now())
+    statistics = {}
+    for field, value in redis_client.hgetall(day_key(day)).items():
+        merchant_id, name = field.split(":")
+        if merchant_id == "all":
+            continue
+        statistic = statistics.setdefault(int(merchant_id), [0, 0])
+        if name == "count":
+            statistic[0] = int(value)
+        else:
+            statistic[1] = round(float(value), 2)
+    return {"day": day.strftime("%Y-%m-%d"), "statistics": statistics}
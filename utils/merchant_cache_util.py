@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+商户信息缓存工具类: 在redis merchants哈希之上维护一层进程内L1缓存, 鉴权时热路径无需访问redis
+商户信息变更时写redis并通过redis频道广播失效消息, 各进程收到后删除本地缓存条目
+redis未命中时(如变更尚未投影到缓存)从数据库读取审核通过的商户, 只放入本地缓存
+"""
+import json
+import time
+from starlette.concurrency import run_in_threadpool
+
+from config import merchant_cache_config, merchant_cache_topic
+from utils import app_logger as logger
+from utils.cache_util import LRUCache
+from utils.json_encoder import JsonEncoder
+from utils.redis_util import redis_client, async_redis_client
+from utils.db_util import session_class
+from models.merchant import Merchant
+
+merchant_cache = LRUCache(merchant_cache_config["max_size"])
+
+
+def _cache(merchant_id, merchant_info):
+    merchant = json.loads(merchant_info)
+    merchant_cache.set(int(merchant_id), merchant, expire_at=time.time() + merchant_cache_config["ttl"])
+    return merchant
+
+
+def load_merchant(merchant_id):
+    """
+    从数据库读取审核通过的商户信息
+    :return: 商户信息, 不存在或未审核通过时返回None
+    """
+    session = session_class()
+    try:
+        merchant = session.query(Merchant).filter(Merchant.id == merchant_id, Merchant.status == 1).one_or_none()
+        merchant_info = None if merchant is None else merchant.to_dict()
+        session.commit()
+        return merchant_info
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+async def get_merchant(merchant_id):
+    """
+    获取商户信息, 优先读取本地缓存, 未命中时读取redis(开启异步模式时使用异步客户端, 否则在线程池中读取),
+    redis未命中时读取数据库
+    :param merchant_id: 商户id
+    :return: 商户信息dict副本, 商户不存在时返回None
+    """
+    merchant = merchant_cache.get(int(merchant_id))
+    if merchant is None:
+        if async_redis_client is not None:
+            merchant_info = await async_redis_client.hget("merchants", merchant_id)
+        else:
+            # 同步客户端会阻塞事件循环, 放到线程池执行
+            merchant_info = await run_in_threadpool(redis_client.hget, "merchants", merchant_id)
+        if merchant_info is None:
+            merchant = await run_in_threadpool(load_merchant, merchant_id)
+            if merchant is None:
+                return None
+            merchant_info = json.dumps(merchant, cls=JsonEncoder)
+        merchant = _cache(merchant_id, merchant_info)
+    # 返回副本, 避免调用方修改(如pop password)污染缓存
+    return dict(merchant)
+
+
+def save_merchant(merchant: dict):
+    """
+    写入/更新redis中的商户信息并通知各进程失效本地缓存
+    :param merchant: 商户信息(Merchant.to_dict())
+    """
+    save_merchants([merchant])
+
+
+def save_merchants(merchants):
+    """
+    批量写入/更新redis中的商户信息并通知各进程失效本地缓存
+    :param merchants: 商户信息列表
+    """
+    if not merchants:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset("merchants", mapping={merchant["id"]: json.dumps(merchant, cls=JsonEncoder) for merchant in merchants})
+    pipe.hset("merchant_names", mapping={merchant["id"]: merchant["merchant_name"] for merchant in merchants})
+    for merchant in merchants:
+        pipe.publish(merchant_cache_topic, merchant["id"])
+    pipe.execute()
+    for merchant in merchants:
+        merchant_cache.delete(int(merchant["id"]))
+
+
+def remove_merchant(merchant_id):
+    """
+    删除redis中的商户信息并通知各进程失效本地缓存
+    """
+    remove_merchants([merchant_id])
+
+
+def remove_merchants(merchant_ids):
+    """
+    批量删除redis中的商户信息并通知各进程失效本地缓存
+    """
+    if not merchant_ids:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hdel("merchants", *merchant_ids)
+    pipe.hdel("merchant_names", *merchant_ids)
+    for merchant_id in merchant_ids:
+        pipe.publish(merchant_cache_topic, merchant_id)
+    pipe.execute()
+    for merchant_id in merchant_ids:
+        merchant_cache.delete(int(merchant_id))
+
+
+def get_merchant_names(session, merchant_ids):
+    """
+    批量获取商户名称, 读取redis merchant_names哈希(商户id -> 名称), 缺失的从数据库补齐并回填
+    :param merchant_ids: 商户id列表
+    :return: {merchant_id: merchant_name}
+    """
+    merchant_ids = list(merchant_ids)
+    if not merchant_ids:
+        return {}
+    names = {merchant_id: name for merchant_id, name in zip(merchant_ids, redis_client.hmget("merchant_names", merchant_ids))
+             if name is not None}
+    missing_ids = [merchant_id for merchant_id in merchant_ids if merchant_id not in names]
+    if missing_ids:
+        missing_names = dict(session.query(Merchant.id, Merchant.merchant_name).filter(Merchant.id.in_(missing_ids)))
+        if missing_names:
+            redis_client.hset("merchant_names", mapping=missing_names)
+        names.update(missing_names)
+    return names
+
+
+def invalidation_listener(msg):
+    if msg["type"] != "message":
+        return
+    try:
+        merchant_cache.delete(int(msg["data"]))
+    except ValueError:
+        logger.error(f"非法的商户缓存失效消息: {msg['data']}")
+
+
+def start_invalidation_listener():
+    """
+    订阅商户缓存失效频道(每个进程启动时调用一次)
+    """
+    subscriber = redis_client.pubsub(ignore_subscribe_messages=True)
+    subscriber.subscribe(**{merchant_cache_topic: invalidation_listener})
+    thread = subscriber.run_in_thread(sleep_time=0.1, daemon=True)
+    logger.info("Merchant Cache Invalidation Listener Started...")
+    return thread
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+商户目录工具类: 审核通过的商户在redis中维护目录读模型, 商户列表按任意排序键分页只需一次lua脚本调用, 不查询商户表
+    merchant_directory_cards: 哈希, 商户id -> 商户资料JSON(不含密码、审核状态)
+    merchant_directory_by_create_time: 有序集合, 分值为注册时间戳
+    merchant_directory_by_rating: 有序集合, 分值为平均星级(evaluation_stars / evaluation_times, 未被评价为4)
+    merchant_directory_by_sales: 有序集合, 分值为近30天订单数量
+商品数读取商户商品集合products_of_merchant_{商户id}(商品变更时已同步维护)
+更新方式:
+    商户资料: 商户变更投影到缓存时写入, 非审核通过的商户移出目录
+    星级: 评价由小程序后台写入evaluation_stars/evaluation_times, 定时任务在redis内一次性重新计算
+    销量: 实时销量任务增量累加新订单, 重新统计当天计数时按订单汇总表重新统计近30天销量(同时移出窗口外的订单)
+"""
+import json
+from datetime import datetime, timedelta
+
+from utils import deal_rollup_util
+from utils.json_encoder import JsonEncoder
+from utils.redis_util import redis_client
+from utils.db_util import session_class
+from models.merchant import Merchant
+
+CARDS_KEY = "merchant_directory_cards"
+BY_CREATE_TIME_KEY = "merchant_directory_by_create_time"
+BY_RATING_KEY = "merchant_directory_by_rating"
+BY_SALES_KEY = "merchant_directory_by_sales"
+SORT_KEYS = {"create_time": BY_CREATE_TIME_KEY, "rating": BY_RATING_KEY, "sales": BY_SALES_KEY}
+SALES_DAYS = 30
+# 未被评价的商户默认星级
+DEFAULT_STARS = 4
+
+# KEYS: 排序key, 商户资料key, 星级key, 销量key
+# ARGV: 起始下标, 商户数, 是否倒序, 排除的商户id(不排除时为空串)
+# 返回: {商户总数, [商户资料JSON, 星级, 销量, 商品数]...}
+LIST_SCRIPT = redis_client.register_script("""
+local rev = ARGV[3] == '1'
+local offset = tonumber(ARGV[1])
+local count = tonumber(ARGV[2])
+local rank = false
+if ARGV[4] ~= '' then
+    if rev then
+        rank = redis.call('zrevrank', KEYS[1], ARGV[4])
+    else
+        rank = redis.call('zrank', KEYS[1], ARGV[4])
+    end
+end
+-- 排除的商户排在起始下标之前(含)时, 后续商户整体前移一位
+local start = offset
+if rank and rank <= offset then
+    start = offset + 1
+end
+local ids
+if rev then
+    ids = redis.call('zrevrange', KEYS[1], start, start + count)
+else
+    ids = redis.call('zrange', KEYS[1], start, start + count)
+end
+local total = redis.call('zcard', KEYS[1])
+if rank then
+    total = total - 1
+end
+local merchants = {}
+for _, merchant_id in ipairs(ids) do
+    if #merchants >= count then
+        break
+    end
+    if merchant_id ~= ARGV[4] then
+        merchants[#merchants + 1] = {
+            redis.call('hget', KEYS[2], merchant_id) or '',
+            redis.call('zscore', KEYS[3], merchant_id) or '',
+            redis.call('zscore', KEYS[4], merchant_id) or '',
+            redis.call('scard', 'products_of_merchant_' .. merchant_id)
+        }
+    end
+end
+return {total, merchants}
+""")
+
+# KEYS: 注册时间key, 星级key
+# ARGV: 默认星级
+RATING_SCRIPT = redis_client.register_script("""
+local ids = redis.call('zrange', KEYS[1], 0, -1)
+for _, merchant_id in ipairs(ids) do
+    local stars = redis.call('hget', 'evaluation_stars', merchant_id)
+    local times = tonumber(redis.call('hget', 'evaluation_times', merchant_id))
+    local rating = ARGV[1]
+    if stars and times and times > 0 then
+        rating = tonumber(stars) / times
+    end
+    redis.call('zadd', KEYS[2], rating, merchant_id)
+end
+return #ids
+""")
+
+# KEYS: 注册时间key, 销量key
+# ARGV: 商户id及销量...
+SALES_SCRIPT = redis_client.register_script("""
+local sales = {}
+for i = 1, #ARGV, 2 do
+    sales[ARGV[i]] = ARGV[i + 1]
+end
+redis.call('del', KEYS[2])
+local ids = redis.call('zrange', KEYS[1], 0, -1)
+for _, merchant_id in ipairs(ids) do
+    redis.call('zadd', KEYS[2], sales[merchant_id] or 0, merchant_id)
+end
+return #ids
+""")
+
+# KEYS: 销量key
+# ARGV: 商户id及新增订单数...
+INCR_SALES_SCRIPT = redis_client.register_script("""
+for i = 1, #ARGV, 2 do
+    if redis.call('zscore', KEYS[1], ARGV[i]) then
+        redis.call('zincrby', KEYS[1], ARGV[i + 1], ARGV[i])
+    end
+end
+return 1
+""")
+
+
+def get_rating(stars, times):
+    if stars is None or not times or int(times) == 0:
+        return DEFAULT_STARS
+    return float(stars) / int(times)
+
+
+def save_merchants(merchants):
+    """
+    写入/更新商户目录(商户变更投影到缓存时调用)
+    :param merchants: 审核通过的商户信息列表(Merchant.to_dict())
+    """
+    if not merchants:
+        return
+    merchant_ids = [merchant["id"] for merchant in merchants]
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hmget("evaluation_stars", merchant_ids)
+    pipe.hmget("evaluation_times", merchant_ids)
+    stars, times = pipe.execute()
+
+    pipe = redis_client.pipeline(transaction=True)
+    cards = {}
+    for merchant in merchants:
+        card = dict(merchant)
+        card.pop("password", None)
+        card.pop("status", None)
+        cards[merchant["id"]] = json.dumps(card, cls=JsonEncoder)
+    pipe.hset(CARDS_KEY, mapping=cards)
+    pipe.zadd(BY_CREATE_TIME_KEY, {merchant["id"]: merchant["create_time"].timestamp() if merchant["create_time"] else 0
+                                   for merchant in merchants})
+    pipe.zadd(BY_RATING_KEY, {merchant_id: get_rating(merchant_stars, merchant_times)
+                              for merchant_id, merchant_stars, merchant_times in zip(merchant_ids, stars, times)})
+    # 销量由实时销量任务维护, 新加入目录的商户先记为0
+    pipe.zadd(BY_SALES_KEY, {merchant_id: 0 for merchant_id in merchant_ids}, nx=True)
+    pipe.execute()
+
+
+def remove_merchants(merchant_ids):
+    """
+    将商户移出目录(商户未审核通过、被拒绝或已删除)
+    """
+    if not merchant_ids:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hdel(CARDS_KEY, *merchant_ids)
+    for key in SORT_KEYS.values():
+        pipe.zrem(key, *merchant_ids)
+    pipe.execute()
+
+
+def refresh_ratings():
+    """
+    按evaluation_stars/evaluation_times重新计算目录内全部商户的平均星级(定时任务)
+    """
+    RATING_SCRIPT(keys=[BY_CREATE_TIME_KEY, BY_RATING_KEY], args=[DEFAULT_STARS])
+
+
+def queue_sales(pipe, statistics):
+    """
+    在pipeline中加入累加商户销量的命令, 不在目录内的商户忽略
+    :param statistics: {merchant_id: [新增订单数, 订单金额]}
+    """
+    args = []
+    for merchant_id, (count, _) in statistics.items():
+        args.extend((merchant_id, count))
+    if args:
+        INCR_SALES_SCRIPT(keys=[BY_SALES_KEY], args=args, client=pipe)
+
+
+def reseed_sales(session):
+    """
+    按订单汇总表重新统计目录内全部商户近30天的订单数量
+    """
+    now = datetime.now()
+    statistics = deal_rollup_util.get_sale_statistics(session, now - timedelta(days=SALES_DAYS), now)
+    args = []
+    for merchant_id, (count, _, _) in statistics.items():
+        args.extend((merchant_id, count))
+    SALES_SCRIPT(keys=[BY_CREATE_TIME_KEY, BY_SALES_KEY], args=args)
+
+
+def sync_from_db():
+    """
+    按商户表重建商户目录(启动时执行, 补齐本功能上线前的商户)
+    """
+    session = session_class()
+    try:
+        merchants = [merchant.to_dict() for merchant in session.query(Merchant).filter(Merchant.status == 1)]
+        approved_ids = {merchant["id"] for merchant in merchants}
+        save_merchants(merchants)
+        remove_merchants([int(merchant_id) for merchant_id in redis_client.hkeys(CARDS_KEY)
+                          if int(merchant_id) not in approved_ids])
+        reseed_sales(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def list_merchants(sort_by="create_time", desc=True, offset=0, count=20, exclude_id=None):
+    """
+    分页查询商户目录
+    :param sort_by: 排序键 create_time: 注册时间, rating: 平均星级, sales: 近30天订单数量
+    :param exclude_id: 排除的商户id(如当前登录的管理员)
+    :return: (商户总数, 商户列表), 商户信息含stars、sales、product_count字段
+    """
+    total, rows = LIST_SCRIPT(keys=[SORT_KEYS[sort_by], CARDS_KEY, BY_RATING_KEY, BY_SALES_KEY],
+                              args=[offset, count, 1 if desc else 0, "" if exclude_id is None else exclude_id])
+    merchants = []
+    for card, rating, sales, product_count in rows:
+        if not card:
+            continue
+        merchant = json.loads(card)
+        merchant["stars"] = float(rating) if rating else DEFAULT_STARS
+        merchant["sales"] = int(float(sales)) if sales else 0
+        merchant["product_count"] = product_count
+        merchants.append(merchant)
+    return total, merchants
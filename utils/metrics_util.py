@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+监控指标工具类: 进程内采集接口耗时、数据库及redis调用统计, 以Prometheus文本格式输出
+"""
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+# 耗时直方图分桶(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 单次请求内调用次数直方图分桶
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# 当前请求的数据库、redis调用统计, 由metrics中间件在请求开始时设置
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, name, doc, buckets):
+        self.name = name
+        self.doc = doc
+        self.buckets = buckets
+        self.series = {}    # labels -> [各分桶计数..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, series in self.series.items():
+                label_str = format_labels(labels)
+                cumulative = 0
+                for bucket, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label_str}{"," if label_str else ""}le="{bucket}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{label_str}{"," if label_str else ""}le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{label_str}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{label_str}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.series = {}    # labels -> value
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), value=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in self.series.items():
+                lines.append(f"{self.name}{{{format_labels(labels)}}} {value}")
+        return lines
+
+
+def format_labels(labels):
+    """
+    :param labels: ((label_name, label_value), ...)
+    """
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+http_requests = Counter("http_requests_total", "接口请求次数")
+http_latency = Histogram("http_request_duration_seconds", "接口耗时", LATENCY_BUCKETS)
+db_queries_per_request = Histogram("db_queries_per_request", "单次请求数据库查询次数", COUNT_BUCKETS)
+db_time_per_request = Histogram("db_time_per_request_seconds", "单次请求数据库查询耗时", LATENCY_BUCKETS)
+redis_commands_per_request = Histogram("redis_commands_per_request", "单次请求redis命令数", COUNT_BUCKETS)
+redis_time_per_request = Histogram("redis_time_per_request_seconds", "单次请求redis耗时", LATENCY_BUCKETS)
+db_queries = Counter("db_queries_total", "数据库查询总次数")
+db_time = Counter("db_query_seconds_total", "数据库查询总耗时")
+redis_commands = Counter("redis_commands_total", "redis命令总数")
+redis_roundtrips = Counter("redis_roundtrips_total", "redis网络往返总次数(pipeline计一次)")
+redis_time = Counter("redis_seconds_total", "redis调用总耗时")
+
+# 采集时实时计算的指标: name -> (doc, 返回数值或{labels: 数值}的函数)
+gauges = {}
+
+
+def register_gauge(name, doc, func):
+    gauges[name] = (doc, func)
+
+
+def begin_request():
+    stats = {"db_queries": 0, "db_time": 0.0, "redis_commands": 0, "redis_time": 0.0}
+    request_stats.set(stats)
+    return stats
+
+
+def end_request(method, route, status_code, elapsed, stats):
+    labels = (("method", method), ("route", route))
+    http_requests.inc(labels + (("status", status_code),))
+    http_latency.observe(labels, elapsed)
+    db_queries_per_request.observe(labels, stats["db_queries"])
+    db_time_per_request.observe(labels, stats["db_time"])
+    redis_commands_per_request.observe(labels, stats["redis_commands"])
+    redis_time_per_request.observe(labels, stats["redis_time"])
+
+
+def observe_db(elapsed):
+    db_queries.inc()
+    db_time.inc(value=elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats["db_queries"] += 1
+        stats["db_time"] += elapsed
+
+
+def observe_redis(command_count, elapsed):
+    redis_commands.inc(value=command_count)
+    redis_roundtrips.inc()
+    redis_time.inc(value=elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats["redis_commands"] += command_count
+        stats["redis_time"] += elapsed
+
+
+def instrument_engine(engine):
+    """
+    通过engine事件统计每条sql的执行次数及耗时
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        observe_db(time.perf_counter() - conn.info["query_start_time"].pop())
+
+
+def render():
+    lines = []
+    for metric in (http_requests, http_latency, db_queries_per_request, db_time_per_request,
+                   redis_commands_per_request, redis_time_per_request,
+                   db_queries, db_time, redis_commands, redis_roundtrips, redis_time):
+        lines.extend(metric.render())
+    for name, (doc, func) in gauges.items():
+        lines.append(f"# HELP {name} {doc}")
+        lines.append(f"# TYPE {name} gauge")
+        value = func()
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                lines.append(f"{name}{{{format_labels(labels)}}} {v}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
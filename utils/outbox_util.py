@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+缓存投影工具类(outbox模式): 写接口不再直接写redis, 而是在业务事务内向t_cache_outbox记录变更的商品/商户id,
+事务提交后由后台投影线程按事件批量读取数据库最新数据, 与redis中的旧数据比对后批量写入缓存及索引
+
+投影按实体最新状态整体覆盖, 与事件的先后顺序无关, 重复投影结果相同:
+    数据库写入失败 -> 事务回滚, 事件一并丢弃, 缓存不变
+    redis写入失败或进程退出 -> 事件未删除, 下次投影时重试
+多进程部署时通过redis锁保证同一时刻只有一个进程投影, 本进程提交事件后立即唤醒投影线程
+"""
+import time
+import threading
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import cache_outbox_config
+from utils import app_logger as logger, product_cache_util, merchant_cache_util, activity_schedule_util, \
+    activity_product_util, merchant_directory_util, job_util
+from utils.db_util import session_class
+from models.cache_outbox import CacheOutbox
+from models.product import Product
+from models.merchant import Merchant
+
+PRODUCT = "product"
+MERCHANT = "merchant"
+LOCK_KEY = "cache_outbox_lock"
+# session.info中标记本事务记录了事件, 提交后唤醒投影线程
+PENDING_FLAG = "cache_outbox_pending"
+
+wakeup = threading.Event()
+projector_stats = {"projected": 0, "failed": 0}
+
+
+def record(session, entity_type, entity_ids):
+    """
+    在当前事务内记录实体变更事件(须在session.commit()之前调用)
+    :param entity_type: product/merchant
+    :param entity_ids: 实体id列表
+    """
+    entity_ids = list(dict.fromkeys(entity_ids))
+    if not entity_ids:
+        return
+    now = datetime.now()
+    session.execute(CacheOutbox.__table__.insert(), [
+        {"entity_type": entity_type, "entity_id": entity_id, "create_time": now} for entity_id in entity_ids
+    ])
+    session.info[PENDING_FLAG] = True
+
+
+def record_products(session, product_ids):
+    record(session, PRODUCT, product_ids)
+
+
+def record_merchants(session, merchant_ids):
+    record(session, MERCHANT, merchant_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def on_commit(session):
+    if session.info.pop(PENDING_FLAG, False):
+        wakeup.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def on_rollback(session):
+    session.info.pop(PENDING_FLAG, None)
+
+
+def project_products(session, product_ids):
+    """
+    按数据库最新数据投影商品缓存: 存在的商品以redis中的旧数据为基准增量更新索引, 已删除的商品从缓存移除
+    """
+    products = [product.to_dict() for product in session.query(Product).filter(Product.id.in_(product_ids))]
+    old_products = {product_id: product for product_id, product
+                    in zip(product_ids, product_cache_util.get_products(product_ids)) if product is not None}
+    existing_ids = {product["id"] for product in products}
+    removed = [product for product_id, product in old_products.items() if product_id not in existing_ids]
+    product_cache_util.save_products(products, old_products)
+    product_cache_util.remove_products(removed)
+    activity_product_util.refresh_products(session, products, [product["id"] for product in removed])
+
+
+def project_merchants(session, merchant_ids):
+    """
+    按数据库最新数据投影商户缓存: 仅缓存审核通过的商户, 其余(待审核、已拒绝、已删除)从缓存移除
+    """
+    merchants = [merchant.to_dict() for merchant in session.query(Merchant).filter(Merchant.id.in_(merchant_ids))]
+    approved = [merchant for merchant in merchants if merchant["status"] == 1]
+    approved_ids = {merchant["id"] for merchant in approved}
+    merchant_cache_util.save_merchants(approved)
+    merchant_cache_util.remove_merchants([merchant_id for merchant_id in merchant_ids if merchant_id not in approved_ids])
+    merchant_directory_util.save_merchants(approved)
+    merchant_directory_util.remove_merchants([merchant_id for merchant_id in merchant_ids
+                                              if merchant_id not in approved_ids])
+    activity_product_util.refresh_merchants({merchant["id"]: merchant["merchant_name"] for merchant in approved},
+                                            activity_schedule_util.live_activity_ids())
+
+
+def project_batch(session):
+    """
+    投影一批事件并删除
+    :return: 本批事件数
+    """
+    events = session.query(CacheOutbox.id, CacheOutbox.entity_type, CacheOutbox.entity_id).order_by(
+        CacheOutbox.id).limit(cache_outbox_config["batch_size"]).all()
+    if not events:
+        session.commit()
+        return 0
+    entity_ids = {PRODUCT: [], MERCHANT: []}
+    for _, entity_type, entity_id in events:
+        entity_ids.setdefault(entity_type, []).append(entity_id)
+    product_ids = list(dict.fromkeys(entity_ids[PRODUCT]))
+    merchant_ids = list(dict.fromkeys(entity_ids[MERCHANT]))
+    if product_ids:
+        project_products(session, product_ids)
+    if merchant_ids:
+        project_merchants(session, merchant_ids)
+    session.query(CacheOutbox).filter(CacheOutbox.id.in_([event_id for event_id, _, _ in events])).delete(
+        synchronize_session=False)
+    # 提交后下一批重新建立一致性读快照, 读到最新提交的数据
+    session.commit()
+    return len(events)
+
+
+def drain():
+    """
+    抢占投影锁并投影全部待处理事件
+    :return: 投影的事件数, 未抢到锁时返回None
+    """
+    token = job_util.acquire_lock(LOCK_KEY, cache_outbox_config["lock_seconds"])
+    if token is None:
+        return None
+    session = session_class()
+    count = 0
+    try:
+        while True:
+            # 每批投影前续期并确认仍持有锁, 锁已过期(被其他进程抢占)时停止, 避免重复投影同一批事件
+            if count and not job_util.renew_lock(LOCK_KEY, token, cache_outbox_config["lock_seconds"]):
+                logger.error("缓存投影锁已失效, 停止本轮投影")
+                return count
+            batch_count = project_batch(session)
+            count += batch_count
+            if batch_count < cache_outbox_config["batch_size"]:
+                return count
+    except Exception:
+        session.rollback()
+        projector_stats["failed"] += 1
+        raise
+    finally:
+        projector_stats["projected"] += count
+        session.close()
+        job_util.release_lock(LOCK_KEY, token)
+
+
+def start_projector():
+    """
+    启动缓存投影线程(每个进程启动时调用一次): 本进程提交事件后立即投影, 否则每poll_interval秒检查一次
+    """
+    def loop():
+        while True:
+            wakeup.wait(cache_outbox_config["poll_interval"])
+            wakeup.clear()
+            try:
+                drain()
+            except Exception as e:
+                logger.error(f"缓存投影失败: {repr(e)}")
+                time.sleep(cache_outbox_config["poll_interval"])
+
+    thread = threading.Thread(target=loop, name="cache-outbox-projector", daemon=True)
+    thread.start()
+    logger.info("Cache Outbox Projector Started...")
+    return thread
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+分页工具类: 订单列表基于(create_time, deal_no)的游标分页(keyset pagination),
+深页查询直接按索引定位起始行, 代价与第一页相同
+"""
+import base64
+from datetime import datetime
+from sqlalchemy import or_, and_
+
+from models.deal import Deal
+
+CURSOR_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+
+def encode_deal_cursor(create_time, deal_no):
+    """
+    将页尾订单的(create_time, deal_no)编码为不透明游标
+    """
+    raw = f"{create_time.strftime(CURSOR_TIME_FORMAT)}_{deal_no}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_deal_cursor(cursor):
+    """
+    :return: (create_time, deal_no)
+    """
+    try:
+        create_time, deal_no = base64.urlsafe_b64decode(cursor.encode()).decode().split("_")
+        return datetime.strptime(create_time, CURSOR_TIME_FORMAT), int(deal_no)
+    except Exception:
+        raise ValueError("无效的分页游标!")
+
+
+def page_deals(query, page_no, page_size, cursor=None):
+    """
+    订单分页, 按create_time、deal_no倒序, 传cursor时使用游标分页, 否则兼容page_no分页
+    :param query: 已带过滤条件的订单Query(或select语句)
+    :param page_no: 当前页码
+    :param page_size: 页面大小
+    :param cursor: 上一页返回的next_cursor
+    :return: 当前页查询
+    """
+    query = query.order_by(Deal.create_time.desc(), Deal.deal_no.desc())
+    if cursor:
+        create_time, deal_no = decode_deal_cursor(cursor)
+        query = query.filter(or_(Deal.create_time < create_time,
+                                 and_(Deal.create_time == create_time, Deal.deal_no < deal_no)))
+    else:
+        query = query.offset((page_no - 1) * page_size)
+    return query.limit(page_size)
+
+
+def next_deal_cursor(deals, page_size):
+    """
+    根据当前页订单生成下一页游标, 已是最后一页时返回None
+    """
+    if page_size == 0 or len(deals) < page_size:
+        return None
+    return encode_deal_cursor(deals[-1].create_time, deals[-1].deal_no)
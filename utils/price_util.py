@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+商品价格工具类: 批量计算商品实际售价(商品单价 × 进行中活动的折扣)
+    商品单价每次从商品缓存读取, 商品所属活动及折扣(activity_of_product_{商品id}、discount_of_activity_{活动id}、
+    activity_{活动id})缓存在进程内, 条目随活动key过期, 未参加活动的商品按price_config["ttl"]过期
+    一批商品只执行一次lua脚本(一次网络往返), 同时读取全部商品单价及本地缓存未命中商品的活动信息
+活动商品或折扣变更时通过price_cache_topic通知各进程失效本地缓存
+"""
+import json
+import time
+from datetime import datetime
+
+from config import price_config, price_cache_topic, product_cache_config
+from utils import app_logger as logger
+from utils.cache_util import LRUCache
+from utils.redis_util import redis_client
+
+# 商品id -> (活动id, 折扣, 活动开始时间戳, 活动结束时间戳), 未参加活动的商品为NO_ACTIVITY
+activity_cache = LRUCache(price_config["max_size"])
+NO_ACTIVITY = ()
+
+# ARGV: 商品缓存结构(json/hash/dual), 本地缓存未命中的商品数m, 未命中的商品id(m个), 全部商品id...
+# 返回: {全部商品单价(不存在为''), 未命中商品的活动信息[活动id, 折扣, 活动信息JSON, 剩余毫秒数]...}
+PRICE_SCRIPT = redis_client.register_script("""
+local layout = ARGV[1]
+local m = tonumber(ARGV[2])
+local activities = {}
+for i = 3, 2 + m do
+    local product_id = ARGV[i]
+    local activity_id = redis.call('get', 'activity_of_product_' .. product_id)
+    if activity_id then
+        activities[#activities + 1] = {
+            activity_id,
+            redis.call('hget', 'discount_of_activity_' .. activity_id, product_id) or '',
+            redis.call('get', 'activity_' .. activity_id) or '',
+            redis.call('pttl', 'activity_of_product_' .. product_id)
+        }
+    else
+        activities[#activities + 1] = {'', '', '', 0}
+    end
+end
+local prices = {}
+for i = 3 + m, #ARGV do
+    local price = false
+    if layout ~= 'json' then
+        price = redis.call('hget', 'product_' .. ARGV[i], 'price')
+    end
+    if not price and layout ~= 'hash' then
+        local product = redis.call('hget', 'products', ARGV[i])
+        if product then
+            price = tostring(cjson.decode(product)['price'])
+        end
+    end
+    prices[#prices + 1] = price or ''
+end
+return {prices, activities}
+""")
+
+
+def parse_activity(values, now):
+    """
+    :param values: [活动id, 折扣, 活动信息JSON, 剩余毫秒数]
+    :return: (缓存值, 过期时间戳)
+    """
+    activity_id, discount, activity_info, pttl = values
+    if not activity_id or not discount or not activity_info:
+        return NO_ACTIVITY, now + price_config["ttl"]
+    activity = json.loads(activity_info)
+    begin_time = datetime.strptime(activity["begin_time"], "%Y-%m-%d %H:%M:%S").timestamp()
+    end_time = datetime.strptime(activity["end_time"], "%Y-%m-%d %H:%M:%S").timestamp()
+    expire_at = now + pttl / 1000 if pttl > 0 else end_time
+    return (int(activity_id), float(discount), begin_time, end_time), min(expire_at, end_time)
+
+
+def get_prices(product_ids):
+    """
+    批量计算商品实际售价
+    :param product_ids: 商品id列表
+    :return: {商品id: {"price": 单价, "effective_price": 实际售价, "activity_id": 活动id, "discount": 折扣}},
+             不存在的商品不返回, 不在进行中活动内的商品activity_id、discount为None
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+    now = time.time()
+    activities = {product_id: activity_cache.get(product_id) for product_id in product_ids}
+    missing = [product_id for product_id, activity in activities.items() if activity is None]
+    prices, values = PRICE_SCRIPT(args=[product_cache_config["layout"], len(missing)] + missing + product_ids)
+    for product_id, value in zip(missing, values):
+        activity, expire_at = parse_activity(value, now)
+        activity_cache.set(product_id, activity, expire_at=expire_at)
+        activities[product_id] = activity
+
+    result = {}
+    for product_id, price in zip(product_ids, prices):
+        if price == "":
+            continue
+        price = float(price)
+        item = {"price": price, "effective_price": price, "activity_id": None, "discount": None}
+        activity = activities[product_id]
+        if activity:
+            activity_id, discount, begin_time, end_time = activity
+            # 折扣为0~1之间的系数, 超出范围视为无效折扣
+            if begin_time <= now < end_time and 0 < discount <= 1:
+                item.update(effective_price=round(price * discount, 2), activity_id=activity_id, discount=discount)
+        result[product_id] = item
+    return result
+
+
+def invalidate_products(product_ids):
+    """
+    通知各进程失效商品的活动缓存(活动商品或折扣变更后调用)
+    """
+    product_ids = list(product_ids)
+    if product_ids:
+        redis_client.publish(price_cache_topic, ",".join(str(product_id) for product_id in product_ids))
+
+
+def invalidate_activity(activity_id):
+    """
+    通知各进程失效活动下全部商品的活动缓存(活动时间变更或删除活动前调用)
+    """
+    invalidate_products(product_id for product_id in redis_client.hkeys(f"discount_of_activity_{activity_id}")
+                        if product_id != "")
+
+
+def invalidation_listener(msg):
+    if msg["type"] != "message":
+        return
+    try:
+        for product_id in msg["data"].split(","):
+            activity_cache.delete(int(product_id))
+    except ValueError:
+        logger.error(f"非法的价格缓存失效消息: {msg['data']}")
+
+
+def start_invalidation_listener():
+    """
+    订阅价格缓存失效频道(每个进程启动时调用一次)
+    """
+    subscriber = redis_client.pubsub(ignore_subscribe_messages=True)
+    subscriber.subscribe(**{price_cache_topic: invalidation_listener})
+    thread = subscriber.run_in_thread(sleep_time=0.1, daemon=True)
+    logger.info("Price Cache Invalidation Listener Started...")
+    return thread
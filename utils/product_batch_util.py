@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+商品批量操作工具类: 解析JSONL/CSV商品文件, 按批写入数据库(修改executemany, 新增逐行取得自增id), 同一事务内记录缓存变更事件(outbox),
+以及批量上下架、删除商品, 均返回逐行/逐个商品的处理结果
+"""
+import csv
+import codecs
+import json
+from datetime import datetime
+
+from utils import outbox_util, stock_util
+from models.product import Product
+
+# 文件中可导入的商品字段
+PRODUCT_FIELDS = ("id", "product_name", "product_tag", "product_cover", "product_desc", "detail_pictures",
+                  "has_stock_limit", "remain_stock", "price")
+
+
+def iter_upload_rows(file, file_format):
+    """
+    逐行解析上传的商品文件, 不一次性读入内存
+    :param file: 二进制文件对象(UploadFile.file)
+    :param file_format: jsonl 或 csv
+    :return: 生成器, 每次返回(行号, 商品字段dict, 解析错误信息)
+    """
+    text = codecs.iterdecode(file, "utf-8-sig")
+    if file_format == "jsonl":
+        for line_no, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"JSON格式错误: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, "每行须为一个JSON对象!"
+                continue
+            yield line_no, row, None
+    else:
+        reader = csv.DictReader(text)
+        for row in reader:
+            # 表头占第1行
+            line_no = reader.line_num
+            # 空值使用默认值
+            row = {k: v.strip() for k, v in row.items() if k in PRODUCT_FIELDS and v is not None and v.strip() != ""}
+            pictures = row.get("detail_pictures")
+            if pictures is not None:
+                if pictures.startswith("["):
+                    try:
+                        row["detail_pictures"] = json.loads(pictures)
+                    except ValueError as e:
+                        yield line_no, None, f"detail_pictures格式错误: {e}"
+                        continue
+                else:
+                    row["detail_pictures"] = pictures.split("|")
+            yield line_no, row, None
+
+
+def import_batch(session, merchant_id, batch):
+    """
+    写入一批商品并提交, 缓存由投影线程在提交后批量更新
+    :param batch: [(行号, ProductModel), ...], 不带id的新增, 带id的修改
+    :return: (成功列表[{"line": 行号, "product_id": 商品id}], 错误列表[{"line": 行号, "msg": 错误信息}])
+    """
+    now = datetime.now()
+    imported = []
+    errors = []
+    stocks = {}
+
+    updates = [(line_no, info) for line_no, info in batch if info.id is not None]
+    if updates:
+        existing = {product.id: product for product in session.query(Product).filter(
+            Product.id.in_([info.id for _, info in updates])).with_for_update()}
+        mappings = []
+        for line_no, info in updates:
+            product = existing.get(info.id)
+            if product is None:
+                errors.append({"line": line_no, "msg": f"商品({info.id})不存在!"})
+                continue
+            if product.merchant_id != merchant_id:
+                errors.append({"line": line_no, "msg": "不允许修改他人账户下的商品!"})
+                continue
+            mapping = {
+                "id": info.id,
+                "product_name": info.product_name,
+                "product_tag": info.product_tag,
+                "product_cover": info.product_cover,
+                "product_desc": info.product_desc,
+                "detail_pictures": json.dumps(info.detail_pictures),
+                "has_stock_limit": info.has_stock_limit,
+                "remain_stock": info.remain_stock,
+                "price": info.price,
+                "update_time": now
+            }
+            mappings.append(mapping)
+            imported.append({"line": line_no, "product_id": info.id})
+            stocks[info.id] = (product.remain_stock if product.has_stock_limit == 1 else None,
+                               info.remain_stock if info.has_stock_limit == 1 else None)
+        # executemany UPDATE
+        session.bulk_update_mappings(Product, mappings)
+
+    inserts = [(line_no, info) for line_no, info in batch if info.id is None]
+    if inserts:
+        products = [Product(merchant_id, info.product_name, info.product_tag, info.product_cover, info.product_desc,
+                            json.dumps(info.detail_pictures), info.has_stock_limit, info.remain_stock, info.price,
+                            now, now) for _, info in inserts]
+        # 逐行取得自增id(lastrowid), 不依赖按商户及创建时间回查, 同一商户并发导入不会串号
+        session.add_all(products)
+        session.flush()
+        for (line_no, info), product in zip(inserts, products):
+            imported.append({"line": line_no, "product_id": product.id})
+            stocks[product.id] = (None, info.remain_stock if info.has_stock_limit == 1 else None)
+
+    outbox_util.record_products(session, [item["product_id"] for item in imported])
+    session.commit()
+    stock_util.adjust_stocks(stocks)
+    imported.sort(key=lambda item: item["line"])
+    return imported, errors
+
+
+def load_own_products(session, merchant_id, product_ids):
+    """
+    查询商户自己的商品
+    :return: (商品列表, 错误列表[{"product_id": 商品id, "msg": 错误信息}])
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    existing = {product.id: product for product in session.query(Product).filter(Product.id.in_(product_ids))}
+    products = []
+    errors = []
+    for product_id in product_ids:
+        product = existing.get(product_id)
+        if product is None:
+            errors.append({"product_id": product_id, "msg": "商品不存在!"})
+        elif product.merchant_id != merchant_id:
+            errors.append({"product_id": product_id, "msg": "仅能操作自己商户下的商品!"})
+        else:
+            products.append(product)
+    return products, errors
+
+
+def set_products_status(session, merchant_id, product_ids, status):
+    """
+    批量上下架商品并提交
+    :param status: 0: 上架, 1: 下架
+    :return: (成功的商品id列表, 错误列表)
+    """
+    products, errors = load_own_products(session, merchant_id, product_ids)
+    ids = [product.id for product in products]
+    now = datetime.now()
+    if ids:
+        session.query(Product).filter(Product.id.in_(ids)).update({
+            Product.status: status,
+            Product.update_time: now
+        }, synchronize_session=False)
+    outbox_util.record_products(session, ids)
+    session.commit()
+    return ids, errors
+
+
+def delete_products(session, merchant_id, product_ids):
+    """
+    批量删除商品并提交
+    :return: (成功的商品id列表, 错误列表)
+    """
+    products, errors = load_own_products(session, merchant_id, product_ids)
+    ids = [product.id for product in products]
+    if ids:
+        session.query(Product).filter(Product.id.in_(ids)).delete(synchronize_session=False)
+    outbox_util.record_products(session, ids)
+    session.commit()
+    stock_util.drop_stocks(ids)
+    return ids, errors
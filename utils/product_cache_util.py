@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+商品缓存工具类: 统一维护redis中的商品信息、商户商品集合(products_of_merchant_{商户id})、商户商品索引、搜索索引及分面计数,
+批量写入时一批商品只执行一次redis事务pipeline(MULTI/EXEC), 缓存、索引与计数同时生效
+
+商品信息支持两种存储结构, 由product_cache_config["layout"]切换:
+    json: 全部商品以JSON串存放在products哈希中(旧结构), 修改单个字段需读出、解析、整体回写
+    hash: 每个商品一个哈希product_{商品id}, 字段可单独读写, 读取时只取需要的字段
+    dual: 迁移期间同时写两种结构, 优先读hash结构, 未命中时读json结构并回填hash结构
+"""
+import json
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+
+from config import product_cache_config
+from utils.json_encoder import JsonEncoder
+from utils import product_index_util, product_search_util, product_facet_util
+from utils.redis_util import redis_client, async_redis_client
+
+# hash结构中非字符串字段的类型, 其余字段按字符串读取
+FIELD_TYPES = {
+    "id": int,
+    "merchant_id": int,
+    "has_stock_limit": int,
+    "init_stock": int,
+    "remain_stock": int,
+    "price": float,
+    "status": int
+}
+
+# 仅在商品哈希存在时更新字段, 避免为已删除的商品写入残缺数据
+UPDATE_FIELDS_SCRIPT = redis_client.register_script("""
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('hset', KEYS[1], unpack(ARGV))
+end
+return -1
+""")
+
+# KEYS: 商品哈希key, json结构哈希key(products)
+# ARGV: 商品id, 读取到的json串, 字段及值...
+# json结构中仍是读取到的同一份数据且hash结构不存在时才回填, 避免并发删除或更新后用读到的旧数据重建商品
+BACKFILL_SCRIPT = redis_client.register_script("""
+if redis.call('hget', KEYS[2], ARGV[1]) ~= ARGV[2] or redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('hset', KEYS[1], unpack(ARGV, 3))
+return 1
+""")
+
+
+def product_key(product_id):
+    return f"product_{product_id}"
+
+
+def write_json():
+    return product_cache_config["layout"] in ("json", "dual")
+
+
+def write_hash():
+    return product_cache_config["layout"] in ("hash", "dual")
+
+
+def encode_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, datetime):
+        # 与json结构(JsonEncoder)的时间格式保持一致
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return json.dumps(value, cls=JsonEncoder)
+
+
+def encode_hash(product):
+    """
+    将商品信息编码为hash结构字段, None存为空串
+    """
+    return {field: encode_value(value) for field, value in product.items()}
+
+
+def decode_hash(values):
+    """
+    :param values: {字段: 字符串值}
+    """
+    product = {}
+    for field, value in values.items():
+        field_type = FIELD_TYPES.get(field)
+        if field_type is None or value is None:
+            product[field] = value
+        else:
+            product[field] = None if value == "" else field_type(value)
+    return product
+
+
+def queue_save(pipe, products, old_products, with_facets=True):
+    if write_json():
+        pipe.hset("products", mapping={product["id"]: json.dumps(product, cls=JsonEncoder) for product in products})
+    if write_hash():
+        for product in products:
+            pipe.hset(product_key(product["id"]), mapping=encode_hash(product))
+    merchant_products = {}
+    for product in products:
+        merchant_products.setdefault(product["merchant_id"], []).append(product["id"])
+        product_index_util.queue_index(pipe, product, old_products.get(product["id"]))
+        product_search_util.queue_index(pipe, product, old_products.get(product["id"]))
+        if with_facets:
+            product_facet_util.queue_facets(pipe, product, old_products.get(product["id"]))
+    for merchant_id, product_ids in merchant_products.items():
+        pipe.sadd(f"products_of_merchant_{merchant_id}", *product_ids)
+
+
+def save_products(products, old_products=None):
+    """
+    写入/更新商品缓存及商户商品索引
+    :param products: 商品信息列表(Product.to_dict())
+    :param old_products: 修改商品时传入变更前的商品信息 {商品id: 商品信息}
+    """
+    if not products:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    queue_save(pipe, products, old_products or {})
+    pipe.execute()
+
+
+def fill_products(products):
+    """
+    重建缓存时批量写入商品缓存及索引(不使用事务, 不更新分面计数, 分面计数重建完成后按数据库统一校正)
+    :param products: 商品信息列表
+    """
+    if not products:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    queue_save(pipe, products, {}, with_facets=False)
+    pipe.execute()
+
+
+def update_products(products, values):
+    """
+    更新商品的部分字段, hash结构只写变更字段, json结构需整体回写
+    :param products: 变更前的商品信息列表
+    :param values: {字段: 新值}
+    """
+    if not products:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    if write_json():
+        pipe.hset("products", mapping={product["id"]: json.dumps(dict(product, **values), cls=JsonEncoder)
+                                       for product in products})
+    if write_hash():
+        args = []
+        for field, value in encode_hash(values).items():
+            args.extend((field, value))
+        for product in products:
+            UPDATE_FIELDS_SCRIPT(keys=[product_key(product["id"])], args=args, client=pipe)
+    for product in products:
+        product_index_util.queue_index(pipe, dict(product, **values), product)
+        product_search_util.queue_index(pipe, dict(product, **values), product)
+        product_facet_util.queue_facets(pipe, dict(product, **values), product)
+    pipe.execute()
+
+
+def remove_products(products):
+    """
+    删除商品缓存及商户商品索引
+    :param products: 商品信息列表
+    """
+    if not products:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hdel("products", *[product["id"] for product in products])
+    pipe.delete(*[product_key(product["id"]) for product in products])
+    for product in products:
+        pipe.srem(f"products_of_merchant_{product['merchant_id']}", product["id"])
+        product_index_util.queue_unindex(pipe, product)
+        product_search_util.queue_unindex(pipe, product)
+        product_facet_util.queue_unfacet(pipe, product)
+    pipe.execute()
+
+
+def queue_hash_reads(pipe, product_ids, fields):
+    for product_id in product_ids:
+        if fields is None:
+            pipe.hgetall(product_key(product_id))
+        else:
+            pipe.hmget(product_key(product_id), fields)
+
+
+def parse_hash_reads(values, fields):
+    """
+    :return: 商品信息列表, 不存在的商品为None
+    """
+    products = []
+    for value in values:
+        if fields is not None:
+            value = dict(zip(fields, value)) if value[0] is not None else {}
+        products.append(decode_hash(value) if value else None)
+    return products
+
+
+def pick_fields(product, fields):
+    return product if fields is None else {field: product.get(field) for field in fields}
+
+
+def get_products(product_ids, fields=None):
+    """
+    批量读取商品缓存, 一次pipeline读取hash结构(dual结构下未命中的再读取一次json结构)
+    :param product_ids: 商品id列表
+    :param fields: 需要的字段列表, 不传则读取全部字段
+    :return: 商品信息列表, 与product_ids一一对应, 不存在的商品为None
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    if fields is not None:
+        # 首个字段用于判断商品是否存在
+        fields = ["id"] + [field for field in fields if field != "id"]
+    if not write_hash():
+        return [None if value is None else pick_fields(json.loads(value), fields)
+                for value in redis_client.hmget("products", product_ids)]
+
+    pipe = redis_client.pipeline(transaction=False)
+    queue_hash_reads(pipe, product_ids, fields)
+    products = parse_hash_reads(pipe.execute(), fields)
+    if write_json():
+        products = fallback_json_reads(product_ids, products, fields)
+    return products
+
+
+def fallback_json_reads(product_ids, products, fields):
+    """
+    dual结构下hash结构未命中的商品从json结构读取, 并回填hash结构(json结构未变化时才回填)
+    """
+    missing = [i for i, product in enumerate(products) if product is None]
+    if not missing:
+        return products
+    values = redis_client.hmget("products", [product_ids[i] for i in missing])
+    backfill = []
+    for i, value in zip(missing, values):
+        if value is not None:
+            product = json.loads(value)
+            backfill.append((product_ids[i], value, product))
+            products[i] = pick_fields(product, fields)
+    if backfill:
+        pipe = redis_client.pipeline(transaction=False)
+        for product_id, value, product in backfill:
+            args = [product_id, value]
+            for field, field_value in encode_hash(product).items():
+                args.extend((field, field_value))
+            BACKFILL_SCRIPT(keys=[product_key(product["id"]), "products"], args=args, client=pipe)
+        pipe.execute()
+    return products
+
+
+async def get_products_async(product_ids, fields=None):
+    """
+    get_products的异步版本(使用异步redis客户端)
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    if fields is not None:
+        fields = ["id"] + [field for field in fields if field != "id"]
+    if not write_hash():
+        return [None if value is None else pick_fields(json.loads(value), fields)
+                for value in await async_redis_client.hmget("products", product_ids)]
+
+    pipe = async_redis_client.pipeline(transaction=False)
+    queue_hash_reads(pipe, product_ids, fields)
+    products = parse_hash_reads(await pipe.execute(), fields)
+    if write_json() and None in products:
+        missing = [i for i, product in enumerate(products) if product is None]
+        values = await async_redis_client.hmget("products", [product_ids[i] for i in missing])
+        for i, value in zip(missing, values):
+            if value is not None:
+                products[i] = pick_fields(json.loads(value), fields)
+    return products
+
+
+def rebuild_merchant_index(merchant_id):
+    """
+    根据商户商品集合及商品缓存重建商户商品索引(索引未重建过时调用), 完成后写入已重建标记
+    :return: 商品数
+    """
+    products = [product for product in get_products(redis_client.smembers(f"products_of_merchant_{merchant_id}"))
+                if product is not None]
+    for start in range(0, len(products), 500):
+        pipe = redis_client.pipeline(transaction=False)
+        for product in products[start: start + 500]:
+            product_index_util.queue_index(pipe, product)
+        pipe.execute()
+    redis_client.set(product_index_util.built_key(merchant_id), 1)
+    return len(products)
+
+
+def list_merchant_products(merchant_id, sort_by="update_time", desc=True, status=None, tag=None,
+                           page_no=1, page_size=20):
+    """
+    分页查询商户商品
+    :return: (符合条件的商品总数, 当前页商品信息列表)
+    """
+    offset = (page_no - 1) * page_size
+    total, product_ids = product_index_util.query_product_ids(merchant_id, sort_by, desc, status, tag,
+                                                              offset, page_size)
+    if total == 0 and not redis_client.exists(product_index_util.built_key(merchant_id)):
+        # 索引尚未重建(如首次上线), 从商品缓存重建
+        if rebuild_merchant_index(merchant_id) == 0:
+            return 0, []
+        total, product_ids = product_index_util.query_product_ids(merchant_id, sort_by, desc, status, tag,
+                                                                  offset, page_size)
+    return total, [product for product in get_products(product_ids) if product is not None]
+
+
+async def list_merchant_products_async(merchant_id, sort_by="update_time", desc=True, status=None, tag=None,
+                                       page_no=1, page_size=20):
+    """
+    list_merchant_products的异步版本, 索引不存在时在线程池中重建
+    """
+    offset = (page_no - 1) * page_size
+    total, product_ids = await product_index_util.query_product_ids_async(merchant_id, sort_by, desc, status, tag,
+                                                                          offset, page_size)
+    if total == 0 and not await async_redis_client.exists(product_index_util.built_key(merchant_id)):
+        if await run_in_threadpool(rebuild_merchant_index, merchant_id) == 0:
+            return 0, []
+        total, product_ids = await product_index_util.query_product_ids_async(merchant_id, sort_by, desc, status,
+                                                                              tag, offset, page_size)
+    return total, [product for product in await get_products_async(product_ids) if product is not None]
+
+
+def iter_cached_products(batch_size=500):
+    """
+    分批遍历全部商品缓存
+    :return: 生成器, 每次返回一批商品信息
+    """
+    if write_json():
+        cursor = 0
+        while True:
+            cursor, values = redis_client.hscan("products", cursor, count=batch_size)
+            if values:
+                yield [json.loads(value) for value in values.values()]
+            if cursor == 0:
+                return
+    else:
+        product_ids = []
+        for key in redis_client.scan_iter(match="product_[0-9]*", count=batch_size):
+            product_id = key[len("product_"):]
+            if product_id.isdigit():
+                product_ids.append(product_id)
+            if len(product_ids) >= batch_size:
+                yield [product for product in get_products(product_ids) if product is not None]
+                product_ids = []
+        if product_ids:
+            yield [product for product in get_products(product_ids) if product is not None]
+
+
+def reindex_products():
+    """
+    根据商品缓存重建全部商品的商户商品索引及搜索索引
+    :return: 商品数
+    """
+    count = 0
+    for products in iter_cached_products():
+        pipe = redis_client.pipeline(transaction=False)
+        for product in products:
+            product_index_util.queue_index(pipe, product)
+            product_search_util.queue_index(pipe, product)
+        pipe.execute()
+        count += len(products)
+    redis_client.set(product_search_util.INDEX_BUILT_KEY, count)
+    return count
+
+
+def migrate_to_hash_layout(batch_size=500):
+    """
+    将json结构的商品缓存全部复制为hash结构(切换到dual结构后执行一次, 完成后即可切换到hash结构)
+    :return: 迁移的商品数
+    """
+    count = 0
+    cursor = 0
+    while True:
+        cursor, values = redis_client.hscan("products", cursor, count=batch_size)
+        if values:
+            pipe = redis_client.pipeline(transaction=False)
+            for value in values.values():
+                product = json.loads(value)
+                pipe.hset(product_key(product["id"]), mapping=encode_hash(product))
+            pipe.execute()
+            count += len(values)
+        if cursor == 0:
+            return count
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+商品分面计数工具类: 按标签、商户×标签、商品状态维护商品数量(redis哈希),
+    product_facet_tag: {标签: 商品数}
+    product_facet_tag_{商户id}: {标签: 商品数}
+    product_facet_status: {状态: 商品数}
+计数随商品新增、修改标签、上下架、删除在商品缓存的同一个事务pipeline中增量更新,
+定时任务按数据库GROUP BY结果整体重写, 修正其他服务写库或进程异常造成的偏差
+    重写期间持有缓存投影锁, 且只在没有待投影事件时重写, 避免投影线程同时增量更新或重写后重复计入已统计的变更
+"""
+from sqlalchemy import func
+
+from config import cache_outbox_config
+from consts import ProductTags
+from utils import app_logger as logger, job_util
+from utils.redis_util import redis_client
+from utils.db_util import session_class
+from models.cache_outbox import CacheOutbox
+from models.product import Product
+
+TAG_KEY = "product_facet_tag"
+STATUS_KEY = "product_facet_status"
+# 缓存投影锁(outbox_util.LOCK_KEY)
+PROJECTOR_LOCK_KEY = "cache_outbox_lock"
+
+
+def merchant_tag_key(merchant_id):
+    return f"product_facet_tag_{merchant_id}"
+
+
+def queue_count(pipe, product, delta):
+    pipe.hincrby(TAG_KEY, product["product_tag"], delta)
+    pipe.hincrby(merchant_tag_key(product["merchant_id"]), product["product_tag"], delta)
+    pipe.hincrby(STATUS_KEY, product["status"], delta)
+
+
+def queue_facets(pipe, product, old_product=None):
+    """
+    在pipeline中加入更新分面计数的命令
+    :param product: 商品最新信息
+    :param old_product: 商品变更前信息(修改商品时传入, 标签、状态均未变化时不更新计数)
+    """
+    if old_product is not None:
+        if old_product.get("product_tag") == product["product_tag"] and old_product.get("status") == product["status"]:
+            return
+        queue_count(pipe, old_product, -1)
+    queue_count(pipe, product, 1)
+
+
+def queue_unfacet(pipe, product):
+    """
+    在pipeline中加入删除商品时扣减分面计数的命令
+    """
+    queue_count(pipe, product, -1)
+
+
+def merge_tags(counts):
+    """
+    :param counts: {标签: 商品数(字符串)}
+    :return: [{"tag": 标签, "count": 商品数}, ...], 预置标签在前, 其余有商品的标签按商品数倒序在后
+    """
+    counts = {tag: int(count) for tag, count in counts.items()}
+    tags = [{"tag": tag, "count": max(counts.pop(tag, 0), 0)} for tag in ProductTags]
+    tags.extend({"tag": tag, "count": count}
+                for tag, count in sorted(counts.items(), key=lambda item: -item[1]) if count > 0)
+    return tags
+
+
+def get_facets(merchant_id=None):
+    """
+    一次pipeline读取分面计数
+    :param merchant_id: 传入时标签计数只统计该商户的商品
+    :return: (标签计数列表, {状态: 商品数})
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(TAG_KEY if merchant_id is None else merchant_tag_key(merchant_id))
+    pipe.hgetall(STATUS_KEY)
+    tag_counts, status_counts = pipe.execute()
+    return merge_tags(tag_counts), {int(status): max(int(count), 0) for status, count in status_counts.items()}
+
+
+def reconcile_facets():
+    """
+    按数据库统计结果重写全部分面计数, 投影线程正在投影或有待投影事件时跳过本次校正
+    """
+    token = job_util.acquire_lock(PROJECTOR_LOCK_KEY, cache_outbox_config["lock_seconds"])
+    if token is None:
+        logger.info("缓存投影进行中, 跳过本次商品分面计数校正")
+        return
+    try:
+        session = session_class()
+        try:
+            # 与统计查询在同一个事务中读取, 没有待投影事件时统计结果与当前计数对应同一时刻的商品数据
+            pending = session.query(CacheOutbox.id).limit(1).first()
+            statistics = [] if pending else session.query(
+                Product.merchant_id, Product.product_tag, Product.status, func.count(Product.id)
+            ).group_by(Product.merchant_id, Product.product_tag, Product.status).all()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"商品分面计数校正失败: {repr(e)}")
+            return
+        finally:
+            session.close()
+        if pending:
+            logger.info("存在待投影事件, 跳过本次商品分面计数校正")
+            return
+        rewrite_facets(statistics)
+    finally:
+        job_util.release_lock(PROJECTOR_LOCK_KEY, token)
+
+
+def rewrite_facets(statistics):
+    """
+    :param statistics: [(商户id, 标签, 状态, 商品数), ...]
+    """
+    tag_counts, status_counts, merchant_tag_counts = {}, {}, {}
+    for merchant_id, tag, status, count in statistics:
+        tag_counts[tag] = tag_counts.get(tag, 0) + count
+        status_counts[status] = status_counts.get(status, 0) + count
+        merchant_counts = merchant_tag_counts.setdefault(merchant_tag_key(merchant_id), {})
+        merchant_counts[tag] = merchant_counts.get(tag, 0) + count
+
+    stale_keys = [key for key in redis_client.scan_iter(match=f"{TAG_KEY}_*", count=1000)
+                  if key not in merchant_tag_counts]
+    pipe = redis_client.pipeline(transaction=True)
+    if stale_keys:
+        pipe.delete(*stale_keys)
+    for key, counts in [(TAG_KEY, tag_counts), (STATUS_KEY, status_counts)] + list(merchant_tag_counts.items()):
+        pipe.delete(key)
+        if counts:
+            pipe.hset(key, mapping=counts)
+    pipe.execute()
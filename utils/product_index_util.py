@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+商户商品索引工具类: 每个商户维护按更新时间、价格、剩余库存排序的有序集合(product_sort_{商户id}_{字段}),
+及按商品状态、标签划分的集合(product_status_{商户id}_{状态}、product_tag_{商户id}_{标签}),
+分页查询时用ZINTERSTORE按条件过滤排序索引, 再ZRANGE取当前页, 耗时与商户商品总数无关
+
+过滤结果缓存在product_query_{商户id}_{条件}:{版本号}中, 商户商品索引每次变更都会递增版本号
+(product_index_version_{商户id}), 缓存随版本号变化自然失效; 版本号由调用方先读取, 过滤结果key与其他key一样通过KEYS传入脚本
+"""
+from datetime import datetime
+
+from config import product_index_config
+from utils.redis_util import redis_client, async_redis_client
+
+SORT_FIELDS = ("update_time", "price", "remain_stock")
+
+# KEYS: 排序索引key[, 过滤集合key..., 过滤结果key(含版本号)], 不过滤时只传排序索引key
+# ARGV: 起始下标, 结束下标, 是否倒序, 过滤结果缓存时间
+QUERY_SCRIPT = """
+local source = KEYS[1]
+if #KEYS > 1 then
+    source = KEYS[#KEYS]
+    if redis.call('exists', source) == 0 then
+        local args = {'zinterstore', source, #KEYS - 1}
+        for i = 1, #KEYS - 1 do
+            args[#args + 1] = KEYS[i]
+        end
+        args[#args + 1] = 'weights'
+        args[#args + 1] = 1
+        for i = 2, #KEYS - 1 do
+            args[#args + 1] = 0
+        end
+        redis.call(unpack(args))
+        redis.call('expire', source, ARGV[4])
+    end
+end
+local ids
+if ARGV[3] == '1' then
+    ids = redis.call('zrevrange', source, ARGV[1], ARGV[2])
+else
+    ids = redis.call('zrange', source, ARGV[1], ARGV[2])
+end
+return {redis.call('zcard', source), ids}
+"""
+query_script = redis_client.register_script(QUERY_SCRIPT)
+async_query_script = async_redis_client.register_script(QUERY_SCRIPT) if async_redis_client is not None else None
+
+
+def sort_key(merchant_id, field):
+    return f"product_sort_{merchant_id}_{field}"
+
+
+def status_key(merchant_id, status):
+    return f"product_status_{merchant_id}_{status}"
+
+
+def tag_key(merchant_id, tag):
+    return f"product_tag_{merchant_id}_{tag}"
+
+
+def version_key(merchant_id):
+    return f"product_index_version_{merchant_id}"
+
+
+def built_key(merchant_id):
+    """
+    商户商品索引已按商品缓存完整重建的标记, 不以排序索引是否存在判断(投影线程可能已写入部分商品)
+    """
+    return f"product_index_built_{merchant_id}"
+
+
+def sort_score(product, field):
+    value = product.get(field)
+    if value is None:
+        return 0
+    if field == "update_time":
+        if isinstance(value, str):
+            value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        return value.timestamp()
+    return float(value)
+
+
+def queue_index(pipe, product, old_product=None):
+    """
+    在pipeline中加入更新商品索引的命令
+    :param product: 商品最新信息
+    :param old_product: 商品变更前信息(修改商品时传入, 用于从原状态、原标签集合中移除)
+    """
+    merchant_id = product["merchant_id"]
+    product_id = product["id"]
+    for field in SORT_FIELDS:
+        pipe.zadd(sort_key(merchant_id, field), {product_id: sort_score(product, field)})
+    if old_product is not None:
+        if old_product.get("status") != product["status"]:
+            pipe.srem(status_key(merchant_id, old_product.get("status")), product_id)
+        if old_product.get("product_tag") != product["product_tag"]:
+            pipe.srem(tag_key(merchant_id, old_product.get("product_tag")), product_id)
+    pipe.sadd(status_key(merchant_id, product["status"]), product_id)
+    pipe.sadd(tag_key(merchant_id, product["product_tag"]), product_id)
+    pipe.incr(version_key(merchant_id))
+
+
+def queue_unindex(pipe, product):
+    """
+    在pipeline中加入删除商品索引的命令
+    """
+    merchant_id = product["merchant_id"]
+    product_id = product["id"]
+    for field in SORT_FIELDS:
+        pipe.zrem(sort_key(merchant_id, field), product_id)
+    pipe.srem(status_key(merchant_id, product["status"]), product_id)
+    pipe.srem(tag_key(merchant_id, product["product_tag"]), product_id)
+    pipe.incr(version_key(merchant_id))
+
+
+def filter_keys(merchant_id, status, tag):
+    keys = []
+    if status is not None:
+        keys.append(status_key(merchant_id, status))
+    if tag is not None:
+        keys.append(tag_key(merchant_id, tag))
+    return keys
+
+
+def query_args(merchant_id, sort_by, desc, status, tag, offset, count, version=None):
+    """
+    :param version: 商户商品索引版本号(有过滤条件时由调用方先读取, 过滤结果key随版本号变化)
+    :return: (脚本KEYS, 脚本ARGV), 脚本访问的key全部通过KEYS传入
+    """
+    keys = [sort_key(merchant_id, sort_by)] + filter_keys(merchant_id, status, tag)
+    if len(keys) > 1:
+        keys.append(f"product_query_{merchant_id}_{sort_by}_{'' if status is None else status}_{tag or ''}:"
+                    f"{version or '0'}")
+    args = [offset, offset + count - 1, 1 if desc else 0, product_index_config["query_cache_seconds"]]
+    return keys, args
+
+
+def query_product_ids(merchant_id, sort_by="update_time", desc=True, status=None, tag=None, offset=0, count=20):
+    """
+    按条件分页查询商户商品id
+    :param sort_by: 排序字段, update_time/price/remain_stock
+    :param desc: 是否倒序
+    :param status: 商品状态, 不传则不过滤
+    :param tag: 商品标签, 不传则不过滤
+    :return: (符合条件的商品总数, 当前页商品id列表)
+    """
+    version = redis_client.get(version_key(merchant_id)) if filter_keys(merchant_id, status, tag) else None
+    keys, args = query_args(merchant_id, sort_by, desc, status, tag, offset, count, version)
+    total, product_ids = query_script(keys=keys, args=args)
+    return total, [int(product_id) for product_id in product_ids]
+
+
+async def query_product_ids_async(merchant_id, sort_by="update_time", desc=True, status=None, tag=None,
+                                  offset=0, count=20):
+    """
+    query_product_ids的异步版本(使用异步redis客户端)
+    """
+    version = await async_redis_client.get(version_key(merchant_id)) if filter_keys(merchant_id, status, tag) else None
+    keys, args = query_args(merchant_id, sort_by, desc, status, tag, offset, count, version)
+    total, product_ids = await async_query_script(keys=keys, args=args)
+    return total, [int(product_id) for product_id in product_ids]
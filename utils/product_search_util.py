@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+商品搜索工具类: 基于redis的商城全量商品倒排索引, 无需外部搜索服务
+    分词: 中文按单字及相邻二字(bigram)切分, 英文、数字按连续字母数字切分, 统一转小写
+    倒排索引: search_token_{词}为有序集合, 成员为商品id, 分值为该词在商品中的权重(名称3, 标签2, 简介1, 多字段累加)
+    过滤集合: search_tag_{标签}、search_status_{状态}为集合, search_price为按价格排序的有序集合,
+             按商户过滤直接使用商户商品集合products_of_merchant_{商户id}
+查询时按ZCARD找出最小的查询词索引, 按权重倒序最多扫描max_scan个商品, 逐个用ZSCORE/SISMEMBER校验其余查询词、
+过滤集合及价格区间(要求命中全部查询词), 按权重之和排序后写入查询结果缓存search_cache_{查询条件摘要}(有序集合,
+cache_seconds秒后过期), 同一查询翻页或重复查询直接读取缓存; 耗时与扫描上限有关, 与商品总数无关,
+最小的查询词索引超过扫描上限(如常见单字)时只在其权重最高的max_scan个商品中查找
+索引随商品新增、修改、上下架、删除增量更新
+"""
+import re
+import json
+import hashlib
+
+from config import product_search_config
+from utils.redis_util import redis_client
+
+# 各字段命中的权重
+FIELD_WEIGHTS = (("product_name", 3), ("product_tag", 2), ("product_desc", 1))
+CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+PRICE_KEY = "search_price"
+# 索引已全量建立的标记, 不存在时启动后台任务全量建立
+INDEX_BUILT_KEY = "search_index_built"
+
+# KEYS: 查询结果缓存key, 价格索引key, 查询词索引key..., 过滤集合key...
+# ARGV: 查询词数量, 最低价格, 最高价格, 起始下标, 结束下标, 扫描上限, 缓存时间(秒)
+# 返回: {命中商品总数, [商品id, 相关度]...}
+SEARCH_SCRIPT = redis_client.register_script("""
+local cache = KEYS[1]
+if redis.call('exists', cache) == 0 then
+    local first = 3
+    local last = 2 + tonumber(ARGV[1])
+    local min_price = tonumber(ARGV[2])
+    local max_price = tonumber(ARGV[3])
+    local smallest, smallest_size = first, -1
+    for i = first, last do
+        local size = redis.call('zcard', KEYS[i])
+        if smallest_size < 0 or size < smallest_size then
+            smallest, smallest_size = i, size
+        end
+    end
+    local members = {}
+    if smallest_size > 0 then
+        members = redis.call('zrevrange', KEYS[smallest], 0, tonumber(ARGV[6]) - 1, 'withscores')
+    end
+    local matched = {}
+    for j = 1, #members, 2 do
+        local product_id = members[j]
+        local score = tonumber(members[j + 1])
+        local ok = true
+        for i = first, last do
+            if i ~= smallest then
+                local token_score = redis.call('zscore', KEYS[i], product_id)
+                if not token_score then
+                    ok = false
+                    break
+                end
+                score = score + tonumber(token_score)
+            end
+        end
+        if ok then
+            for i = last + 1, #KEYS do
+                if redis.call('sismember', KEYS[i], product_id) == 0 then
+                    ok = false
+                    break
+                end
+            end
+        end
+        if ok and (min_price or max_price) then
+            local price = tonumber(redis.call('zscore', KEYS[2], product_id))
+            ok = price ~= nil and (not min_price or price >= min_price) and (not max_price or price <= max_price)
+        end
+        if ok then
+            matched[#matched + 1] = score
+            matched[#matched + 1] = product_id
+        end
+    end
+    for j = 1, #matched, 1000 do
+        redis.call('zadd', cache, unpack(matched, j, math.min(j + 999, #matched)))
+    end
+    if #matched == 0 then
+        return {0, {}}
+    end
+    redis.call('expire', cache, ARGV[7])
+end
+return {redis.call('zcard', cache), redis.call('zrevrange', cache, ARGV[4], ARGV[5], 'withscores')}
+""")
+
+
+def token_key(token):
+    return f"search_token_{token}"
+
+
+def tag_key(tag):
+    return f"search_tag_{tag}"
+
+
+def status_key(status):
+    return f"search_status_{status}"
+
+
+def tokenize(text, for_query=False):
+    """
+    分词
+    :param for_query: 是否为查询分词, 查询时两字及以上的中文只取bigram, 单字才取单字
+    :return: 词列表(去重, 保持顺序)
+    """
+    tokens = []
+    for run in CJK_PATTERN.findall((text or "").lower()):
+        if not run[0].isascii():
+            if len(run) == 1 or not for_query:
+                tokens.extend(run)
+            tokens.extend(run[i: i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return list(dict.fromkeys(tokens))
+
+
+def doc_tokens(product):
+    """
+    :return: {词: 权重}
+    """
+    scores = {}
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(product.get(field)):
+            scores[token] = scores.get(token, 0) + weight
+    return scores
+
+
+def queue_index(pipe, product, old_product=None):
+    """
+    在pipeline中加入更新商品搜索索引的命令
+    :param product: 商品最新信息
+    :param old_product: 商品变更前信息(修改商品时传入, 只更新有变化的词及过滤集合)
+    """
+    product_id = product["id"]
+    new_tokens = doc_tokens(product)
+    if old_product is None:
+        old_tokens = {}
+    elif all(old_product.get(field) == product.get(field) for field, _ in FIELD_WEIGHTS):
+        old_tokens = new_tokens
+    else:
+        old_tokens = doc_tokens(old_product)
+    for token in old_tokens.keys() - new_tokens.keys():
+        pipe.zrem(token_key(token), product_id)
+    for token, score in new_tokens.items():
+        if old_tokens.get(token) != score:
+            pipe.zadd(token_key(token), {product_id: score})
+
+    if old_product is not None:
+        if old_product.get("product_tag") != product["product_tag"]:
+            pipe.srem(tag_key(old_product.get("product_tag")), product_id)
+        if old_product.get("status") != product["status"]:
+            pipe.srem(status_key(old_product.get("status")), product_id)
+    pipe.sadd(tag_key(product["product_tag"]), product_id)
+    pipe.sadd(status_key(product["status"]), product_id)
+    pipe.zadd(PRICE_KEY, {product_id: product["price"]})
+
+
+def queue_unindex(pipe, product):
+    """
+    在pipeline中加入删除商品搜索索引的命令
+    """
+    product_id = product["id"]
+    for token in doc_tokens(product):
+        pipe.zrem(token_key(token), product_id)
+    pipe.srem(tag_key(product["product_tag"]), product_id)
+    pipe.srem(status_key(product["status"]), product_id)
+    pipe.zrem(PRICE_KEY, product_id)
+
+
+def search(keyword, tag=None, merchant_id=None, status=None, min_price=None, max_price=None, offset=0, count=20):
+    """
+    搜索商品
+    :param keyword: 搜索关键词, 须命中全部查询词
+    :return: (命中商品总数, [(商品id, 相关度), ...]按相关度倒序)
+    """
+    tokens = tokenize(keyword, for_query=True)[:product_search_config["max_query_tokens"]]
+    if not tokens:
+        return 0, []
+    filter_keys = []
+    if tag is not None:
+        filter_keys.append(tag_key(tag))
+    if status is not None:
+        filter_keys.append(status_key(status))
+    if merchant_id is not None:
+        filter_keys.append(f"products_of_merchant_{merchant_id}")
+    digest = hashlib.md5(json.dumps([tokens, filter_keys, min_price, max_price],
+                                    ensure_ascii=False).encode("utf-8")).hexdigest()
+    keys = [f"search_cache_{digest}", PRICE_KEY] + [token_key(token) for token in tokens] + filter_keys
+    args = [len(tokens), "" if min_price is None else min_price, "" if max_price is None else max_price,
+            offset, offset + count - 1, product_search_config["max_scan"], product_search_config["cache_seconds"]]
+    total, values = SEARCH_SCRIPT(keys=keys, args=args)
+    return total, [(int(values[i]), float(values[i + 1])) for i in range(0, len(values), 2)]
@@ -1,7 +1,49 @@
 # -*- coding: utf-8 -*-
+import time
 import redis
-from config import redis_config
+from redis.client import Pipeline
+from config import redis_config, async_config
+from utils import metrics_util
+
+
+class InstrumentedPipeline(Pipeline):
+    """
+    统计pipeline命令数及耗时(一次execute计一次网络往返)
+    """
+    def execute(self, raise_on_error=True):
+        command_count = len(self.command_stack)
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            metrics_util.observe_redis(command_count, time.perf_counter() - start)
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    统计redis命令数及耗时
+    """
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            metrics_util.observe_redis(1, time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
 
 pool = redis.ConnectionPool(host=redis_config["host"], port=redis_config["port"], encoding='utf-8',
                             decode_responses=True)
-redis_client = redis.Redis(connection_pool=pool, password=redis_config["passwd"])
+redis_client = InstrumentedRedis(connection_pool=pool, password=redis_config["passwd"])
+
+# 异步模式下的redis连接池(redis.asyncio), 未开启异步模式时为None
+async_redis_client = None
+if async_config["enable"]:
+    from redis import asyncio as aioredis
+
+    async_pool = aioredis.ConnectionPool(host=redis_config["host"], port=redis_config["port"], encoding='utf-8',
+                                         decode_responses=True, password=redis_config["passwd"] or None,
+                                         max_connections=async_config["redis_max_connections"])
+    async_redis_client = aioredis.Redis(connection_pool=async_pool)
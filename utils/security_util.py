@@ -3,24 +3,122 @@
 安全校验工具类
 """
 import time
+import threading
 import jwt
 import starlette.status
 from datetime import datetime, timedelta
-from fastapi import Cookie, HTTPException
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from fastapi import Cookie, Depends, HTTPException
 from passlib.context import CryptContext
 
-from config import SECRET_KEY, ALGORITHM
+from config import SECRET_KEY, ALGORITHM, token_cache_config, password_hash_config
 from utils import app_logger as logger
+from utils.cache_util import LRUCache
+from utils import merchant_cache_util
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# 已校验通过的token缓存, token -> merchant_id
+token_cache = LRUCache(token_cache_config["max_size"])
+
+
+class PasswordHashBusyError(Exception):
+    """
+    密码哈希进程池繁忙(排队已满或排队超时)
+    """
+    def __init__(self):
+        super().__init__("系统繁忙, 请稍后重试!")
+
+
+# bcrypt计算放到独立进程池执行, 避免登录高峰占满处理其他接口的线程池
+_hash_executor = None
+_hash_executor_lock = threading.Lock()
+# 进程池容量 = 执行中 + 排队中, 满了直接拒绝, 等待中的请求各占用一个同步接口线程, 容量须远小于线程池大小
+_hash_slots = threading.BoundedSemaphore(password_hash_config["workers"] + password_hash_config["queue_size"])
+_hash_stats_lock = threading.Lock()
+hash_stats = {
+    "queue_depth": 0,       # 当前进程池中执行中+排队中的任务数(含等待已超时的任务)
+    "calls": 0,             # 完成的哈希计算次数
+    "rejected": 0,          # 被快速失败的请求数
+    "latency_ms_sum": 0.0,  # 请求总耗时(排队+计算)累计
+    "latency_ms_max": 0.0,
+    "compute_ms_sum": 0.0   # 进程内实际计算耗时累计
+}
+
+
+def _get_hash_executor():
+    global _hash_executor
+    if _hash_executor is None:
+        with _hash_executor_lock:
+            if _hash_executor is None:
+                _hash_executor = ProcessPoolExecutor(max_workers=password_hash_config["workers"])
+    return _hash_executor
+
+
+def shutdown_hash_executor():
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False)
+
+
+def _hash_task(method, args, enqueue_time, queue_timeout):
+    """
+    在哈希进程中执行, 排队超时的任务直接丢弃
+    :return: (是否被丢弃, 计算结果, 计算耗时ms)
+    """
+    start = time.time()
+    if start - enqueue_time > queue_timeout:
+        return True, None, 0
+    result = getattr(pwd_context, method)(*args)
+    return False, result, 1000 * (time.time() - start)
+
+
+def _release_hash_slot(future=None):
+    _hash_slots.release()
+    with _hash_stats_lock:
+        hash_stats["queue_depth"] -= 1
+
+
+def _run_hash(method, *args):
+    if not _hash_slots.acquire(blocking=False):
+        with _hash_stats_lock:
+            hash_stats["rejected"] += 1
+        raise PasswordHashBusyError()
+    start = time.time()
+    with _hash_stats_lock:
+        hash_stats["queue_depth"] += 1
+    try:
+        future = _get_hash_executor().submit(_hash_task, method, args, start, password_hash_config["queue_timeout"])
+    except Exception:
+        _release_hash_slot()
+        raise
+    # 任务在进程池中执行完(或被丢弃)时才释放名额, 等待超时不释放, 保证进程池实际占用不超过容量
+    future.add_done_callback(_release_hash_slot)
+    try:
+        shed, result, compute_ms = future.result(timeout=password_hash_config["timeout"])
+    except FutureTimeoutError:
+        logger.error("密码哈希计算超时!")
+        raise PasswordHashBusyError()
+    latency_ms = 1000 * (time.time() - start)
+    with _hash_stats_lock:
+        if shed:
+            hash_stats["rejected"] += 1
+        else:
+            hash_stats["calls"] += 1
+            hash_stats["latency_ms_sum"] += latency_ms
+            hash_stats["latency_ms_max"] = max(hash_stats["latency_ms_max"], latency_ms)
+            hash_stats["compute_ms_sum"] += compute_ms
+    if shed:
+        logger.warn(f"密码哈希排队超时, 已丢弃, 耗时: {latency_ms}ms")
+        raise PasswordHashBusyError()
+    return result
+
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return _run_hash("hash", password)
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return _run_hash("verify", plain_password, hashed_password)
 
 
 def create_access_token(*, data: dict, expires_delta: timedelta = None):
@@ -34,30 +132,49 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None):
     return encoded_jwt.decode()
 
 
-def verify_token(token):
-    token = token.encode()
-    credentials_exception = HTTPException(
-        status_code=starlette.status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def decode_token(token):
+    """
+    校验token签名并解析出商户id及过期时间
+    :return: (merchant_id, exp)
+    """
     payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     merchant_id: int = payload.get("merchant_id")
     if merchant_id is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=starlette.status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return merchant_id, payload.get("exp")
+
+
+def verify_token(token):
+    merchant_id, _ = decode_token(token)
     return merchant_id
 
 
-def get_login_merchant(x_token: str = Cookie(...)):
+def verify_token_cached(token):
     """
-    从token获取当前登录用户id
+    带缓存的token校验, 同一token在过期前只做一次签名校验
+    """
+    merchant_id = token_cache.get(token)
+    if merchant_id is not None:
+        return merchant_id
+    merchant_id, exp = decode_token(token)
+    token_cache.set(token, merchant_id, expire_at=exp)
+    return merchant_id
+
+
+async def get_login_merchant(x_token: str = Cookie(...)):
+    """
+    从token获取当前登录用户id(纯CPU计算, 定义为async在事件循环内执行, 不占用线程池)
     :param x_token:
     """
     # 校验登录token
     if x_token is None or x_token == "":
         raise HTTPException(status_code=401, detail="请先登录!")
     try:
-        cur_merchant_id = verify_token(x_token)
+        cur_merchant_id = verify_token_cached(x_token)
         return cur_merchant_id
     except jwt.ExpiredSignatureError as e:
         logger.error(str(e))
@@ -70,6 +187,18 @@ def get_login_merchant(x_token: str = Cookie(...)):
         raise HTTPException(status_code=401, detail="非法请求!")
 
 
+async def get_current_merchant(merchant_id: int = Depends(get_login_merchant)):
+    """
+    获取当前登录商户信息(同一请求内只解析一次, 热路径直接读取进程内缓存)
+    :param merchant_id:
+    :return: 商户信息dict
+    """
+    merchant = await merchant_cache_util.get_merchant(merchant_id)
+    if merchant is None:
+        raise HTTPException(status_code=403, detail="商户信息不存在, 请重新登录!")
+    return merchant
+
+
 if __name__ == "__main__":
     access_token_expires = timedelta(seconds=3)
     access_token = create_access_token(
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+库存工具类: 有库存限制的商品在redis中维护实时可售库存(stock_{商品id}), 下单时通过lua脚本原子地预留/确认/释放
+整个购物车的库存, 不读写数据库, 不锁t_product_info
+    预留: 全部商品库存充足时才一起扣减, 预留明细存于stock_reservation_{预留id}, 到期时间存于stock_reservation_deadlines
+    确认: 删除预留, 将售出数量累加到待回写哈希stock_sold_pending
+    释放: 删除预留, 归还库存(取消下单或预留超时, 超时由定时任务释放)
+定时任务将待回写的售出数量按商品合并, 一个事务批量扣减数据库剩余库存, 并记录缓存变更事件刷新商品缓存
+    每批回写中的售出数量带有批次id, 与扣减库存在同一事务内写入t_stock_write_back, 已回写的批次重试时跳过
+商户修改剩余库存时按(新库存 - 原库存)调整实时库存, 不影响未结束的预留及尚未回写的售出数量
+"""
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, update
+
+from config import stock_config
+from utils import app_logger as logger, product_cache_util, outbox_util, job_util
+from utils.redis_util import redis_client
+from utils.db_util import session_class
+from models.product import Product
+from models.stock_write_back import StockWriteBack
+
+DEADLINES_KEY = "stock_reservation_deadlines"
+PENDING_KEY = "stock_sold_pending"
+# 回写中的售出数量, 回写失败时下次优先重试
+FLUSHING_KEY = "stock_sold_flushing"
+STOCK_KEY_PREFIX = "stock_"
+WRITE_BACK_LOCK_KEY = "stock_write_back_lock"
+BATCH_FIELD = "_batch"
+
+# KEYS: 预留key, 到期时间key, 库存key...
+# ARGV: 预留id, 到期时间, 商品id及数量(与库存key一一对应)...
+RESERVE_SCRIPT = redis_client.register_script("""
+if redis.call('exists', KEYS[1]) == 1 then
+    return {1, 0}
+end
+local n = #KEYS - 2
+for i = 1, n do
+    local stock = redis.call('get', KEYS[i + 2])
+    if not stock then
+        return {-1, i}
+    end
+    if tonumber(stock) < tonumber(ARGV[2 + 2 * i]) then
+        return {0, i}
+    end
+end
+for i = 1, n do
+    redis.call('decrby', KEYS[i + 2], ARGV[2 + 2 * i])
+    redis.call('hset', KEYS[1], ARGV[1 + 2 * i], ARGV[2 + 2 * i])
+end
+redis.call('hset', KEYS[1], '_deadline', ARGV[2])
+redis.call('zadd', KEYS[2], ARGV[2], ARGV[1])
+return {1, n}
+""")
+
+# KEYS: 预留key, 到期时间key, 待回写key
+# ARGV: 预留id, 当前时间
+COMMIT_SCRIPT = redis_client.register_script("""
+local items = redis.call('hgetall', KEYS[1])
+if #items == 0 then
+    return 0
+end
+local fields = {}
+for i = 1, #items, 2 do
+    fields[items[i]] = items[i + 1]
+end
+if tonumber(fields['_deadline']) < tonumber(ARGV[2]) then
+    return -1
+end
+for product_id, quantity in pairs(fields) do
+    if product_id ~= '_deadline' then
+        redis.call('hincrby', KEYS[3], product_id, quantity)
+    end
+end
+redis.call('del', KEYS[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+return 1
+""")
+
+# KEYS: 预留key, 到期时间key
+# ARGV: 预留id, 库存key前缀
+RELEASE_SCRIPT = redis_client.register_script("""
+local items = redis.call('hgetall', KEYS[1])
+for i = 1, #items, 2 do
+    if items[i] ~= '_deadline' then
+        redis.call('incrby', ARGV[2] .. items[i], items[i + 1])
+    end
+end
+redis.call('del', KEYS[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+return #items > 0 and 1 or 0
+""")
+
+# KEYS: 待回写key, 回写中key
+# ARGV: 新批次id
+TAKE_PENDING_SCRIPT = redis_client.register_script("""
+if redis.call('exists', KEYS[2]) == 0 then
+    if redis.call('exists', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('rename', KEYS[1], KEYS[2])
+end
+redis.call('hsetnx', KEYS[2], '_batch', ARGV[1])
+return redis.call('hgetall', KEYS[2])
+""")
+
+# KEYS: 回写中key
+# ARGV: 批次id
+FINISH_BATCH_SCRIPT = redis_client.register_script("""
+if redis.call('hget', KEYS[1], '_batch') == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+# KEYS: 待回写key, 回写中key
+# ARGV: 库存key前缀, 商品id, 原剩余库存, 新剩余库存...(无库存限制为空串)
+ADJUST_SCRIPT = redis_client.register_script("""
+for i = 2, #ARGV, 3 do
+    local product_id = ARGV[i]
+    local key = ARGV[1] .. product_id
+    local old, new = ARGV[i + 1], ARGV[i + 2]
+    if new == '' then
+        redis.call('del', key)
+    elseif old ~= '' and redis.call('exists', key) == 1 then
+        redis.call('incrby', key, tonumber(new) - tonumber(old))
+    else
+        -- 实时库存不存在时, 扣除尚未回写数据库的售出数量
+        local sold = tonumber(redis.call('hget', KEYS[1], product_id) or 0)
+            + tonumber(redis.call('hget', KEYS[2], product_id) or 0)
+        redis.call('set', key, tonumber(new) - sold)
+    end
+end
+return 1
+""")
+
+
+class StockError(Exception):
+    """
+    库存预留失败(商品不存在、已下架或库存不足)
+    """
+    def __init__(self, product_id, msg):
+        super().__init__(msg)
+        self.product_id = product_id
+
+
+def stock_key(product_id):
+    return f"{STOCK_KEY_PREFIX}{product_id}"
+
+
+def reservation_key(reservation_id):
+    return f"stock_reservation_{reservation_id}"
+
+
+def adjust_stocks(changes):
+    """
+    按剩余库存的变化量调整商品实时库存(新增、修改商品提交后调用), 未结束的预留及尚未回写的售出数量保持不变
+    :param changes: {商品id: (原剩余库存, 新剩余库存)}, 新增商品或原无库存限制时原剩余库存为None,
+                    新剩余库存为None表示商品无库存限制
+    """
+    if not changes:
+        return
+    args = [STOCK_KEY_PREFIX]
+    for product_id, (old_stock, new_stock) in changes.items():
+        args.extend((product_id, "" if old_stock is None else old_stock, "" if new_stock is None else new_stock))
+    ADJUST_SCRIPT(keys=[PENDING_KEY, FLUSHING_KEY], args=args)
+
+
+def drop_stocks(product_ids):
+    """
+    删除商品实时库存(删除商品提交后调用)
+    """
+    if product_ids:
+        redis_client.delete(*[stock_key(product_id) for product_id in product_ids])
+
+
+def init_stocks(product_ids):
+    """
+    从数据库初始化redis中尚不存在的商品库存(redis被清空或商品在本功能上线前创建)
+    """
+    session = session_class()
+    try:
+        rows = session.query(Product.id, Product.remain_stock).filter(
+            Product.id.in_(product_ids), Product.has_stock_limit == 1).all()
+        session.commit()
+    finally:
+        session.close()
+    pipe = redis_client.pipeline(transaction=False)
+    for product_id, remain_stock in rows:
+        pipe.set(stock_key(product_id), remain_stock or 0, nx=True)
+    pipe.execute()
+
+
+def get_stocks(product_ids):
+    """
+    :return: {商品id: 实时可售库存}, 无库存限制的商品不返回
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    values = redis_client.mget([stock_key(product_id) for product_id in product_ids])
+    missing = [product_id for product_id, value in zip(product_ids, values) if value is None]
+    if missing:
+        init_stocks(missing)
+        values = redis_client.mget([stock_key(product_id) for product_id in product_ids])
+    return {product_id: int(value) for product_id, value in zip(product_ids, values) if value is not None}
+
+
+def reserve(items, reservation_id=None):
+    """
+    预留购物车库存, 全部商品库存充足时才一起扣减, 同一预留id重复调用不会重复扣减
+    :param items: {商品id: 数量}
+    :param reservation_id: 预留id(如订单号), 不传则自动生成
+    :return: 预留id
+    :raise StockError: 商品不存在、已下架或库存不足
+    """
+    reservation_id = str(reservation_id or uuid.uuid4().hex)
+    product_ids = list(items.keys())
+    limited_ids = []
+    for product_id, product in zip(product_ids, product_cache_util.get_products(product_ids,
+                                                                                ["has_stock_limit", "status"])):
+        if product is None:
+            raise StockError(product_id, f"商品({product_id})不存在!")
+        if product["status"] != 0:
+            raise StockError(product_id, f"商品({product_id})已下架!")
+        if items[product_id] <= 0:
+            raise StockError(product_id, f"商品({product_id})购买数量必须大于0!")
+        if product["has_stock_limit"] == 1:
+            limited_ids.append(product_id)
+
+    keys = [reservation_key(reservation_id), DEADLINES_KEY] + [stock_key(product_id) for product_id in limited_ids]
+    args = [reservation_id, int(time.time()) + stock_config["reservation_seconds"]]
+    for product_id in limited_ids:
+        args.extend((product_id, items[product_id]))
+    for retry in range(2):
+        code, index = RESERVE_SCRIPT(keys=keys, args=args)
+        if code == 1:
+            return reservation_id
+        product_id = limited_ids[index - 1]
+        if code == 0:
+            raise StockError(product_id, f"商品({product_id})库存不足!")
+        # 库存尚未初始化, 从数据库初始化后重试一次
+        init_stocks(limited_ids)
+    raise StockError(product_id, f"商品({product_id})不存在!")
+
+
+def commit(reservation_id):
+    """
+    确认预留(下单成功), 售出数量稍后批量回写数据库
+    :return: 是否成功, 预留不存在或已超时(超时的预留会被释放)时返回False
+    """
+    code = COMMIT_SCRIPT(keys=[reservation_key(reservation_id), DEADLINES_KEY, PENDING_KEY],
+                         args=[reservation_id, int(time.time())])
+    if code == -1:
+        release(reservation_id)
+    return code == 1
+
+
+def release(reservation_id):
+    """
+    释放预留, 归还库存
+    :return: 是否释放了预留
+    """
+    return RELEASE_SCRIPT(keys=[reservation_key(reservation_id), DEADLINES_KEY],
+                          args=[reservation_id, STOCK_KEY_PREFIX]) == 1
+
+
+def release_expired():
+    """
+    释放已超时的预留(定时任务)
+    """
+    while True:
+        reservation_ids = redis_client.zrangebyscore(DEADLINES_KEY, "-inf", int(time.time()), start=0, num=500)
+        for reservation_id in reservation_ids:
+            release(reservation_id)
+        if len(reservation_ids) < 500:
+            return
+
+
+def write_back():
+    """
+    将售出数量合并后批量回写数据库剩余库存(定时任务), 一批只执行一个事务
+    回写全程持有带持有者标识的锁, 同一批次(批次id)只会扣减一次数据库库存
+    """
+    token = job_util.acquire_lock(WRITE_BACK_LOCK_KEY, stock_config["lock_seconds"])
+    if token is None:
+        return
+    try:
+        values = TAKE_PENDING_SCRIPT(keys=[PENDING_KEY, FLUSHING_KEY], args=[uuid.uuid4().hex])
+        if not values:
+            return
+        fields = {values[i]: values[i + 1] for i in range(0, len(values), 2)}
+        batch_id = fields.pop(BATCH_FIELD)
+        sold = {int(product_id): int(quantity) for product_id, quantity in fields.items() if int(quantity) != 0}
+
+        session = session_class()
+        try:
+            if session.query(StockWriteBack.batch_id).filter(StockWriteBack.batch_id == batch_id).first() is None:
+                if sold:
+                    table = Product.__table__
+                    stmt = update(table).where(table.c.id == bindparam("product_id")).values(
+                        remain_stock=table.c.remain_stock - bindparam("quantity"))
+                    session.execute(stmt, [{"product_id": product_id, "quantity": quantity}
+                                           for product_id, quantity in sold.items()])
+                    outbox_util.record_products(session, sold.keys())
+                now = datetime.now()
+                session.add(StockWriteBack(batch_id, len(sold), now))
+                session.query(StockWriteBack).filter(
+                    StockWriteBack.create_time < now - timedelta(days=stock_config["batch_retention_days"])
+                ).delete(synchronize_session=False)
+                logger.info(f"库存回写完成, 批次: {batch_id}, 商品数: {len(sold)}")
+            else:
+                logger.info(f"库存回写批次({batch_id})已回写, 跳过")
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        # 只删除本批次, 不会误删其他进程之后取出的新批次
+        FINISH_BATCH_SCRIPT(keys=[FLUSHING_KEY], args=[batch_id])
+    finally:
+        job_util.release_lock(WRITE_BACK_LOCK_KEY, token)